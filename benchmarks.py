@@ -0,0 +1,2353 @@
+'''
+Benchmarks for the scraping and analysis scripts.
+
+Nothing in here talks to boardgamegeek.com; the scrapers are pointed at
+the local stand-in server from bgg_stand_in.py instead.
+
+The database benchmarks drop and recreate tables, so they use their own
+database (BENCH_DATABASE) which has to be created first:
+
+$ createdb bggdb_bench
+
+Every benchmark can be run on its own from an interpreter, or all of them
+from the command line:
+
+$ python benchmarks.py
+'''
+
+import matplotlib
+matplotlib.use('Agg') # data_analysis imports pyplot, never show anything
+
+import csv
+import datetime
+import gc
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import psycopg2
+
+import bg_scraper
+import bgg_http
+import bgg_stand_in
+import collect_games
+import data_analysis
+import game_list
+import game_store
+import normalize_database
+import query_cache
+import query_executor
+import rating_history
+import snapshot
+
+BENCH_DATABASE = "dbname = 'bggdb_bench'"
+
+
+def bench_top_games_crawl(num_games=2000, latency=0.25, requests_per_second=4.,
+                          num_workers=4):
+    '''
+    Crawl the stand-in's browse pages with the sequential scraper and with
+    the concurrent one, both held to the same request rate.
+
+    num_games           : Number of games to crawl
+                          (Type: integer)
+
+    latency             : Seconds the stand-in takes to answer each page
+                          (Type: float)
+
+    requests_per_second : Rate limit given to both scrapers, the stand-in
+                          starts answering 429 above twice this rate
+                          (Type: float)
+
+    num_workers         : Threads used by the concurrent scraper
+                          (Type: integer)
+
+    Returns a dict of wall times in seconds
+    '''
+
+    out_dir = tempfile.mkdtemp()
+
+    times = {}
+
+    try:
+
+        with bgg_stand_in.StandInServer(latency=latency,
+                      max_requests_per_second=2*requests_per_second) as server:
+
+            sequential_csv = os.path.join(out_dir, 'sequential.csv')
+
+            start = time.time()
+
+            collect_games.scrape_list_of_top_games(num_games, sequential_csv,
+                                     base_url=server.game_list_page,
+                                     wait_time=1./requests_per_second)
+
+            times['sequential'] = time.time() - start
+
+            concurrent_csv = os.path.join(out_dir, 'concurrent.csv')
+
+            start = time.time()
+
+            collect_games.scrape_list_of_top_games_concurrent(num_games,
+                                     concurrent_csv,
+                                     num_workers=num_workers,
+                                     requests_per_second=requests_per_second,
+                                     base_url=server.game_list_page)
+
+            times['concurrent'] = time.time() - start
+
+            with open(sequential_csv) as f1, open(concurrent_csv) as f2:
+
+                identical = f1.read() == f2.read()
+
+            throttled = server.requests_throttled
+
+    finally:
+
+        shutil.rmtree(out_dir)
+
+    num_pages = (num_games + 99)//100
+
+    print '\nTop games crawl:', num_games, 'games,', num_pages, 'pages,',\
+          latency, 's latency,', requests_per_second, 'requests/s'
+
+    for mode in ('sequential', 'concurrent'):
+
+        print '  %-10s %7.2f s  %6.2f pages/s' % (mode, times[mode],
+                                                  num_pages/times[mode])
+
+    print '  Identical csv output:', identical
+
+    print '  Requests throttled by stand-in:', throttled
+
+    return times
+
+
+def bench_xmlapi_scrape(num_games=1000, chunk_size=100, latency=1.,
+                        requests_per_second=1., num_fetchers=2,
+                        db=BENCH_DATABASE):
+    '''
+    Scrape the stand-in's XML API into the boardgames table with
+    scrape_bg_stats() and with scrape_bg_stats_pipelined(), both held to
+    the same request rate.
+
+    num_games           : Number of games to scrape
+                          (Type: integer)
+
+    chunk_size          : Games per XML API request
+                          (Type: integer)
+
+    latency             : Seconds the stand-in takes to answer each request
+                          (Type: float)
+
+    requests_per_second : Rate limit given to both scrapers
+                          (Type: float)
+
+    num_fetchers        : Requests the pipelined scraper keeps in flight
+                          (Type: integer)
+
+    db                  : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    times = {}
+
+    with bgg_stand_in.StandInServer(latency=latency) as server:
+
+        _reset_boardgames_table(db)
+
+        start = time.time()
+
+        bg_scraper.scrape_bg_stats('BGG_GameList_tabbed.csv', chunk_size,
+                                   num_games, db, xmlapi=server.xmlapi,
+                                   wait_time=1./requests_per_second)
+
+        times['sequential'] = time.time() - start
+
+        sequential_rows = _dump_boardgames_table(db)
+
+        _reset_boardgames_table(db)
+
+        start = time.time()
+
+        bg_scraper.scrape_bg_stats_pipelined('BGG_GameList_tabbed.csv',
+                                   chunk_size, num_games, db,
+                                   num_fetchers=num_fetchers,
+                                   requests_per_second=requests_per_second,
+                                   xmlapi=server.xmlapi)
+
+        times['pipelined'] = time.time() - start
+
+        pipelined_rows = _dump_boardgames_table(db)
+
+    num_chunks = (num_games + chunk_size - 1)//chunk_size
+
+    print '\nXML API scrape:', num_games, 'games,', num_chunks, 'chunks,',\
+          latency, 's latency,', requests_per_second, 'requests/s'
+
+    for mode in ('sequential', 'pipelined'):
+
+        print '  %-10s %7.2f s  %7.1f games/s' % (mode, times[mode],
+                                                  num_games/times[mode])
+
+    print '  Identical boardgames table:', sequential_rows == pipelined_rows
+
+    return times
+
+
+def bench_xmlapi2_scrape(num_games=1000, latency=0.25, requests_per_second=2.,
+                         chunk_size=100, thing_chunk_size=20,
+                         db=BENCH_DATABASE):
+    '''
+    Fill boardgames the two pass way (crawl the browse pages, then
+    scrape_bg_stats() from the csv file) and the one pass way
+    (scrape_things() from XML API2), both held to the same request rate.
+
+    The stand-in's fixture games are turned off, so both ways should end
+    up with the same table apart from href.
+
+    num_games           : Number of games to scrape
+                          (Type: integer)
+
+    latency             : Seconds the stand-in takes to answer a request
+                          (Type: float)
+
+    requests_per_second : Rate limit given to the scrapers
+                          (Type: float)
+
+    chunk_size          : Games per legacy XML API request
+                          (Type: integer)
+
+    thing_chunk_size    : Games per XML API2 request (BGG allows 20)
+                          (Type: integer)
+
+    db                  : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    out_dir = tempfile.mkdtemp()
+
+    times = {}
+
+    requests_sent = {}
+
+    try:
+
+        with bgg_stand_in.StandInServer(latency=latency,
+                                        thing_fixture=None) as server:
+
+            _reset_boardgames_table(db)
+
+            csv_file_name = os.path.join(out_dir, 'games.csv')
+
+            start = time.time()
+
+            collect_games.scrape_list_of_top_games(num_games, csv_file_name,
+                                     base_url=server.game_list_page,
+                                     wait_time=1./requests_per_second)
+
+            bg_scraper.scrape_bg_stats(csv_file_name, chunk_size, num_games,
+                                       db, xmlapi=server.xmlapi,
+                                       wait_time=1./requests_per_second)
+
+            times['two pass'] = time.time() - start
+
+            requests_sent['two pass'] = server.requests_served
+
+            two_pass_rows = _dump_boardgames_table(db)
+
+            _reset_boardgames_table(db)
+
+            bg_ids = [game[2].split(u'/')[2]
+                      for game in server.games[:num_games]]
+
+            start = time.time()
+
+            bg_scraper.scrape_things(bg_ids, thing_chunk_size, db,
+                                     server.xmlapi2,
+                                     wait_time=1./requests_per_second)
+
+            times['one pass'] = time.time() - start
+
+            requests_sent['one pass'] = server.requests_served -\
+                                        requests_sent['two pass']
+
+            one_pass_rows = _dump_boardgames_table(db)
+
+    finally:
+
+        shutil.rmtree(out_dir)
+
+    href = bg_scraper.BOARDGAMES_COLUMNS.index('href')
+
+    def without_href(rows):
+
+        return [row[:href] + row[href+1:] for row in rows]
+
+    print '\nXML API2 scrape:', num_games, 'games,', latency, 's latency,',\
+          requests_per_second, 'requests/s'
+
+    for mode in ('two pass', 'one pass'):
+
+        print '  %-9s %7.2f s  %4d requests' % (mode, times[mode],
+                                                requests_sent[mode])
+
+    print '  Identical boardgames table (but href):',\
+          without_href(two_pass_rows) == without_href(one_pass_rows)
+
+    return times
+
+
+def bench_adaptive_chunks(num_games=5000, fixed_sizes=(50, 200), start_size=20,
+                          latency=0.2, latency_per_game=0.01,
+                          max_games_per_request=250, requests_per_second=2.,
+                          db=BENCH_DATABASE):
+    '''
+    Scrape the stand-in's XML API with scrape_bg_stats() using fixed chunk
+    sizes and using a bgg_http.ChunkSizer that starts at start_size.
+
+    The stand-in's responses get slower with every game asked for, and it
+    refuses requests for more than max_games_per_request games, so neither
+    small nor huge fixed chunks are the fastest. The chunk the adaptive
+    scrape loses while finding the limit is picked up by a resume=True
+    run, which is counted in its time.
+
+    num_games             : Number of games to scrape
+                            (Type: integer)
+
+    fixed_sizes           : Fixed chunk sizes to compare with
+                            (Type: tuple of integers)
+
+    start_size            : First chunk size of the adaptive scrape
+                            (Type: integer)
+
+    latency               : Seconds the stand-in takes to answer a request
+                            (Type: float)
+
+    latency_per_game      : Extra seconds per game in a request
+                            (Type: float)
+
+    max_games_per_request : Bigger requests get a 503
+                            (Type: integer)
+
+    requests_per_second   : Rate limit given to the scraper
+                            (Type: float)
+
+    db                    : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    times = {}
+
+    written = {}
+
+    summary = None
+
+    with bgg_stand_in.StandInServer(latency=latency,
+                        latency_per_game=latency_per_game,
+                        max_games_per_request=max_games_per_request) as server:
+
+        for chunk_size in list(fixed_sizes) + ['adaptive']:
+
+            if chunk_size == 'adaptive':
+
+                chunk_size = bgg_http.ChunkSizer(start_size)
+
+                mode = 'adaptive'
+
+            else:
+
+                mode = 'fixed ' + str(chunk_size)
+
+            _reset_boardgames_table(db)
+
+            start = time.time()
+
+            bg_scraper.scrape_bg_stats('BGG_GameList_tabbed.csv', chunk_size,
+                                       num_games, db, xmlapi=server.xmlapi,
+                                       wait_time=1./requests_per_second)
+
+            if mode == 'adaptive':
+
+                bg_scraper.scrape_bg_stats('BGG_GameList_tabbed.csv',
+                                           chunk_size, num_games, db,
+                                           xmlapi=server.xmlapi,
+                                           wait_time=1./requests_per_second,
+                                           resume=True)
+
+            times[mode] = time.time() - start
+
+            written[mode] = len(_dump_boardgames_table(db))
+
+            if mode == 'adaptive':
+
+                summary = chunk_size.summary()
+
+    print '\nXML API scrape of', num_games, 'games,', latency, 's +',\
+          latency_per_game, 's per game, at most', max_games_per_request,\
+          'games per request'
+
+    for mode in [('fixed ' + str(size)) for size in fixed_sizes] +\
+                ['adaptive']:
+
+        print '  %-10s %7.2f s  %5d games written  %6.1f games/s' % (mode,
+                             times[mode], written[mode],
+                             written[mode]/times[mode])
+
+    sizes = summary['sizes']
+
+    print '  adaptive chunk sizes: first', sizes[:8], '... last', sizes[-4:],\
+          '(' + str(summary['failed']), 'failed)'
+
+    return times
+
+
+def bench_flaky_xmlapi(num_games=2000, chunk_size=100, error_rate=0.2,
+                       broken_rows=(5, 150, 151, 1777), latency=0.05,
+                       base_delay=0.1, db=BENCH_DATABASE):
+    '''
+    Scrape a stand-in XML API that fails error_rate of all requests with a
+    503 and always fails requests that include one of a few broken games,
+    once the old way (one request per chunk, bg_scraper.RETRY_FAILED_CHUNKS
+    off) and once with retries, backoff and splitting.
+
+    num_games   : Number of games to scrape
+                  (Type: integer)
+
+    chunk_size  : Games per XML API request
+                  (Type: integer)
+
+    error_rate  : Fraction of requests answered with a 503
+                  (Type: float)
+
+    broken_rows : csv rows (0 = first game) of the games that break every
+                  request they are in
+                  (Type: tuple of integers)
+
+    latency     : Seconds the stand-in takes to answer each request
+                  (Type: float)
+
+    base_delay  : Backoff before the first retry (FETCH_BASE_DELAY)
+                  (Type: float)
+
+    db          : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    broken_ids = []
+
+    for labels, bg_list in bg_scraper.iter_csv_chunks('BGG_GameList_tabbed.csv',
+                                                      num_games, num_games):
+
+        bgID_list = bg_scraper.game_ids_from_chunk(labels, bg_list)
+
+        broken_ids = [bgID_list[row] for row in broken_rows if row < num_games]
+
+    times = {}
+
+    results = {}
+
+    old_base_delay = bg_scraper.FETCH_BASE_DELAY
+
+    bg_scraper.FETCH_BASE_DELAY = base_delay
+
+    try:
+
+        with bgg_stand_in.StandInServer(latency=latency, error_rate=error_rate,
+                                        broken_game_ids=broken_ids) as server:
+
+            for mode in ('one try', 'retry'):
+
+                bg_scraper.RETRY_FAILED_CHUNKS = mode == 'retry'
+
+                _reset_boardgames_table(db)
+
+                served = server.requests_served
+
+                start = time.time()
+
+                bg_scraper.scrape_bg_stats('BGG_GameList_tabbed.csv',
+                                           chunk_size, num_games, db,
+                                           xmlapi=server.xmlapi, wait_time=0,
+                                           run_name='bench_flaky')
+
+                times[mode] = time.time() - start
+
+                with psycopg2.connect(db) as conn:
+                    with conn.cursor() as curs:
+
+                        curs.execute("""SELECT count(*) FROM boardgames;""")
+
+                        written = curs.fetchone()[0]
+
+                results[mode] = (written, server.requests_served - served,
+                                 len(bg_scraper.dead_letters('bench_flaky',
+                                                             db)))
+
+    finally:
+
+        bg_scraper.RETRY_FAILED_CHUNKS = True
+
+        bg_scraper.FETCH_BASE_DELAY = old_base_delay
+
+    print '\nXML API scrape of', num_games, 'games,', int(error_rate*100),\
+          '% 503s,', len(broken_ids), 'broken games'
+
+    for mode in ('one try', 'retry'):
+
+        print '  %-10s %7.2f s  %5d games written  %4d requests  '\
+              '%d dead lettered' % ((mode, times[mode]) + results[mode])
+
+    return times
+
+
+def bench_db_writer(num_games=3000, chunk_size=50, latency=0.05,
+                    db_latency=0.1, write_batch_size=500, db=BENCH_DATABASE):
+    '''
+    Scrape with scrape_bg_stats() writing every chunk before the next
+    request, and with a DatabaseWriter thread committing write_batch_size
+    games at a time.
+
+    A far away or busy database is faked with a trigger that sleeps
+    db_latency seconds on every INSERT into boardgames.
+
+    num_games        : Number of games to scrape
+                       (Type: integer)
+
+    chunk_size       : Games per XML API request
+                       (Type: integer)
+
+    latency          : Seconds the stand-in takes to answer each request
+                       (Type: float)
+
+    db_latency       : Seconds every INSERT into boardgames takes on top
+                       (Type: float)
+
+    write_batch_size : Games per commit of the writer thread
+                       (Type: integer)
+
+    db               : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    times = {}
+
+    rows = {}
+
+    with bgg_stand_in.StandInServer(latency=latency) as server:
+
+        for mode, batch_size in (('inline', None),
+                                 ('writer', write_batch_size)):
+
+            _reset_boardgames_table(db)
+
+            with psycopg2.connect(db) as conn:
+                with conn.cursor() as curs:
+
+                    curs.execute("""CREATE OR REPLACE FUNCTION bench_db_latency()
+                                    RETURNS trigger AS $$
+                                    BEGIN
+                                        PERFORM pg_sleep(""" +\
+                                                 str(float(db_latency)) + """);
+                                        RETURN NULL;
+                                    END;
+                                    $$ LANGUAGE plpgsql;
+
+                                    CREATE TRIGGER bench_db_latency
+                                        AFTER INSERT ON boardgames
+                                        FOR EACH STATEMENT
+                                        EXECUTE PROCEDURE bench_db_latency();""")
+
+            # Made here to read its metrics afterwards
+            writer = bg_scraper.DatabaseWriter(db, batch_size) \
+                         if batch_size else None
+
+            start = time.time()
+
+            bg_scraper.scrape_bg_stats('BGG_GameList_tabbed.csv', chunk_size,
+                                       num_games, db, xmlapi=server.xmlapi,
+                                       wait_time=0, run_name='bench_writer',
+                                       write_batch_size=writer)
+
+            times[mode] = time.time() - start
+
+            rows[mode] = _dump_boardgames_table(db)
+
+            if writer is not None:
+
+                metrics = writer.metrics()
+
+    print '\nDatabase writer:', num_games, 'games,', chunk_size,\
+          'per request,', latency, 's request latency,', db_latency,\
+          's per INSERT'
+
+    for mode in ('inline', 'writer'):
+
+        print '  %-7s %7.2f s  %7.1f games/s' % (mode, times[mode],
+                                                 num_games/times[mode])
+
+    print '  Writer: %d commits, queue depth mean %.2f max %d, %.2f s '\
+          'waiting for room' % (metrics['batches'],
+                                metrics['mean_queue_depth'],
+                                metrics['max_queue_depth'],
+                                metrics['put_wait_seconds'])
+
+    print '  Identical boardgames table:', rows['inline'] == rows['writer']
+
+    return times
+
+
+def bench_response_cache(num_games=1000, chunk_size=100, latency=1.,
+                         requests_per_second=1., db=BENCH_DATABASE):
+    '''
+    Scrape the stand-in's XML API with scrape_bg_stats() three times
+    through a bgg_http.ResponseCache: cold (empty cache), warm (every
+    response fresh on disk) and stale (every response revalidated with
+    If-None-Match, answered 304).
+
+    num_games           : Number of games to scrape
+                          (Type: integer)
+
+    chunk_size          : Games per XML API request
+                          (Type: integer)
+
+    latency             : Seconds the stand-in takes to answer each request
+                          (Type: float)
+
+    requests_per_second : Rate limit given to the scraper
+                          (Type: float)
+
+    db                  : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    cache_dir = tempfile.mkdtemp()
+
+    times = {}
+
+    requests_sent = {}
+
+    try:
+
+        with bgg_stand_in.StandInServer(latency=latency) as server:
+
+            for mode, ttl in (('cold', 3600), ('warm', 3600), ('stale', 0)):
+
+                bgg_http.use_cache(bgg_http.ResponseCache(cache_dir, ttl=ttl))
+
+                _reset_boardgames_table(db)
+
+                served = server.requests_served
+
+                start = time.time()
+
+                bg_scraper.scrape_bg_stats('BGG_GameList_tabbed.csv',
+                                           chunk_size, num_games, db,
+                                           xmlapi=server.xmlapi,
+                                           wait_time=1./requests_per_second)
+
+                times[mode] = time.time() - start
+
+                requests_sent[mode] = server.requests_served - served
+
+    finally:
+
+        bgg_http.use_cache(None)
+
+        shutil.rmtree(cache_dir)
+
+    print '\nXML API scrape through the response cache:', num_games, 'games,',\
+          latency, 's latency'
+
+    for mode in ('cold', 'warm', 'stale'):
+
+        print '  %-10s %7.2f s  %3d requests' % (mode, times[mode],
+                                                 requests_sent[mode])
+
+    return times
+
+
+def bench_delta_rescrape(num_games=10000, num_new=500, chunk_size=100,
+                         latency=0.2, requests_per_second=5.,
+                         db=BENCH_DATABASE):
+    '''
+    Refresh a scraped catalog from a drifted game list, once by scraping
+    everything again and once with scrape_changed_games(), and check both
+    end up with the same boardgames table.
+
+    The catalog starts with all but the last num_new games. In the drifted
+    list every 10th game has its geek rating moved by 0.05 (past the
+    threshold), every 3rd gets a tiny rating wobble, and the last num_new
+    games are new.
+
+    num_games           : Games in the drifted list
+                          (Type: integer)
+
+    num_new             : Games that weren't in the first scrape
+                          (Type: integer)
+
+    chunk_size          : Games per XML API request
+                          (Type: integer)
+
+    latency             : Seconds the stand-in takes to answer each request
+                          (Type: float)
+
+    requests_per_second : Rate limit given to both refreshes
+                          (Type: float)
+
+    db                  : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    work_dir = tempfile.mkdtemp()
+
+    drifted_csv = os.path.join(work_dir, 'drifted.csv')
+
+    _drift_game_list('BGG_GameList_tabbed.csv', drifted_csv, num_games)
+
+    times = {}
+
+    requests_sent = {}
+
+    try:
+
+        with bgg_stand_in.StandInServer(drifted_csv, latency=latency) as server:
+
+            _reset_boardgames_table(db)
+
+            served = server.requests_served
+
+            start = time.time()
+
+            bg_scraper.scrape_bg_stats(drifted_csv, chunk_size, num_games, db,
+                                       xmlapi=server.xmlapi,
+                                       wait_time=1./requests_per_second)
+
+            times['full'] = time.time() - start
+
+            requests_sent['full'] = server.requests_served - served
+
+            full_rows = _dump_boardgames_table(db)
+
+            _load_bench_catalog(db, num_games - num_new)
+
+            served = server.requests_served
+
+            start = time.time()
+
+            counts = bg_scraper.scrape_changed_games(drifted_csv, chunk_size, db,
+                                       xmlapi=server.xmlapi,
+                                       wait_time=1./requests_per_second)
+
+            times['delta'] = time.time() - start
+
+            requests_sent['delta'] = server.requests_served - served
+
+            delta_rows = _dump_boardgames_table(db)
+
+    finally:
+
+        shutil.rmtree(work_dir)
+
+    print '\nRefresh of', num_games, 'games (%(new)d new, %(changed)d changed,'\
+          ' %(updated)d updated, %(unchanged)d unchanged)' % counts
+
+    for mode in ('full', 'delta'):
+
+        print '  %-10s %7.2f s  %3d requests' % (mode, times[mode],
+                                                 requests_sent[mode])
+
+    print '  Identical boardgames table:', full_rows == delta_rows
+
+    return times
+
+
+def _drift_game_list(csv_file_name, out_file_name, num_games):
+    '''
+    Copy of a game list csv file with some ratings moved, see
+    bench_delta_rescrape()
+    '''
+
+    with open(csv_file_name, 'rb') as csv_file:
+
+        lines = csv_file.read().split('\n')
+
+    with open(out_file_name, 'wb') as out_file:
+
+        out_file.write(lines[0])
+
+        for i, line in enumerate(lines[1:num_games + 1]):
+
+            fields = line.split('\t')
+
+            if fields[4] != 'N/A':
+
+                if i % 10 == 0:
+
+                    fields[4] = '%.3f' % (float(fields[4]) + 0.05)
+
+                elif i % 3 == 0:
+
+                    fields[4] = '%.3f' % (float(fields[4]) + 0.001)
+
+            out_file.write('\n' + '\t'.join(fields))
+
+
+def bench_list_page_parse(num_pages=100, repeats=3, num_processes=(2, 4)):
+    '''
+    Parse saved browse pages with BeautifulSoup (parse_list_page()), with
+    lxml (parse_list_page_lxml()) and with lxml in process pools
+    (parse_list_pages(), pool start up included).
+
+    num_pages     : Pages the stand-in renders and saves to disk
+                    (Type: integer)
+
+    repeats       : Times each way is timed, the best time is kept
+                    (Type: integer)
+
+    num_processes : Pool sizes to try
+                    (Type: tuple of integers)
+
+    Returns a dict of seconds for all the pages per way
+    '''
+
+    server = bgg_stand_in.StandInServer()
+
+    server.stop()
+
+    out_dir = tempfile.mkdtemp()
+
+    try:
+
+        for page in range(1, num_pages + 1):
+
+            with open(os.path.join(out_dir, str(page) + '.html'), 'wb') as f:
+
+                f.write(server.render_game_list_page(page).encode('utf-8'))
+
+        html_pages = []
+
+        for page in range(1, num_pages + 1):
+
+            with open(os.path.join(out_dir, str(page) + '.html'), 'rb') as f:
+
+                html_pages.append(f.read().decode('utf-8'))
+
+    finally:
+
+        shutil.rmtree(out_dir)
+
+    ways = [('soup', lambda: [collect_games.parse_list_page(html)
+                              for html in html_pages]),
+            ('lxml', lambda: [collect_games.parse_list_page_lxml(html)
+                              for html in html_pages])] +\
+           [('lxml, ' + str(n) + ' processes',
+             lambda n=n: collect_games.parse_list_pages(html_pages, n))
+            for n in num_processes]
+
+    times = {}
+
+    results = {}
+
+    for name, parse in ways:
+
+        best = None
+
+        for _ in range(repeats):
+
+            start = time.time()
+
+            results[name] = parse()
+
+            elapsed = time.time() - start
+
+            best = elapsed if best is None else min(best, elapsed)
+
+        times[name] = best
+
+    print '\nBrowse page parse:', num_pages, 'pages,',\
+          multiprocessing.cpu_count(), 'CPUs'
+
+    for name, parse in ways:
+
+        print '  %-20s %7.3f s  %6.1f pages/s  same tuples: %s' %\
+              (name, times[name], num_pages/times[name],
+               results[name] == results['soup'])
+
+    return times
+
+
+def bench_game_list_lookup(csv_file_name='BGG_GameList_tabbed.csv',
+                           first_rank=9801, last_rank=9900, repeats=20):
+    '''
+    Get a range of ranks and a single game out of the game list csv file
+    by reading through it (how grab_chunk_from_csv() used to) and through a
+    game_list.GameList offset index.
+
+    csv_file_name         : Game list to read
+                            (Type: String)
+
+    first_rank, last_rank : Rank range to look up, near the end of the file
+                            is the worst case for reading through
+                            (Type: integer)
+
+    repeats               : Times each lookup is timed, the average is kept
+                            (Type: integer)
+
+    Returns a dict of seconds per lookup
+    '''
+
+    games = game_list.GameList(csv_file_name)
+
+    last_id = games.ids[-1]
+
+    def scan_range():
+
+        return [game_list.to_record(row) for row
+                in _scan_csv_rows(csv_file_name, first_rank, last_rank + 1)]
+
+    def scan_id():
+
+        for row in _scan_csv_rows(csv_file_name, 1, games.num_games + 1):
+
+            if int(row[2].split('/')[2]) == last_id:
+
+                return game_list.to_record(row)
+
+    ways = [('index build', lambda: game_list.GameList(csv_file_name)),
+            ('rank range, scan', scan_range),
+            ('rank range, index', lambda: games.by_rank(first_rank, last_rank)),
+            ('game ID, scan', scan_id),
+            ('game ID, index', lambda: games.by_id(last_id))]
+
+    times = {}
+
+    results = {}
+
+    for name, lookup in ways:
+
+        start = time.time()
+
+        for _ in range(repeats):
+
+            results[name] = lookup()
+
+        times[name] = (time.time() - start)/repeats
+
+    print '\nGame list lookups:', games.num_games, 'games, ranks', first_rank,\
+          'to', last_rank
+
+    for name, lookup in ways:
+
+        print '  %-18s %9.3f ms' % (name, 1000*times[name])
+
+    print '  Same records:', results['rank range, scan'] ==\
+                           results['rank range, index'] and\
+                           results['game ID, scan'] == results['game ID, index']
+
+    return times
+
+
+def _scan_csv_rows(csv_file_name, start, stop):
+    '''
+    Rows start up to stop of a csv file, found by reading every row before
+    them
+    '''
+
+    with open(csv_file_name, 'rb') as csv_file:
+
+        csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+        csv_contents.next()
+
+        return [row for row_number, row in enumerate(csv_contents, 1)
+                if start <= row_number < stop]
+
+
+def bench_xml_parse(chunk_size=100, repeats=20):
+    '''
+    Parse the same XML API chunk with the BeautifulSoup parser and with the
+    streaming bgg_xml parser.
+
+    Peak memory is measured as the growth of the max resident set size of a
+    fresh child process while it parses one chunk.
+
+    chunk_size : Games in the chunk
+                 (Type: integer)
+
+    repeats    : Times each parser is timed on the chunk
+                 (Type: integer)
+
+    Returns a dict of (seconds per chunk, KB of peak memory) per parser
+    '''
+
+    server = bgg_stand_in.StandInServer()
+
+    server.stop()
+
+    bg_list = [[field.encode('utf-8') for field in game]
+               for game in server.games[:chunk_size]]
+
+    bgID_list = bg_scraper.game_ids_from_chunk(['Rank', 'Name', 'HRef'],
+                                               bg_list)
+
+    xml_content = server.render_boardgames_xml(bgID_list).encode('utf-8')
+
+    parsers = [('soup', bg_scraper.parse_chunk_soup),
+               ('streaming', bg_scraper.parse_chunk)]
+
+    # Measure memory before anything has been parsed in this process, the
+    #   children would otherwise inherit a heap that already fits a chunk
+    peaks = dict((name, _peak_memory_kb(parser, xml_content, bg_list,
+                                        bgID_list))
+                 for name, parser in parsers)
+
+    results = {}
+
+    for name, parser in parsers:
+
+        start = time.time()
+
+        for _ in range(repeats):
+
+            parser(xml_content, bg_list, bgID_list)
+
+        results[name] = ((time.time() - start)/repeats, peaks[name])
+
+    identical = bg_scraper.parse_chunk_soup(xml_content, bg_list, bgID_list) ==\
+                bg_scraper.parse_chunk(xml_content, bg_list, bgID_list)
+
+    print '\nXML parse:', chunk_size, 'games per chunk,',\
+          len(xml_content)/1024, 'KB of XML'
+
+    for name, parser in parsers:
+
+        print '  %-10s %8.2f ms/chunk  %7d KB peak' % (name,
+                                                       1000*results[name][0],
+                                                       results[name][1])
+
+    print '  Identical bg_dicts:', identical
+
+    return results
+
+
+def bench_db_load(num_games=None, chunk_size=100, db=BENCH_DATABASE):
+    '''
+    Load the games of BGG_GameList_tabbed.csv (with the stand-in's XML API
+    details) into the boardgames table two ways:
+
+        per row : a new connection per chunk and one INSERT per game, the
+                  way bg_scraper used to write every chunk
+        bulk    : one connection and bg_scraper.copy_to_table() per chunk
+
+    num_games  : Number of games to load, None loads the whole csv file
+                 (Type: integer)
+
+    chunk_size : Games written per chunk
+                 (Type: integer)
+
+    db         : Database the boardgames table is (re)created in
+
+    Returns a dict of wall times in seconds
+    '''
+
+    chunks = _parsed_chunks(num_games, chunk_size)
+
+    total_games = sum(len(bg_dicts) for bg_dicts in chunks)
+
+    times = {}
+
+    _reset_boardgames_table(db)
+
+    start = time.time()
+
+    for bg_dicts in chunks:
+
+        with psycopg2.connect(db) as conn:
+            with conn.cursor() as curs:
+
+                for bg_dict in bg_dicts:
+
+                    bg_scraper.add_to_table(curs, bg_dict)
+
+    times['per row'] = time.time() - start
+
+    per_row_rows = _dump_boardgames_table(db)
+
+    _reset_boardgames_table(db)
+
+    start = time.time()
+
+    conn = psycopg2.connect(db)
+
+    for bg_dicts in chunks:
+
+        with conn:
+            with conn.cursor() as curs:
+
+                bg_scraper.copy_to_table(curs, bg_dicts)
+
+    conn.close()
+
+    times['bulk'] = time.time() - start
+
+    bulk_rows = _dump_boardgames_table(db)
+
+    print '\nDatabase load:', total_games, 'games in chunks of', chunk_size
+
+    for mode in ('per row', 'bulk'):
+
+        print '  %-10s %7.2f s  %8.1f games/s' % (mode, times[mode],
+                                                  total_games/times[mode])
+
+    print '  Identical boardgames table:', per_row_rows == bulk_rows
+
+    return times
+
+
+def bench_incremental_normalize(num_changed=200, db=BENCH_DATABASE):
+    '''
+    Change the mechanics of num_changed games (and delete a few), then
+    bring the normalized tables up to date two ways:
+
+        incremental : normalize_database.normalize_changes()
+        full        : normalize_database.normalize_database()
+
+    Also checks the partial build case: with only the designers table
+    made, normalize_changes() has to fall back to building every table.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    num_changed : Number of games changed
+                  (Type: int)
+
+    db          : Database the catalog is (re)loaded into
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    times = {}
+
+    _change_games(num_changed, db)
+
+    start = time.time()
+
+    normalize_database.normalize_changes(db=db)
+
+    times['incremental'] = time.time() - start
+
+    incremental_rows = _dump_link_tables(db)
+
+    start = time.time()
+
+    normalize_database.normalize_database(db=db)
+
+    times['full'] = time.time() - start
+
+    full_rows = _dump_link_tables(db)
+
+    # Only the designers table and the change log, like after
+    #   create_designers_table() on a fresh database
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""DROP TABLE IF EXISTS """ +\
+                         ', '.join(table for column, (table, item)
+                                   in normalize_database.LINK_TABLES) +\
+                         """, boardgames_changes CASCADE;""")
+
+    normalize_database.normalize_database(['designers'], db=db)
+
+    _change_games(1, db)
+
+    normalize_database.normalize_changes(db=db)
+
+    partial_rows = _dump_link_tables(db)
+
+    normalize_database.normalize_database(db=db)
+
+    print '\nNormalizing after', num_changed, 'changed games'
+
+    for mode in ('incremental', 'full'):
+
+        print '  %-12s %8.2f ms' % (mode, times[mode]*1000)
+
+    print '  Identical tables:', incremental_rows == full_rows
+
+    print '  Partial build caught up:', partial_rows == _dump_link_tables(db)
+
+    return times
+
+
+def _change_games(num_changed, db):
+    '''
+    Add a mechanic to num_changed games, and delete every tenth of them
+    '''
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""UPDATE boardgames
+                            SET mechanics = array_append(mechanics,
+                                                         'Bench Mechanic')
+                            WHERE id IN (SELECT id FROM boardgames
+                                         ORDER BY id LIMIT %s);
+
+                            DELETE FROM boardgames
+                            WHERE id IN (SELECT id FROM boardgames
+                                         ORDER BY id LIMIT %s);""",
+                         (num_changed, num_changed // 10))
+
+
+def _dump_link_tables(db):
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            tables = []
+
+            for column, (table, item) in normalize_database.LINK_TABLES:
+
+                curs.execute("""SELECT * FROM """ + table +\
+                             """ ORDER BY 1, 2;""")
+
+                tables.append(curs.fetchall())
+
+            return tables
+
+
+def bench_analysis_pooling(column='mechanics', db=BENCH_DATABASE):
+    '''
+    Time the per item queries scatter_plot_geekr_vs_complxr() used to run
+    for every item of a column, first with a new connection for every query
+    (how data_analysis used to work) and then with query_executor's pooled
+    connections and prepared statements.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    column : Column of the boardgames table to plot, eg. mechanics
+             (Type: String)
+
+    db     : Database the catalog is (re)loaded into
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    times = {}
+
+    # Every call is meant to reach the database
+    cache = query_cache.cache
+
+    query_cache.use_cache(None)
+
+    try:
+
+        for mode, pooling in (('per call', False), ('pooled', True)):
+
+            query_executor.POOLING = pooling
+
+            query_executor.close_pool()
+
+            start = time.time()
+
+            _per_item_queries(column)
+
+            times[mode] = time.time() - start
+
+    finally:
+
+        query_cache.use_cache(cache)
+
+        query_executor.POOLING = True
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    num_items = _count_items(column, db)
+
+    print '\nQueries for a plot of all', num_items, column,\
+          '(' + str(2*num_items + 1), 'queries)'
+
+    for mode in ('per call', 'pooled'):
+
+        print '  %-10s %7.3f s' % (mode, times[mode])
+
+    return times
+
+
+def bench_batched_item_queries(column='categories', db=BENCH_DATABASE):
+    '''
+    Time grabbing the data for a plot of every item of a column one item at
+    a time (count_column() plus two queries per item, on pooled connections)
+    against data_analysis.stats_for_items_in_column()'s single query.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    column : Column of the boardgames table, eg. categories
+             (Type: String)
+
+    db     : Database the catalog is (re)loaded into
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    times = {}
+
+    # Every call is meant to reach the database
+    cache = query_cache.cache
+
+    query_cache.use_cache(None)
+
+    try:
+
+        # Warm up the pool so both sides start with open connections
+        data_analysis.count_column(column)
+
+        start = time.time()
+
+        _per_item_queries(column)
+
+        times['per item'] = time.time() - start
+
+        start = time.time()
+
+        stats = data_analysis.stats_for_items_in_column(column)
+
+        data_analysis.count_items_in_stats(stats)
+
+        times['batched'] = time.time() - start
+
+    finally:
+
+        query_cache.use_cache(cache)
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    num_items = _count_items(column, db)
+
+    print '\nData for a plot of all', num_items, column
+
+    print '  %-10s %7.3f s  (%d queries)' % ('per item', times['per item'],
+                                            2*num_items + 1)
+
+    print '  %-10s %7.3f s  (1 query)' % ('batched', times['batched'])
+
+    return times
+
+
+def bench_game_store(db=BENCH_DATABASE, repeats=5):
+    '''
+    Time a handful of data_analysis calls answered by the database against
+    the same calls answered by an in-memory game_store.GameStore (plus the
+    one-off cost of loading the store). Then checks that both give the
+    same averages per mechanic in the same order, with a mechanic whose
+    only game has NULL ratings in the mix.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    db      : Database the catalog is (re)loaded into
+
+    repeats : Times each set of calls is run; the best run is kept
+              (Type: int)
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    times = {}
+
+    # Every call is meant to reach the database
+    cache = query_cache.cache
+
+    query_cache.use_cache(None)
+
+    try:
+
+        start = time.time()
+
+        store = game_store.GameStore.from_database()
+
+        times['load store'] = time.time() - start
+
+        for mode, source in (('database', None), ('store', store)):
+
+            data_analysis.use_game_store(source)
+
+            best = None
+
+            for repeat in range(repeats):
+
+                start = time.time()
+
+                _analysis_session()
+
+                elapsed = time.time() - start
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            times[mode] = best
+
+        data_analysis.use_game_store(None)
+
+        # NULL averages have to sort the same way in both
+        with psycopg2.connect(db) as conn:
+            with conn.cursor() as curs:
+
+                curs.execute("""UPDATE boardgames
+                                SET geek_rating = NULL, play_time = NULL,
+                                    mechanics = array_append(mechanics,
+                                                             'Bench Null Mechanic')
+                                WHERE rank = 1;""")
+
+        normalize_database.normalize_changes(db=db)
+
+        results = {}
+
+        for mode, source in (('database', None),
+                             ('store', game_store.GameStore.from_database())):
+
+            data_analysis.use_game_store(source)
+
+            results[mode] = _per_mechanic_session()
+
+    finally:
+
+        query_cache.use_cache(cache)
+
+        data_analysis.use_game_store(None)
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    print '\nAnalysis calls from the database vs a GameStore'
+
+    for mode in ('load store', 'database', 'store'):
+
+        print '  %-10s %9.2f ms' % (mode, times[mode]*1000)
+
+    print '  Same averages per mechanic:', _same_per_mechanic(results['database'],
+                                                          results['store'])
+
+    return times
+
+
+def _per_mechanic_session():
+    '''
+    avg_geek_rating_playtime_per_mechanic() in every sort order, as lists
+    of (mechanic, avg geek rating, avg play time, num games) rows
+    '''
+
+    return [(sortby, zip(*data_analysis.avg_geek_rating_playtime_per_mechanic(
+                                                                1001, sortby)))
+            for sortby in (None, 'num', 'geek', 'playtime')]
+
+
+def _same_per_mechanic(results, other_results):
+    '''
+    True if two _per_mechanic_session() results have the same rows and
+    the values sorted by come in the same order (ties may come in any
+    order). geek_rating is a real and gets averaged at different
+    precisions, so averages only have to be close; NaN matches NaN.
+    '''
+
+    for (sortby, rows), (other_sortby, other_rows) in zip(results,
+                                                          other_results):
+
+        rows_by_name = dict((row[0], row[1:]) for row in rows)
+
+        other_by_name = dict((row[0], row[1:]) for row in other_rows)
+
+        if len(rows) != len(other_rows) or\
+           sorted(rows_by_name) != sorted(other_by_name):
+
+            return False
+
+        for name in rows_by_name:
+
+            if not np.allclose(np.array(rows_by_name[name], dtype=float),
+                               np.array(other_by_name[name], dtype=float),
+                               rtol=1e-6, equal_nan=True):
+
+                return False
+
+        if sortby is not None:
+
+            key = {'num': 3, 'geek': 1, 'playtime': 2}[sortby]
+
+            if not np.allclose(np.array([row[key] for row in rows], dtype=float),
+                               np.array([row[key] for row in other_rows],
+                                        dtype=float),
+                               rtol=1e-6, equal_nan=True):
+
+                return False
+
+    return True
+
+
+def bench_rank_bands(db=BENCH_DATABASE, repeats=5):
+    '''
+    Time the queries behind scatter_plot_mechanics_with_rank() for the top
+    100, top 1000 and all games, plus count_column() of every link column,
+    joining and grouping the link tables every time against adding up the
+    bands of the item_rank_bands view. Also times refreshing the view.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    db      : Database the catalog is (re)loaded into
+
+    repeats : Times each set of calls is run; the best run is kept
+              (Type: int)
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    times = {}
+
+    results = {}
+
+    # Every call is meant to reach the database
+    cache = query_cache.cache
+
+    query_cache.use_cache(None)
+
+    try:
+
+        for mode, use_rank_bands in (('group by', False), ('rank bands', True)):
+
+            data_analysis.USE_RANK_BANDS = use_rank_bands
+
+            best = None
+
+            for repeat in range(repeats):
+
+                start = time.time()
+
+                results[mode] = _rank_cutoff_session()
+
+                elapsed = time.time() - start
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            times[mode] = best
+
+    finally:
+
+        query_cache.use_cache(cache)
+
+        data_analysis.USE_RANK_BANDS = True
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    start = time.time()
+
+    bg_scraper.refresh_rank_bands(db)
+
+    times['refresh'] = time.time() - start
+
+    print '\nRank cutoff queries (3 ranks x 4 orders) and 6 count_column() calls'
+
+    for mode in ('group by', 'rank bands', 'refresh'):
+
+        print '  %-10s %9.2f ms' % (mode, times[mode]*1000)
+
+    print '  Same results:', results['group by'] == results['rank bands']
+
+    return times
+
+
+def _rank_cutoff_session():
+    '''
+    What scatter_plot_mechanics_with_rank() asks for at three ranks, and
+    the item counts of every link column. Rows are sorted so ties in the
+    ORDER BY don't count as a difference, averages rounded to 9 places.
+    '''
+
+    results = []
+
+    for rank in (101, 1001, 10001):
+
+        for sortby in (None, 'num', 'geek', 'playtime'):
+
+            rows = zip(*data_analysis.avg_geek_rating_playtime_per_mechanic(
+                                                                  rank, sortby))
+
+            results.append(sorted((mechanic, round(avg_rating, 9),
+                                   avg_playtime, num_games)
+                                  for mechanic, avg_rating, avg_playtime,
+                                      num_games in rows))
+
+    for column, link in normalize_database.LINK_TABLES:
+
+        results.append(sorted(data_analysis.count_column(column)))
+
+    return results
+
+
+def bench_query_cache(db=BENCH_DATABASE, repeats=5):
+    '''
+    Time a notebook-like session of data_analysis calls, each run repeats
+    times, without the query cache and with it (the first run fills it).
+    Then the data version is bumped, like a scrape would, to time the run
+    that finds every entry stale.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    db      : Database the catalog is (re)loaded into
+
+    repeats : Times the session is run
+              (Type: int)
+
+    Returns a dict of wall times in seconds (per session)
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    previous_cache = query_cache.cache
+
+    times = {}
+
+    try:
+
+        for mode, cache in (('no cache', None),
+                            ('cached', query_cache.QueryCache())):
+
+            query_cache.use_cache(cache)
+
+            run_times = []
+
+            for repeat in range(repeats):
+
+                start = time.time()
+
+                _analysis_session()
+
+                _per_item_queries('categories')
+
+                run_times.append(time.time() - start)
+
+            times[mode] = min(run_times)
+
+        times['first run'] = run_times[0]
+
+        bg_scraper.bump_data_version(db)
+
+        start = time.time()
+
+        _analysis_session()
+
+        _per_item_queries('categories')
+
+        times['after bump'] = time.time() - start
+
+    finally:
+
+        query_cache.use_cache(previous_cache)
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    print '\nNotebook session of data_analysis calls (best of', repeats, 'runs)'
+
+    for mode in ('no cache', 'first run', 'cached', 'after bump'):
+
+        print '  %-10s %9.2f ms' % (mode, times[mode]*1000)
+
+    print ' ',
+
+    cache.report()
+
+    return times
+
+
+def bench_plot_data_prep(db=BENCH_DATABASE, repeats=3):
+    '''
+    Time the data prep behind the plots over every game of the 10k game
+    catalog, the way data_analysis used to do it (appending row by row to
+    lists, a list comprehension for the rating difference, min and max of
+    the whole list for every element when scaling circle sizes) against
+    the numpy versions.
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    db      : Database the catalog is (re)loaded into
+
+    repeats : Times each step is run; the best run is kept
+              (Type: int)
+
+    Returns a dict of seconds per step and way
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    try:
+
+        rows = query_executor.execute("""SELECT play_time, complx_rating,
+                                                geek_rating, avg_rating,
+                                                num_voters
+                                         FROM boardgames;""")
+
+    finally:
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    scale_size = data_analysis.__dict__['__scale_size']
+
+    num_voters = [row_tuple[4] for row_tuple in rows]
+
+    def lists():
+
+        columns = [[] for _ in range(5)]
+
+        for row_tuple in rows:
+
+            for column, value in zip(columns, row_tuple):
+
+                column.append(value)
+
+        return columns
+
+    def list_diff():
+
+        columns = lists()
+
+        return [a - g for a, g in zip(columns[3], columns[2])]
+
+    def array_diff():
+
+        columns = data_analysis._column_arrays(rows, 5)
+
+        return columns[3] - columns[2]
+
+    steps = [('rows to columns', lists,
+              lambda: data_analysis._column_arrays(rows, 5)),
+             ('rating difference', list_diff, array_diff),
+             ('scale sizes', lambda: _scale_size_per_element(num_voters),
+              lambda: scale_size(num_voters))]
+
+    times = {}
+
+    same = True
+
+    for step, old_way, new_way in steps:
+
+        for way, prep in (('lists', old_way), ('numpy', new_way)):
+
+            best = None
+
+            for repeat in range(repeats):
+
+                start = time.time()
+
+                result = prep()
+
+                elapsed = time.time() - start
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            times[step, way] = best
+
+            if way == 'lists':
+
+                expected = result
+
+        same = same and all(np.allclose(np.array(old, dtype=float), new,
+                                        equal_nan=True)
+                            for old, new in zip(*_as_columns(expected, result)))
+
+    print '\nPlot data prep over', len(rows), 'games'
+
+    for step, old_way, new_way in steps:
+
+        print '  %-18s lists %9.2f ms   numpy %8.2f ms' % (step,
+                  1000*times[step, 'lists'], 1000*times[step, 'numpy'])
+
+    print '  Same values:', same
+
+    return times
+
+
+def _scale_size_per_element(val_list, min=25, max=1000):
+    '''
+    data_analysis.__scale_size() before it was vectorized
+    '''
+
+    return [float(val - np.min(val_list))/
+            (np.max(val_list) - np.min(val_list))*(max-min) + min \
+            for val in val_list]
+
+
+def _as_columns(old, new):
+    '''
+    A result of bench_plot_data_prep() both ways as lists of columns
+    '''
+
+    if isinstance(new, tuple):
+
+        return old, new
+
+    return [old], [new]
+
+
+def bench_streaming_fetch(scale=30, db=BENCH_DATABASE):
+    '''
+    Peak memory and time of getting every (mechanic, game) row of a
+    catalog grown to scale times the 10k games, as float arrays: with one
+    fetchall() turned into arrays afterwards (how data_analysis used to do
+    it) and streamed through query_executor.fetch_arrays()'s server side
+    cursor. Also the mean of every column worked out batch by batch from
+    query_executor.stream(), which never holds more than one batch.
+
+    The 10k game catalog is loaded into db, copied scale - 1 more times
+    (new ids, ranks after the originals) and normalized first.
+
+    scale : Size of the catalog in multiples of the 10k games
+            (Type: int)
+
+    db    : Database the catalog is (re)loaded into
+
+    Returns a dict of times in seconds and peak memory growth in kB
+    '''
+
+    _load_bench_catalog(db)
+
+    copied = ', '.join(column for column in bg_scraper.BOARDGAMES_COLUMNS
+                       if column not in ('id', 'rank'))
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""INSERT INTO boardgames (id, rank, """ + copied + """)
+                            SELECT id + copy*1000000, rank + copy*10000,
+                                   """ + copied + """
+                            FROM boardgames, generate_series(1, %s) AS copy;""",
+                         (scale - 1,))
+
+    normalize_database.normalize_database(db=db)
+
+    sql = """SELECT """ + data_analysis.ITEM_STAT_SELECT + """
+             FROM mechanics
+             INNER JOIN boardgames ON boardgames.id = mechanics.bg_id;"""
+
+    def fetchall_arrays():
+
+        rows = query_executor.execute(sql)
+
+        return data_analysis._column_arrays(rows,
+                                            len(data_analysis.ITEM_STAT_COLUMNS))
+
+    def streamed_arrays():
+
+        return query_executor.fetch_arrays(sql)
+
+    def batch_means():
+
+        sums = np.zeros(len(data_analysis.ITEM_STAT_COLUMNS))
+
+        counts = np.zeros(len(sums))
+
+        for batch in query_executor.stream(sql):
+
+            for i, stat in enumerate(data_analysis.ITEM_STAT_COLUMNS):
+
+                sums[i] += np.nansum(batch[stat])
+
+                counts[i] += np.count_nonzero(~np.isnan(batch[stat]))
+
+        return sums / counts
+
+    query_executor.use_database(db)
+
+    results = {}
+
+    try:
+
+        ways = (('fetchall', fetchall_arrays), ('streamed', streamed_arrays),
+                ('batches', batch_means))
+
+        # Memory first, before this process holds any of the rows. The
+        #   forked child has to make its own connections.
+        query_executor.close_pool()
+
+        for way, fetch in ways:
+
+            results[way, 'kB'] = _peak_memory_kb(fetch)
+
+        for way, fetch in ways:
+
+            start = time.time()
+
+            results[way] = fetch()
+
+            results[way, 's'] = time.time() - start
+
+            query_executor.close_pool()
+
+    finally:
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    num_rows = len(results['streamed'][0])
+
+    print '\nAll', num_rows, 'mechanic rows of a', scale*10, 'k game catalog',\
+          '(' + str(query_executor.ITERSIZE), 'rows per batch)'
+
+    for way in ('fetchall', 'streamed', 'batches'):
+
+        print '  %-9s %7.2f s  %9d kB peak growth' % (way, results[way, 's'],
+                                                     results[way, 'kB'])
+
+    print '  Same arrays:', all(np.array_equal(old, new) or
+                                np.allclose(old, new, equal_nan=True)
+                                for old, new in zip(results['fetchall'],
+                                                    results['streamed']))
+
+    print '  Same means:', np.allclose(results['batches'],
+                                       [np.nanmean(values) for values
+                                        in results['fetchall']])
+
+    return dict((key, value) for key, value in results.items()
+                if isinstance(key, tuple))
+
+
+def bench_snapshot_load(db=BENCH_DATABASE, repeats=5):
+    '''
+    Time getting a GameStore of the 10k game catalog from the database
+    against opening a memory-mapped snapshot of it (snapshot.py).
+
+    The 10k game catalog is loaded into db and normalized first.
+
+    db      : Database the catalog is (re)loaded into
+
+    repeats : Times each load is run; the best run is kept
+              (Type: int)
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    query_executor.use_database(db)
+
+    snapshot_dir = tempfile.mkdtemp()
+
+    times = {}
+
+    try:
+
+        snapshot.export_snapshot(snapshot_dir, 'benchmark')
+
+        for mode, load in (('database', game_store.GameStore.from_database),
+                           ('snapshot', lambda: snapshot.load_snapshot(
+                                                               snapshot_dir))):
+
+            best = None
+
+            for repeat in range(repeats):
+
+                start = time.time()
+
+                load()
+
+                elapsed = time.time() - start
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            times[mode] = best
+
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, file_name))
+                   for file_name in os.listdir(snapshot_dir))
+
+    finally:
+
+        shutil.rmtree(snapshot_dir)
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    print '\nGameStore of the catalog (snapshot is %.1f MB)' % (size/1e6)
+
+    for mode in ('database', 'snapshot'):
+
+        print '  %-10s %9.2f ms' % (mode, times[mode]*1000)
+
+    return times
+
+
+def bench_rating_history(num_days=60, drift_every=20, repeats=5,
+                         db=BENCH_DATABASE):
+    '''
+    Record num_days days of drifting ratings with rating_history.py and
+    compare the size of the (delta) history with keeping every game every
+    day, then time the trajectory and biggest movers queries.
+
+    Each day 1 in drift_every games gets new votes (a different set every
+    day), through UPDATEs of boardgames like a delta re-scrape would do.
+
+    num_days    : Days of history to record
+                  (Type: int)
+
+    drift_every : 1 in drift_every games changes each day
+                  (Type: int)
+
+    repeats     : Times each query is run; the best run is kept
+                  (Type: int)
+
+    db          : Database the catalog is (re)loaded into
+
+    Returns a dict of wall times in seconds
+    '''
+
+    _load_bench_catalog(db)
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""DROP TABLE IF EXISTS boardgame_ratings,
+                                                 boardgame_ratings_daily;""")
+
+    rating_history.install_rating_history(db)
+
+    first_day = datetime.date(2016, 6, 1)
+
+    days = [first_day + datetime.timedelta(days=i) for i in range(num_days)]
+
+    rating_history.record_snapshot(db, snapshot_date=first_day)
+
+    times = {}
+
+    start = time.time()
+
+    conn = psycopg2.connect(db)
+
+    for i, day in enumerate(days[1:], 1):
+
+        with conn:
+            with conn.cursor() as curs:
+
+                curs.execute("""SELECT set_config('bgg.snapshot_date', %s,
+                                                  true);""", (str(day),))
+
+                curs.execute("""UPDATE boardgames
+                                SET num_voters  = num_voters + 1 + id %% 7,
+                                    geek_rating = geek_rating +
+                                                  0.001 * ((id + %s) %% 5 - 2)
+                                WHERE (id + %s) %% %s = 0;""",
+                             (i, i, drift_every))
+
+    times['record'] = time.time() - start
+
+    with conn:
+        with conn.cursor() as curs:
+
+            # What one row per game per day would take
+            curs.execute("""CREATE TABLE boardgame_ratings_daily AS
+                            SELECT day::date AS snapshot_date, id AS bg_id,
+                                   rank, geek_rating, avg_rating, num_voters
+                            FROM boardgames,
+                                 generate_series(%s::date, %s::date,
+                                                 interval '1 day') AS day;""",
+                         (str(days[0]), str(days[-1])))
+
+            curs.execute("""SELECT count(*) FROM boardgame_ratings;""")
+
+            history_rows = curs.fetchone()[0]
+
+            curs.execute("""SELECT sum(pg_total_relation_size(inhrelid))::bigint
+                            FROM pg_inherits
+                            WHERE inhparent = 'boardgame_ratings'::regclass;""")
+
+            history_size = curs.fetchone()[0]
+
+            curs.execute("""SELECT count(*),
+                                   pg_total_relation_size('boardgame_ratings_daily')
+                            FROM boardgame_ratings_daily;""")
+
+            daily_rows, daily_size = curs.fetchone()
+
+            curs.execute("""DROP TABLE boardgame_ratings_daily;""")
+
+            curs.execute("""SELECT id FROM boardgames ORDER BY rank LIMIT 1;""")
+
+            top_game = curs.fetchone()[0]
+
+    conn.close()
+
+    query_executor.use_database(db)
+
+    try:
+
+        for mode, query in (('trajectory', lambda: rating_history.
+                                              rating_trajectory(top_game)),
+                            ('movers', lambda: rating_history.biggest_movers(
+                                                   days[0], days[-1],
+                                                   'num_voters'))):
+
+            best = None
+
+            for repeat in range(repeats):
+
+                start = time.time()
+
+                query()
+
+                elapsed = time.time() - start
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            times[mode] = best
+
+    finally:
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    print '\nRating history of', num_days, 'days'
+
+    print '  %-10s %9d rows %7.2f MB' % ('delta', history_rows,
+                                          history_size/1e6)
+
+    print '  %-10s %9d rows %7.2f MB' % ('daily', daily_rows, daily_size/1e6)
+
+    print '  %-10s %9.2f s' % ('record', times['record'])
+
+    for mode in ('trajectory', 'movers'):
+
+        print '  %-10s %9.2f ms' % (mode, times[mode]*1000)
+
+    return times
+
+
+def _analysis_session():
+    '''
+    A few typical data_analysis calls from the notebooks
+    '''
+
+    data_analysis.count_column('mechanics')
+
+    data_analysis.list_of_unique_items_for_rank('categories', 100)
+
+    data_analysis.time_vs_complexity(300)
+
+    data_analysis.avg_geek_rating_playtime_per_mechanic(1001, sortby='geek')
+
+    for item_name in ('Dice Rolling', 'Hand Management', 'Worker Placement'):
+
+        data_analysis.geek_rating_comp_rating_for_item_in_column('mechanics',
+                                                                 item_name,
+                                                                 100)
+
+
+def _per_item_queries(column, num_voters=0):
+    '''
+    The queries scatter_plot_geekr_vs_complxr() ran before it was batched
+    '''
+
+    for item_name, game_count in data_analysis.count_column(column):
+
+        data_analysis.geek_rating_comp_rating_for_item_in_column(column,
+                                                                 item_name,
+                                                                 num_voters)
+
+        data_analysis.num_voters_for_item_in_column(column, item_name,
+                                                    num_voters)
+
+
+def _count_items(column, db):
+
+    table, item = dict(normalize_database.LINK_TABLES)[column]
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""SELECT COUNT(DISTINCT """ + item + """)
+                            FROM """ + table + """;""")
+
+            return curs.fetchone()[0]
+
+
+def _load_bench_catalog(db, num_games=None):
+    '''
+    Fill db with the games of BGG_GameList_tabbed.csv (details made up by
+    the stand-in) and normalize it, like a finished scrape would
+    '''
+
+    _reset_boardgames_table(db)
+
+    conn = psycopg2.connect(db)
+
+    for bg_dicts in _parsed_chunks(num_games, 100):
+
+        with conn:
+            with conn.cursor() as curs:
+
+                bg_scraper.copy_to_table(curs, bg_dicts)
+
+    conn.close()
+
+    normalize_database.normalize_database(db=db)
+
+
+def _parsed_chunks(num_games, chunk_size):
+    '''
+    bg_dicts for the games in BGG_GameList_tabbed.csv, chunk by chunk, with
+    the details made up by the stand-in's XML API
+    '''
+
+    server = bgg_stand_in.StandInServer()
+
+    server.stop()
+
+    chunks = []
+
+    for labels, bg_list in bg_scraper.iter_csv_chunks('BGG_GameList_tabbed.csv',
+                                                      chunk_size, num_games):
+
+        bgID_list = bg_scraper.game_ids_from_chunk(labels, bg_list)
+
+        xml_content = server.render_boardgames_xml(bgID_list)
+
+        chunks.append(bg_scraper.parse_chunk(xml_content, bg_list,
+                                             bgID_list)[0])
+
+    return chunks
+
+
+def _peak_memory_kb(func, *args):
+    '''
+    Growth of the max resident set size while func(*args) runs, measured in
+    a forked child so earlier runs don't hide it
+    '''
+
+    def child(result_queue):
+
+        gc.collect()
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        func(*args)
+
+        after  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        result_queue.put(after - before)
+
+    result_queue = multiprocessing.Queue()
+
+    process = multiprocessing.Process(target=child, args=(result_queue,))
+
+    process.start()
+
+    peak = result_queue.get()
+
+    process.join()
+
+    return peak
+
+
+def _reset_boardgames_table(db):
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""DROP TABLE IF EXISTS boardgames CASCADE;""")
+
+    bg_scraper.create_table_in_database(db)
+
+
+def _dump_boardgames_table(db):
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""SELECT * FROM boardgames ORDER BY id;""")
+
+            return curs.fetchall()
+
+
+if __name__ == '__main__':
+
+    bench_top_games_crawl()
+
+    bench_xmlapi_scrape()
+
+    bench_xmlapi2_scrape()
+
+    bench_adaptive_chunks()
+
+    bench_flaky_xmlapi()
+
+    bench_db_writer()
+
+    bench_response_cache()
+
+    bench_delta_rescrape()
+
+    bench_list_page_parse()
+
+    bench_game_list_lookup()
+
+    bench_xml_parse()
+
+    bench_db_load()
+
+    bench_incremental_normalize()
+
+    bench_analysis_pooling()
+
+    bench_batched_item_queries()
+
+    bench_game_store()
+
+    bench_rank_bands()
+
+    bench_query_cache()
+
+    bench_plot_data_prep()
+
+    bench_streaming_fetch()
+
+    bench_snapshot_load()
+
+    bench_rating_history()
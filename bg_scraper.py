@@ -6,10 +6,20 @@
 
 import requests
 from bs4 import BeautifulSoup
+import hashlib
+import os
 import time
+import threading
+import Queue
 import numpy as np
 import csv
+from io import BytesIO
+from collections import OrderedDict
 import psycopg2
+from bgg_http import TokenBucket, fetch, sends_request, CacheMiss, ChunkSizer,\
+                     fetch_with_retry
+import bgg_xml
+from game_list import GameList
 
 # Global Variables
 
@@ -17,177 +27,2042 @@ WAIT_TIME_BETWEEN_REQUESTS = 2 # seconds
 
 BGG_XMLAPI = 'https://www.boardgamegeek.com/xmlapi/boardgame/'
 
+BGG_XMLAPI2 = 'https://boardgamegeek.com/xmlapi2/'
+
 DATABASE = "dbname = 'bggdb'" # edit this if you need more info to connect to db
 
+# Requests sent for one chunk before giving up on it, and the backoff
+#   before the first retry (doubled for every next one, see
+#   bgg_http.fetch_with_retry())
+FETCH_ATTEMPTS = 5
+
+FETCH_BASE_DELAY = 2. # seconds
+
+# Set to False to go back to one request per chunk and no splitting of
+#   failed chunks (used by the benchmarks for the before picture)
+RETRY_FAILED_CHUNKS = True
+
+# Per item rollups of the boardgames numbers by rank band, made by
+#   normalize_database.py. A scrape changes the numbers, so the scrapers
+#   refresh it at the end if it exists.
+RANK_BANDS_VIEW = 'item_rank_bands'
+
+# Sequence moved on whenever boardgames or the normalized tables change, so
+#   cached analysis results (see query_cache.py) know they are stale
+DATA_VERSION_SEQUENCE = 'data_version'
+
+# Marks the end of the work flowing through a stage of the pipelined scraper
+_END_OF_STAGE = object()
+
+# Columns of the boardgames table, in the order they were created
+BOARDGAMES_COLUMNS = ['id', 'rank', 'name', 'href', 'pub_year', 'geek_rating',
+                      'avg_rating', 'num_voters', 'min_players', 'max_players',
+                      'play_time', 'sugg_age', 'complx_rating', 'designers',
+                      'artists', 'categories', 'mechanics', 'family', 'type']
+
+# Columns of the boardgames table that come from the browse pages (the csv
+#   file made by collect_games.py) rather than the XML API
+BROWSE_COLUMNS = ['id', 'rank', 'name', 'href', 'pub_year', 'geek_rating',
+                  'avg_rating', 'num_voters']
+
+# Columns of the boardgames table that hold text arrays
+ARRAY_COLUMNS = ['designers', 'artists', 'categories', 'mechanics', 'family',
+                 'type']
+
+# Checkpoints of scrape_bg_stats(). Every chunk gets a row listing the csv
+#   rows (1 = first game after the header) it covered, written in the same
+#   transaction as the chunk's games when it succeeds.
+#   Games that still failed on their own after their chunk was split up
+#   end up in scrape_dead_letters, until a later run scrapes them.
+JOURNAL_SQL = """
+    CREATE TABLE IF NOT EXISTS scrape_journal (
+        chunk_id   serial PRIMARY KEY,
+        run        text NOT NULL,          -- csv file name unless given
+        csv_rows   int[] NOT NULL,
+        status     text NOT NULL,          -- 'done' or 'failed'
+        skipped    int,                    -- erroneously labeled games
+        error      text,
+        logged_at  timestamptz NOT NULL DEFAULT now()
+    );
+
+    CREATE TABLE IF NOT EXISTS scrape_dead_letters (
+        run        text NOT NULL,
+        bg_id      int NOT NULL,
+        csv_row    int,
+        error      text,
+        failures   int NOT NULL DEFAULT 1, -- runs it failed in
+        logged_at  timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (run, bg_id)
+    );
+"""
+
+
+def create_table_in_database(db=DATABASE):
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""CREATE TABLE boardgames (
+                                    id int PRIMARY KEY,
+                                    rank           int,
+                                    name          text,
+                                    href          text,
+                                    pub_year       int,
+                                    geek_rating   real,
+                                    avg_rating    real,
+                                    num_voters     int,
+                                    min_players    int,
+                                    max_players    int,
+                                    play_time      int,
+                                    sugg_age       int, -- suggested age
+                                    complx_rating real, -- complexity rating
+                                    designers   text[],
+                                    artists     text[],
+                                    categories  text[],
+                                    mechanics  text[],
+                                    family      text[],
+                                    type        text[]
+                                    );""")
+
+            print "Table succesfully created"
+
+def scrape_bg_stats(csv_file_name, chunk_size, num_bgs = None, db=DATABASE,
+                    xmlapi=BGG_XMLAPI, wait_time=WAIT_TIME_BETWEEN_REQUESTS,
+                    resume=False, run_name=None, write_batch_size=None):
+    '''
+    csv_file_name = Name of the csv file that was created inside the 
+                    collect_games.py script
+                    (string)
+
+    chunk_size    = The number of boardgames to request in a single XMLAPI call,
+                    or a bgg_http.ChunkSizer to let the number adapt to how
+                    fast (and how big) the responses come back
+                    (int or ChunkSizer)
+
+    num_bgs       = If you don't want every single game in the csv file to be
+                    scraped, provide an integer telling it the total amount.
+                    (int)
+
+    db            = name of the database to connect to
+
+    xmlapi        = url of the XML API, only needs changing to point at a
+                    local stand-in server
+                    (string)
+
+    wait_time     = seconds to sleep between XML API requests
+                    (float)
+
+    resume        = carry on with an earlier scrape of the same run that
+                    died or had failed chunks: games it already wrote are
+                    not requested again, failed chunks are retried
+                    (bool)
+
+    run_name      = name the progress is journaled under in the
+                    scrape_journal table, the csv file's name if not given
+                    (string)
+
+    write_batch_size = hand the parsed chunks to a DatabaseWriter thread that
+                    commits this many games at a time, so requests don't
+                    wait on the database, or the DatabaseWriter itself (not
+                    started yet). None writes every chunk before the next
+                    request.
+                    (int or DatabaseWriter)
+
+    Without resume the journal (and dead letters) of the run are cleared
+    and everything is scraped. A chunk whose request keeps failing is
+    split up and retried piece by piece (see scrape_or_split()), the games
+    that fail on their own are dead lettered. A chunk that fails anyway
+    (eg. BGG can't be reached) is journaled as failed and the scrape moves
+    on to the next one.
+    '''
+
+    if run_name is None:
+
+        run_name = os.path.basename(csv_file_name)
+
+    # Keeping track of how many chunks of boardgames are being scraped
+    i = 0
+
+    # Keeping track of how many erroneously labeled games had to be skipped
+    total_skipped = 0
+
+    failed_chunks = 0
+
+    # Keeping track of how many games have been sent to the XML API
+    games_requested = 0
+
+    # Games that failed even on their own, see scrape_or_split()
+    dead_lettered = 0
+
+    chunk_sizer = chunk_size if isinstance(chunk_size, ChunkSizer) else None
+
+    # One connection for the whole scrape, every chunk commits on its own
+    conn = psycopg2.connect(db)
+
+    if isinstance(write_batch_size, DatabaseWriter):
+
+        writer = write_batch_size.start()
+
+    else:
+
+        writer = DatabaseWriter(db, write_batch_size).start() \
+                     if write_batch_size else None
+
+    try:
+
+        with conn:
+            with conn.cursor() as cursor:
+
+                cursor.execute(JOURNAL_SQL)
+
+                if resume:
+
+                    done_rows = _journaled_rows(cursor, run_name)
+
+                else:
+
+                    cursor.execute("""DELETE FROM scrape_journal
+                                      WHERE run = %s;""", (run_name,))
+
+                    cursor.execute("""DELETE FROM scrape_dead_letters
+                                      WHERE run = %s;""", (run_name,))
+
+                    done_rows = set()
+
+        num_games = _count_csv_games(csv_file_name, num_bgs)
+
+        if done_rows:
+
+            print "\nResuming", run_name + ":", len(done_rows),\
+                  "games already scraped"
+
+            num_games -= len([row for row in done_rows if row <= num_games])
+
+        for labels, csv_rows, bg_list in iter_csv_row_chunks(csv_file_name,
+                                                             chunk_size,
+                                                             num_bgs,
+                                                             done_rows):
+
+            # No need to wait if the chunk is in the response cache
+            if i > 0 and sends_request(chunk_url(game_ids_from_chunk(labels,
+                                                                     bg_list),
+                                                 xmlapi)):
+
+                time.sleep(wait_time)
+
+            i += 1
+
+            games_requested += len(bg_list)
+
+            print "\nScraping chunk", i, "(" + str(len(bg_list)), "games,",\
+                  games_requested, "of", num_games, "so far)"
+
+            try:
+
+                chunk_skipped, chunk_dead = scrape_or_split(labels, bg_list,
+                                                   db, xmlapi, conn, run_name,
+                                                   csv_rows, wait_time,
+                                                   chunk_sizer=chunk_sizer,
+                                                   writer=writer)
+
+                total_skipped += chunk_skipped
+
+                dead_lettered += len(chunk_dead)
+
+            except Exception as error:
+
+                # Nothing more can be written
+                if writer is not None and writer.error is not None:
+
+                    raise
+
+                failed_chunks += 1
+
+                # The whole error goes in the journal
+                print "Chunk", i, "failed:", error.__class__.__name__
+
+                with conn:
+                    with conn.cursor() as cursor:
+
+                        _journal_chunk(cursor, run_name, csv_rows, 'failed',
+                                       error=repr(error))
+
+        if writer is not None:
+
+            writer.close()
+
+    finally:
+
+        if writer is not None:
+
+            writer.close(raise_error=False)
+
+        conn.close()
+
+    print "\nTotal Number of Erroneously Labeled Games Skipped:", total_skipped
+
+    if writer is not None:
+
+        writer.report()
+
+    if chunk_sizer is not None:
+
+        chunk_sizer.report()
+
+    if failed_chunks:
+
+        print failed_chunks, "chunks failed, run again with resume=True to",\
+              "retry them"
+
+    if dead_lettered:
+
+        print dead_lettered, "games failed on their own (see dead_letters('" +\
+              run_name + "')), resume=True retries them too"
+
+    data_changed(db)
+
+def scrape_changed_games(csv_file_name, chunk_size, db=DATABASE,
+                         xmlapi=BGG_XMLAPI, wait_time=WAIT_TIME_BETWEEN_REQUESTS,
+                         rating_threshold=0.01, voters_threshold=0.05,
+                         run_name=None):
+    '''
+    Bring an already scraped boardgames table up to date with a newer crawl
+    of the browse pages, only asking the XML API about the games that need
+    it.
+
+    Every game in the csv file is compared with its row in boardgames using
+    a fingerprint of the browse page columns (BROWSE_COLUMNS):
+
+        new       not in boardgames yet -> scraped
+        changed   geek_rating or avg_rating moved more than
+                  rating_threshold, or num_voters by more than
+                  voters_threshold of the stored count -> scraped again
+                  and the row replaced
+        updated   some other browse page column differs (rank, name, small
+                  rating drift) -> browse columns updated straight from the
+                  csv file, no request
+        unchanged same fingerprint -> left alone
+
+    Games that dropped out of the csv file are left in the table. Changes
+    that only show up in the XML API (eg. new mechanics) can't be seen from
+    the browse pages, a full scrape_bg_stats() is needed for those.
+
+    csv_file_name    = csv file from a fresh run of collect_games.py
+                       (string)
+
+    chunk_size       = The number of boardgames to request in a single
+                       XMLAPI call, or a bgg_http.ChunkSizer to let it adapt
+                       (int or ChunkSizer)
+
+    db               = name of the database to connect to
+
+    xmlapi           = url of the XML API
+                       (string)
+
+    wait_time        = seconds to sleep between XML API requests
+                       (float)
+
+    rating_threshold = smallest change of geek_rating/avg_rating worth a
+                       request
+                       (float)
+
+    voters_threshold = smallest change of num_voters worth a request, as a
+                       fraction of the stored num_voters
+                       (float)
+
+    run_name         = name games that fail on their own are dead lettered
+                       under (see scrape_or_split()), the csv file's name if
+                       not given
+                       (string)
+
+    Returns a dict with the number of games in each group, plus 'dropped'
+    (in boardgames but not in the csv file) and 'failed' (games in chunks
+    that couldn't be scraped, dead lettered ones included)
+    '''
+
+    start_time = time.time()
+
+    if run_name is None:
+
+        run_name = os.path.basename(csv_file_name)
+
+    conn = psycopg2.connect(db)
+
+    try:
+
+        with conn:
+            with conn.cursor() as cursor:
+
+                cursor.execute(JOURNAL_SQL)
+
+                stored = _stored_fingerprints(cursor)
+
+        counts = {'new': 0, 'changed': 0, 'updated': 0, 'unchanged': 0,
+                  'failed': 0}
+
+        # Rows that need the XML API, and browse column updates
+        to_scrape = []
+
+        to_update = []
+
+        with open(csv_file_name, 'rb') as csv_file:
+
+            csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+            labels = csv_contents.next()
+
+            bg_index = labels.index('HRef')
+
+            seen = set()
+
+            for row in csv_contents:
+
+                bgID = row[bg_index].split('/')[2]
+
+                values = _browse_values(_scrape_csv_row(row, bgID))
+
+                seen.add(values[0])
+
+                if values[0] not in stored:
+
+                    counts['new'] += 1
+
+                    to_scrape.append(row)
+
+                    continue
+
+                fingerprint, old_values = stored[values[0]]
+
+                if fingerprint == _browse_fingerprint(values):
+
+                    counts['unchanged'] += 1
+
+                elif _browse_values_moved(old_values, values, rating_threshold,
+                                          voters_threshold):
+
+                    counts['changed'] += 1
+
+                    to_scrape.append(row)
+
+                else:
+
+                    counts['updated'] += 1
+
+                    to_update.append(_scrape_csv_row(row, bgID))
+
+        counts['dropped'] = len(set(stored) - seen)
+
+        if to_update:
+
+            with conn:
+                with conn.cursor() as cursor:
+
+                    update_browse_columns(cursor, to_update)
+
+        chunk_sizer = chunk_size if isinstance(chunk_size, ChunkSizer)\
+                      else None
+
+        i = 0
+
+        while i < len(to_scrape):
+
+            bg_list = to_scrape[i:i+_chunk_length(chunk_size)]
+
+            if i > 0 and sends_request(chunk_url(game_ids_from_chunk(labels,
+                                                                     bg_list),
+                                                 xmlapi)):
+
+                time.sleep(wait_time)
+
+            i += len(bg_list)
+
+            print "\nScraping", len(bg_list), "games,", i, "of",\
+                  len(to_scrape), "so far"
+
+            try:
+
+                chunk_dead = scrape_or_split(labels, bg_list, db, xmlapi,
+                                             conn, run_name,
+                                             wait_time=wait_time, upsert=True,
+                                             chunk_sizer=chunk_sizer)[1]
+
+                counts['failed'] += len(chunk_dead)
+
+            except Exception as error:
+
+                counts['failed'] += len(bg_list)
+
+                print "Chunk failed:", error.__class__.__name__
+
+    finally:
+
+        conn.close()
+
+    print "\nNew:", counts['new'], " Changed:", counts['changed'],\
+          " Updated without a request:", counts['updated'],\
+          " Unchanged:", counts['unchanged'], " Dropped off the list:",\
+          counts['dropped']
+
+    if chunk_sizer is not None:
+
+        chunk_sizer.report()
+
+    if counts['failed']:
+
+        print counts['failed'], "games could not be scraped"
+
+    data_changed(db)
+
+    print "Total time:", time.time() - start_time, "seconds"
+
+    return counts
+
+def _stored_fingerprints(cursor):
+    '''
+    id -> (fingerprint, browse column values) for every game in boardgames
+    '''
+
+    cursor.execute('SELECT ' + ', '.join(BROWSE_COLUMNS) + ' FROM boardgames;')
+
+    stored = {}
+
+    for row_tuple in cursor.fetchall():
+
+        values = tuple(_to_unicode(value) if isinstance(value, str) else value
+                       for value in row_tuple)
+
+        stored[values[0]] = (_browse_fingerprint(values), values)
+
+    return stored
+
+def _browse_values(bg_dict):
+    '''
+    Browse columns of a bg_dict made from the csv file, typed the way they
+    come back from the database
+    '''
+
+    values = []
+
+    for column in BROWSE_COLUMNS:
+
+        value = bg_dict[column]
+
+        if value is None:
+
+            values.append(None)
+
+        elif column in ('geek_rating', 'avg_rating'):
+
+            values.append(float(value))
+
+        elif column in ('name', 'href'):
+
+            values.append(_to_unicode(value))
+
+        else:
+
+            values.append(int(value))
+
+    return tuple(values)
+
+def _browse_fingerprint(values):
+
+    # boardgames stores ratings as real, so don't let float noise count
+    rounded = tuple(round(value, 4) if isinstance(value, float) else value
+                    for value in values)
+
+    return hashlib.md5(repr(rounded)).digest()
+
+def _browse_values_moved(old_values, new_values, rating_threshold,
+                         voters_threshold):
+    '''
+    True if the ratings or number of voters changed enough to request the
+    game again
+    '''
+
+    geek_index   = BROWSE_COLUMNS.index('geek_rating')
+
+    avg_index    = BROWSE_COLUMNS.index('avg_rating')
+
+    voters_index = BROWSE_COLUMNS.index('num_voters')
+
+    for i in (geek_index, avg_index, voters_index):
+
+        if (old_values[i] is None) != (new_values[i] is None):
+
+            return True
+
+    for i in (geek_index, avg_index):
+
+        if old_values[i] is not None and \
+           abs(new_values[i] - old_values[i]) > rating_threshold:
+
+            return True
+
+    old_voters, new_voters = old_values[voters_index], new_values[voters_index]
+
+    return old_voters is not None and \
+           abs(new_voters - old_voters) > voters_threshold*old_voters
+
+def scrape_things(bg_ids, chunk_size=20, db=DATABASE, xmlapi2=BGG_XMLAPI2,
+                  wait_time=WAIT_TIME_BETWEEN_REQUESTS, upsert=True,
+                  run_name='xmlapi2'):
+    '''
+    Scrape games from XML API2's thing?stats=1 alone, no csv file needed.
+
+    Its response has the name, year, rank and ratings next to everything
+    the legacy XML API has, so every boardgames column comes from the one
+    batched request and the browse pages don't have to be crawled first.
+    Any list of ID's works: the ones already in boardgames to refresh
+    them, or a plain range of ID's (ones that aren't board games are left
+    out by BGG). href is /boardgame/<id>, which BGG redirects to the page
+    of the game.
+
+    Chunks that fail after their retries are split and single games dead
+    lettered under run_name, like scrape_or_split().
+
+    bg_ids     = board game ID's to request
+                 (iterable of ints or strings)
+
+    chunk_size = The number of boardgames to request in a single call
+                 (BGG answers at most 20), or a bgg_http.ChunkSizer to let it
+                 adapt
+                 (int or ChunkSizer)
+
+    db         = name of the database to connect to
+
+    xmlapi2    = url of XML API2
+                 (string)
+
+    wait_time  = seconds to sleep between requests
+                 (float)
+
+    upsert     = replace games that are already in boardgames
+                 (bool)
+
+    Returns a dict with the number of games 'written', 'not_found' (no
+    such board game) and 'failed'
+    '''
+
+    start_time = time.time()
+
+    bg_ids = [str(bgID) for bgID in bg_ids]
+
+    chunk_sizer = chunk_size if isinstance(chunk_size, ChunkSizer) else None
+
+    counts = {'written': 0, 'not_found': 0, 'failed': 0}
+
+    conn = psycopg2.connect(db)
+
+    def scrape_piece(piece, piece_rows):
+
+        return scrape_list_of_things(piece, db, xmlapi2, conn, upsert,
+                                     chunk_sizer)
+
+    try:
+
+        with conn:
+            with conn.cursor() as cursor:
+
+                cursor.execute(JOURNAL_SQL)
+
+        i = 0
+
+        while i < len(bg_ids):
+
+            bgID_list = bg_ids[i:i+_chunk_length(chunk_size)]
+
+            if i > 0 and sends_request(thing_url(bgID_list, xmlapi2)):
+
+                time.sleep(wait_time)
+
+            i += len(bgID_list)
+
+            print "\nScraping", len(bgID_list), "games,", i, "of",\
+                  len(bg_ids), "so far"
+
+            try:
+
+                not_found, chunk_dead = _scrape_in_pieces(scrape_piece,
+                                                          bgID_list, bgID_list,
+                                                          conn, run_name,
+                                                          wait_time=wait_time)
+
+            except Exception as error:
+
+                counts['failed'] += len(bgID_list)
+
+                print "Chunk failed:", error.__class__.__name__
+
+                continue
+
+            counts['not_found'] += not_found
+
+            counts['failed'] += len(chunk_dead)
+
+            counts['written'] += len(bgID_list) - not_found - len(chunk_dead)
+
+    finally:
+
+        conn.close()
+
+    print "\nWritten:", counts['written'], " Not board games:",\
+          counts['not_found'], " Failed:", counts['failed']
+
+    if chunk_sizer is not None:
+
+        chunk_sizer.report()
+
+    data_changed(db)
+
+    print "Total time:", time.time() - start_time, "seconds"
+
+    return counts
+
+def scrape_bg_stats_pipelined(csv_file_name, chunk_size, num_bgs = None,
+                              db=DATABASE, num_fetchers=2,
+                              requests_per_second=1./WAIT_TIME_BETWEEN_REQUESTS,
+                              xmlapi=BGG_XMLAPI, queue_size=4,
+                              write_batch_size=None):
+    '''
+    Same job as scrape_bg_stats() but the work is split into three stages
+    that run at the same time, each in its own thread(s):
+
+        fetch : request chunks from the XML API (num_fetchers threads)
+        parse : turn the XML of a fetched chunk into bg_dicts
+        write : insert parsed chunks into the database over one connection
+                (a DatabaseWriter)
+
+    So while one chunk is being written, the next is being parsed and the
+    one after that is being downloaded. The stages are joined by bounded
+    queues, so a slow stage holds back the ones in front of it instead of
+    piling up chunks in memory. The fetchers share a token bucket, which
+    makes the request rate (not the sum of network, parse and db time) the
+    thing that decides how long a scrape takes.
+
+    csv_file_name       = Name of the csv file that was created inside the 
+                          collect_games.py script
+                          (string)
+
+    chunk_size          = The number of boardgames to request in a single
+                          XMLAPI call
+                          (int)
+
+    num_bgs             = If you don't want every single game in the csv file
+                          to be scraped, provide an integer telling it the
+                          total amount.
+                          (int)
+
+    db                  = name of the database to connect to
+
+    num_fetchers        = Number of XML API requests allowed in flight at once
+                          (int)
+
+    requests_per_second = Maximum rate of XML API requests
+                          (float)
+
+    xmlapi              = url of the XML API, only needs changing to point at
+                          a local stand-in server
+                          (string)
+
+    queue_size          = Number of chunks that can wait between two stages
+                          (int)
+
+    write_batch_size    = Games per commit, chunk_size if not given
+                          (int)
+    '''
+
+    start_time = time.time()
+
+    bucket      = TokenBucket(requests_per_second)
+
+    fetch_queue = Queue.Queue(queue_size)
+
+    parse_queue = Queue.Queue(queue_size)
+
+    writer      = DatabaseWriter(db, write_batch_size or chunk_size, queue_size)
+
+    stop_event  = threading.Event()
+
+    # Filled in by the stages: exceptions raised, games skipped
+    errors = []
+
+    totals = {'skipped': 0}
+
+    stages = [threading.Thread(target=_fetch_stage,
+                               args=(fetch_queue, parse_queue, bucket, xmlapi,
+                                     stop_event, errors))
+              for _ in range(num_fetchers)]
+
+    stages.append(threading.Thread(target=_parse_stage,
+                                   args=(parse_queue, writer, num_fetchers,
+                                         stop_event, errors, totals)))
+
+    writer.start()
+
+    for stage in stages:
+
+        stage.daemon = True
+
+        stage.start()
+
+    try:
+
+        for i, (labels, bg_list) in enumerate(iter_csv_chunks(csv_file_name,
+                                                              chunk_size,
+                                                              num_bgs)):
+
+            _put(fetch_queue, (i + 1, game_ids_from_chunk(labels, bg_list),
+                               bg_list), stop_event)
+
+            if stop_event.is_set():
+
+                break
+
+        for _ in range(num_fetchers):
+
+            _put(fetch_queue, _END_OF_STAGE, stop_event)
+
+        for stage in stages:
+
+            while stage.is_alive():
+
+                stage.join(1)
+
+    except KeyboardInterrupt:
+
+        stop_event.set()
+
+        raise
+
+    finally:
+
+        writer.close(raise_error=False)
+
+    if errors:
+
+        raise errors[0]
+
+    if writer.error is not None:
+
+        raise writer.error
+
+    data_changed(db)
+
+    total_time = time.time() - start_time
+
+    print "\nGames Written:", writer.metrics()['games_written'], "in",\
+          total_time, "seconds"
+
+    writer.report()
+
+    print "\nTotal Number of Erroneously Labeled Games Skipped:",\
+                                                        totals['skipped']
+
+def _fetch_stage(fetch_queue, parse_queue, bucket, xmlapi, stop_event, errors):
+
+    try:
+
+        while True:
+
+            item = _get(fetch_queue, stop_event)
+
+            if item is _END_OF_STAGE:
+
+                break
+
+            chunk_num, bgID_list, bg_list = item
+
+            url = chunk_url(bgID_list, xmlapi)
+
+            # Chunks in the response cache don't count against the rate
+            #   limit, throttled responses slow the bucket down
+            r = fetch_with_retry(url, FETCH_ATTEMPTS, FETCH_BASE_DELAY, bucket)
+
+            r.raise_for_status()
+
+            bucket.relax()
+
+            print "Fetched chunk", chunk_num
+
+            _put(parse_queue, (chunk_num, bgID_list, bg_list, r.content),
+                 stop_event)
+
+    except Exception as error:
+
+        errors.append(error)
+
+        stop_event.set()
+
+    finally:
+
+        _put(parse_queue, _END_OF_STAGE, stop_event)
+
+def _parse_stage(parse_queue, writer, num_fetchers, stop_event, errors,
+                 totals):
+
+    fetchers_done = 0
+
+    try:
+
+        while fetchers_done < num_fetchers:
+
+            item = _get(parse_queue, stop_event)
+
+            if item is _END_OF_STAGE:
+
+                fetchers_done += 1
+
+                continue
+
+            chunk_num, bgID_list, bg_list, xml_content = item
+
+            bg_dicts, games_skipped = parse_chunk(xml_content, bg_list,
+                                                  bgID_list)
+
+            totals['skipped'] += games_skipped
+
+            writer.write(bg_dicts)
+
+    except Exception as error:
+
+        errors.append(error)
+
+        stop_event.set()
+
+def _put(queue, item, stop_event):
+    '''
+    queue.put() that gives up once the pipeline has been stopped, so a stage
+    never hangs on a full queue after the stage after it has died
+    '''
+
+    while not stop_event.is_set():
+
+        try:
+
+            queue.put(item, timeout=0.1)
+
+            return
+
+        except Queue.Full:
+
+            pass
+
+def _get(queue, stop_event):
+    '''
+    queue.get() that returns _END_OF_STAGE once the pipeline has been stopped
+    '''
+
+    while not stop_event.is_set():
+
+        try:
+
+            return queue.get(timeout=0.1)
+
+        except Queue.Empty:
+
+            pass
+
+    return _END_OF_STAGE
+
+class DatabaseWriter(object):
+    '''
+    Thread that writes parsed chunks to boardgames over one long-lived
+    connection, so the thread requesting chunks never waits on the
+    database.
+
+    Chunks handed to write() go on a bounded queue. The writer thread
+    takes them off and writes them in batches: one COPY and one commit for
+    at least batch_size games, or for whatever has arrived once the queue
+    has been quiet for max_wait seconds. A chunk's scrape_journal entry is
+    committed together with its games, so a batch that fails leaves its
+    chunks for resume=True. If the queue fills up (the database is slower
+    than BGG), write() blocks until there is room again.
+
+    db         : database to connect to
+
+    batch_size : games per commit
+                 (Type: int)
+
+    queue_size : chunks that can wait to be written
+                 (Type: int)
+
+    max_wait   : seconds a part filled batch waits for more chunks
+                 (Type: float)
+
+    Use as a context manager, or call start() and close(). An error in the
+    writer thread is raised by the next write() or by close().
+    '''
+
+    def __init__(self, db=DATABASE, batch_size=500, queue_size=8,
+                 max_wait=1.):
+
+        self.db = db
+
+        self.batch_size = batch_size
+
+        self.max_wait = max_wait
+
+        self._queue = Queue.Queue(queue_size)
+
+        self._lock = threading.Lock()
+
+        self._thread = None
+
+        # Exception that stopped the writer thread, if any
+        self.error = None
+
+        # Queue depth as seen by every write(), and time spent waiting for
+        #   room in the queue
+        self._depth_samples = 0
+
+        self._depth_total = 0
+
+        self._max_depth = 0
+
+        self._put_wait = 0.
+
+        self._chunks = 0
+
+        self._batches = 0
+
+        self._games_written = 0
+
+        self._write_time = 0.
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self._run)
+
+        self._thread.daemon = True
+
+        self._thread.start()
+
+        return self
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        # Don't hide the error that got us here behind a writer error
+        self.close(raise_error=exc_type is None)
+
+    def write(self, bg_dicts, journal_entry=None, skipped=0, upsert=False):
+        '''
+        Queue a chunk of bg_dicts to be written
+
+        journal_entry = (run name, csv row numbers) to journal as done with
+                        the chunk, see scrape_list_of_games()
+                        (tuple)
+
+        skipped       = erroneously labeled games of the chunk, for the
+                        journal
+                        (int)
+
+        upsert        = replace games that are already in boardgames
+                        (bool)
+        '''
+
+        item = (bg_dicts, journal_entry, skipped, upsert)
+
+        start = time.time()
+
+        with self._lock:
+
+            depth = self._queue.qsize()
+
+            self._depth_samples += 1
+
+            self._depth_total += depth
+
+            self._max_depth = max(self._max_depth, depth)
+
+        while True:
+
+            self._raise_error()
+
+            try:
+
+                self._queue.put(item, timeout=0.1)
+
+                break
+
+            except Queue.Full:
+
+                pass
+
+        with self._lock:
+
+            self._put_wait += time.time() - start
+
+            self._chunks += 1
+
+    def close(self, raise_error=True):
+        '''
+        Write whatever is still queued and stop the writer thread
+        '''
+
+        if self._thread is not None:
+
+            while self._thread.is_alive():
+
+                try:
+
+                    self._queue.put(_END_OF_STAGE, timeout=0.1)
+
+                    break
+
+                except Queue.Full:
+
+                    pass
+
+            while self._thread.is_alive():
+
+                self._thread.join(1)
+
+            self._thread = None
+
+        if raise_error:
+
+            self._raise_error()
+
+    def metrics(self):
+        '''
+        Dict of how the writer has been doing:
+
+            queue_depth       chunks waiting right now
+            max_queue_depth   most chunks ever found waiting by write()
+            mean_queue_depth  average chunks found waiting by write()
+            put_wait_seconds  time write() spent blocked on a full queue
+            chunks, batches   chunks queued, commits made
+            games_written     games committed
+            write_seconds     time the writer thread spent writing and
+                              committing
+        '''
+
+        with self._lock:
+
+            return {'queue_depth'     : self._queue.qsize(),
+                    'max_queue_depth' : self._max_depth,
+                    'mean_queue_depth': float(self._depth_total) /
+                                        max(self._depth_samples, 1),
+                    'put_wait_seconds': self._put_wait,
+                    'chunks'          : self._chunks,
+                    'batches'         : self._batches,
+                    'games_written'   : self._games_written,
+                    'write_seconds'   : self._write_time}
+
+    def report(self):
+
+        metrics = self.metrics()
+
+        print "\nDatabase writer:", metrics['games_written'], "games in",\
+              metrics['batches'], "commits (" +\
+              str(round(metrics['write_seconds'], 2)), "s writing), queue",\
+              "depth mean", round(metrics['mean_queue_depth'], 2), "max",\
+              metrics['max_queue_depth'], "(" +\
+              str(round(metrics['put_wait_seconds'], 2)), "s waiting for room)"
+
+    def _raise_error(self):
+
+        if self.error is not None:
+
+            raise self.error
+
+    def _run(self):
+
+        batch = []
+
+        batch_games = 0
+
+        try:
+
+            with psycopg2.connect(self.db) as conn:
+
+                while True:
+
+                    try:
+
+                        item = self._queue.get(timeout=self.max_wait if batch
+                                               else None)
+
+                    except Queue.Empty:
+
+                        # Quiet for max_wait, don't sit on a part filled batch
+                        item = None
+
+                    if item is not None and item is not _END_OF_STAGE:
+
+                        batch.append(item)
+
+                        batch_games += len(item[0])
+
+                        if batch_games < self.batch_size:
+
+                            continue
+
+                    if batch:
+
+                        self._write_batch(conn, batch)
+
+                        batch = []
+
+                        batch_games = 0
+
+                    if item is _END_OF_STAGE:
+
+                        break
+
+        except Exception as error:
+
+            self.error = error
+
+            # Let a write() blocked on the full queue see the error
+            while True:
+
+                try:
+
+                    self._queue.get_nowait()
+
+                except Queue.Empty:
+
+                    break
+
+    def _write_batch(self, conn, batch):
+
+        start = time.time()
+
+        with conn:
+            with conn.cursor() as cursor:
+
+                for upsert in (False, True):
+
+                    write_chunk(cursor, [bg_dict for bg_dicts, journal_entry,
+                                                     skipped, item_upsert
+                                         in batch if item_upsert == upsert
+                                         for bg_dict in bg_dicts], upsert)
+
+                for bg_dicts, journal_entry, skipped, upsert in batch:
+
+                    if journal_entry is not None:
+
+                        _journal_chunk(cursor, journal_entry[0],
+                                       journal_entry[1], 'done',
+                                       skipped=skipped)
+
+        games = sum(len(item[0]) for item in batch)
+
+        with self._lock:
+
+            self._batches += 1
+
+            self._games_written += games
+
+            self._write_time += time.time() - start
+
+        print "Committed", games, "games"
+
+def iter_csv_chunks(csv_file_name, chunk_size, num_bgs = None):
+    '''
+    Read the csv file made by collect_games.py in chunks
+
+    Yields (labels, bg_list) tuples where labels is the header row of the
+    csv file and bg_list holds up to chunk_size rows. Stops after num_bgs
+    rows if num_bgs is given.
+    '''
+
+    for labels, csv_rows, bg_list in iter_csv_row_chunks(csv_file_name,
+                                                         chunk_size, num_bgs):
+
+        yield labels, bg_list
+
+def iter_csv_row_chunks(csv_file_name, chunk_size, num_bgs = None,
+                        skip_rows = ()):
+    '''
+    Same as iter_csv_chunks() but also says where in the csv file every
+    chunk came from, and can leave rows out
+
+    chunk_size = rows per chunk, or a bgg_http.ChunkSizer that is asked for
+                 the size of every chunk as it is filled
+                 (int or ChunkSizer)
+
+    skip_rows = row numbers to leave out of the chunks (1 is the first row
+                after the header)
+                (set of ints)
+
+    Yields (labels, csv_rows, bg_list) tuples where csv_rows holds the row
+    number of every row in bg_list
+    '''
+
+    with open(csv_file_name, 'rb') as csv_file:
+
+        csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+        labels = csv_contents.next()
+
+        csv_rows = []
+
+        bg_list = []
+
+        for row_number, row in enumerate(csv_contents, 1):
+
+            if num_bgs is not None and row_number > num_bgs:
+
+                break
+
+            if row_number in skip_rows:
+
+                continue
+
+            csv_rows.append(row_number)
+
+            bg_list.append(row)
+
+            if len(bg_list) >= _chunk_length(chunk_size):
+
+                yield labels, csv_rows, bg_list
+
+                csv_rows = []
+
+                bg_list = []
+
+        if bg_list:
+
+            yield labels, csv_rows, bg_list
+
+def _chunk_length(chunk_size):
+
+    return chunk_size.size if isinstance(chunk_size, ChunkSizer) else chunk_size
+
+def _count_csv_games(csv_file_name, num_bgs = None):
+    '''
+    Number of games that will be read from the csv file
+    '''
+
+    num_games = len(GameList(csv_file_name))
+
+    return num_games if num_bgs is None else min(num_bgs, num_games)
+
+def chunk_url(bgID_list, xmlapi=BGG_XMLAPI):
+    '''
+    XML API url that requests every game in a list of board game ID's
+    '''
+
+    return xmlapi + ','.join(bgID_list) + '?stats=1'
+
+def thing_url(bgID_list, xmlapi2=BGG_XMLAPI2):
+    '''
+    XML API2 url that requests every game in a list of board game ID's,
+    with their ratings and ranks
+    '''
+
+    return xmlapi2 + 'thing?type=boardgame&stats=1&id=' + ','.join(bgID_list)
+
+def game_ids_from_chunk(labels, bg_list):
+    '''
+    Make a list of just the board game ID's from rows of the csv file
+    '''
+
+    bg_index = labels.index('HRef')
+
+    return [bgame[bg_index].split('/')[2] for bgame in bg_list]
+
+def scrape_list_of_games(labels, bg_list, db, xmlapi=BGG_XMLAPI, conn=None,
+                         journal_entry=None, upsert=False, chunk_sizer=None,
+                         writer=None):
+    '''
+    Request one chunk of games from the XML API and write it to the database
+
+    conn          = an open connection to write with, if not given a new
+                    connection to db is made just for this chunk
+
+    journal_entry = (run name, csv row numbers) of the chunk, to be marked
+                    done in the scrape_journal table together with the write
+                    (tuple)
+
+    upsert        = replace games that are already in boardgames instead of
+                    skipping them
+                    (bool)
+
+    chunk_sizer   = bgg_http.ChunkSizer told how long the request took, how
+                    big the response was and whether it failed
+
+    writer        = DatabaseWriter to hand the games (and journal entry) to,
+                    instead of writing them before returning
+
+    Throttled and 5xx responses (and connection errors) are retried with
+    exponential backoff, FETCH_ATTEMPTS requests in all. Raises if the
+    chunk still can't be fetched, or the response has none of its games.
+    '''
+
+    # Make a list of just the board game ID's
+    bgID_list = game_ids_from_chunk(labels, bg_list)
+
+    request_start = time.time()
+
+    try:
+
+        r = fetch_with_retry(chunk_url(bgID_list, xmlapi),
+                             FETCH_ATTEMPTS if RETRY_FAILED_CHUNKS else 1,
+                             FETCH_BASE_DELAY)
+
+        # An error page isn't a chunk with every game missing
+        r.raise_for_status()
+
+    except Exception as error:
+
+        # Not being in an offline cache says nothing about the server
+        if chunk_sizer is not None and not isinstance(error, CacheMiss):
+
+            chunk_sizer.record(len(bgID_list), time.time() - request_start,
+                               ok=False)
+
+        raise
+
+    # Cached responses say nothing about the server either. Needing
+    #   retries counts as a failure.
+    if chunk_sizer is not None and not r.from_cache:
+
+        chunk_sizer.record(len(bgID_list), time.time() - request_start,
+                           len(r.content), ok=r.attempts == 1)
+
+    bg_dicts, games_skipped = parse_chunk(r.content, bg_list, bgID_list)
+
+    # A busy page or cut off response that happens to parse
+    if not bg_dicts and not games_skipped:
+
+        raise ValueError("XML API response has none of the " +\
+                         str(len(bgID_list)) + " games asked for")
+
+    if writer is not None:
+
+        writer.write(bg_dicts, journal_entry, games_skipped, upsert)
+
+        print "Erroneously Labeled Games Skipped This Chunk:", games_skipped
+
+        return games_skipped
+
+    if conn is None:
+
+        conn = psycopg2.connect(db)
+
+        own_conn = True
+
+    else:
+
+        own_conn = False
+
+    try:
+
+        with conn:
+            with conn.cursor() as cursor:
+
+                write_chunk(cursor, bg_dicts, upsert)
+
+                if journal_entry is not None:
+
+                    _journal_chunk(cursor, journal_entry[0], journal_entry[1],
+                                   'done', skipped=games_skipped)
+
+    finally:
+
+        if own_conn:
+
+            conn.close()
+
+    print "Erroneously Labeled Games Skipped This Chunk:", games_skipped
+
+    return games_skipped
+
+def scrape_list_of_things(bgID_list, db, xmlapi2=BGG_XMLAPI2, conn=None,
+                          upsert=True, chunk_sizer=None):
+    '''
+    Request one chunk of games from XML API2 and write it to the database,
+    scrape_list_of_games() without a csv file
+
+    Retries like scrape_list_of_games(). Raises if the chunk still can't
+    be fetched or the response isn't a list of items. An empty list is
+    fine: none of the ID's were board games.
+
+    Returns the number of games asked for that weren't in the response
+    '''
+
+    request_start = time.time()
+
+    try:
+
+        r = fetch_with_retry(thing_url(bgID_list, xmlapi2),
+                             FETCH_ATTEMPTS if RETRY_FAILED_CHUNKS else 1,
+                             FETCH_BASE_DELAY)
+
+        r.raise_for_status()
+
+    except Exception as error:
+
+        if chunk_sizer is not None and not isinstance(error, CacheMiss):
+
+            chunk_sizer.record(len(bgID_list), time.time() - request_start,
+                               ok=False)
+
+        raise
+
+    if chunk_sizer is not None and not r.from_cache:
+
+        chunk_sizer.record(len(bgID_list), time.time() - request_start,
+                           len(r.content), ok=r.attempts == 1)
+
+    bg_dicts = parse_things(r.content, bgID_list)
+
+    if conn is None:
+
+        conn = psycopg2.connect(db)
+
+        own_conn = True
+
+    else:
+
+        own_conn = False
+
+    try:
+
+        with conn:
+            with conn.cursor() as cursor:
+
+                write_chunk(cursor, bg_dicts, upsert)
+
+    finally:
+
+        if own_conn:
+
+            conn.close()
+
+    return len(bgID_list) - len(bg_dicts)
+
+def scrape_or_split(labels, bg_list, db, xmlapi, conn, run_name,
+                    csv_rows=None, wait_time=WAIT_TIME_BETWEEN_REQUESTS,
+                    upsert=False, chunk_sizer=None, writer=None):
+    '''
+    scrape_list_of_games(), but a chunk that still fails after its retries
+    is split in half and both halves are tried again, down to single
+    games. One broken game (or a response that is too big) then only costs
+    that game instead of the whole chunk. Games that fail on their own are
+    put in the scrape_dead_letters table under run_name.
+
+    Chunks that failed because BGG couldn't be reached, kept answering
+    429 or isn't in an offline cache aren't split (smaller requests won't
+    help), the error is raised instead.
+
+    csv_rows  = row numbers of bg_list in the csv file. If given, every
+                piece is journaled in scrape_journal under run_name.
+                (list of ints)
 
-def create_table_in_database():
+    wait_time = seconds to sleep between the requests for the pieces
+                (float)
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+    Returns the number of erroneously labeled games skipped and the list of
+    game ID's that were dead lettered
+    '''
 
-            curs.execute("""CREATE TABLE boardgames (
-                                    id int PRIMARY KEY,
-                                    rank           int,
-                                    name          text,
-                                    href          text,
-                                    pub_year       int,
-                                    geek_rating   real,
-                                    avg_rating    real,
-                                    num_voters     int,
-                                    min_players    int,
-                                    max_players    int,
-                                    play_time      int,
-                                    sugg_age       int, -- suggested age
-                                    complx_rating real, -- complexity rating
-                                    designers   text[],
-                                    artists     text[],
-                                    categories  text[],
-                                    mechanics  text[],
-                                    family      text[],
-                                    type        text[]
-                                    );""")
+    def scrape_piece(piece, piece_rows):
 
-            print "Table succesfully created"
+        journal_entry = (run_name, piece_rows) if piece_rows is not None\
+                        else None
 
-def scrape_bg_stats(csv_file_name, chunk_size, num_bgs = None, db=DATABASE):
-    '''
-    csv_file_name = Name of the csv file that was created inside the 
-                    collect_games.py script
-                    (string)
+        return scrape_list_of_games(labels, piece, db, xmlapi, conn,
+                                    journal_entry, upsert, chunk_sizer, writer)
 
-    chunk_size    = The number of boardgames to request in a single XMLAPI call
-                    (int)
+    return _scrape_in_pieces(scrape_piece, bg_list,
+                             game_ids_from_chunk(labels, bg_list), conn,
+                             run_name, csv_rows, wait_time)
 
-    num_bgs       = If you don't want every single game in the csv file to be
-                    scraped, provide an integer telling it the total amount.
-                    (int)
+def _scrape_in_pieces(scrape_piece, items, bgID_list, conn, run_name,
+                      csv_rows=None, wait_time=WAIT_TIME_BETWEEN_REQUESTS):
+    '''
+    The splitting behind scrape_or_split() and scrape_things()
 
-    db            = name of the database to connect to
+    scrape_piece(piece, piece_rows) scrapes part of items (and its part of
+    csv_rows, or None) and returns a count to add up. bgID_list are the
+    game ID's of items, in the same order.
+
+    Returns the sum of the counts and the list of dead lettered game ID's
     '''
 
-    # Holds list of boardgames to be scraped, will be of length "chunk_size"
-    bg_list = []
+    # Pieces still to do, last one first
+    pieces = [(items, bgID_list, csv_rows)]
 
-    # Keeping track of how many chunks of boardgames are being scraped
-    i = 0
+    total = 0
 
-    # Keeping track of how many erroneously labeled games had to be skipped
-    total_skipped = 0
+    dead_lettered = []
 
-    with open(csv_file_name, 'rb') as csv_file:
+    while pieces:
 
-        csv_contents = csv.reader(csv_file, delimiter = '\t')
+        piece, piece_ids, piece_rows = pieces.pop()
 
-        labels = csv_contents.next()
+        if piece is not items:
 
-        for row in csv_contents:
+            time.sleep(wait_time)
 
-            if len(bg_list) == chunk_size:
+        try:
 
-                i += 1
+            total += scrape_piece(piece, piece_rows)
 
-                if num_bgs:
+        except Exception as error:
 
-                    print "\nScraping chunk", i, "of", num_bgs/chunk_size
+            if not RETRY_FAILED_CHUNKS or not _worth_splitting(error):
 
-                else:
+                raise
 
-                    print "\nScraping chunk", i, "of", 10000/chunk_size
+            if len(piece) > 1:
 
-                total_skipped += scrape_list_of_games(labels, bg_list, db)
+                print "Chunk of", len(piece), "games failed (" +\
+                      error.__class__.__name__ + "), splitting it"
 
-                # Clear list so we can build up another chunk
-                bg_list = []
+                half = len(piece)/2
 
-                bg_list.append(row)
+                pieces.append((piece[half:], piece_ids[half:],
+                               piece_rows and piece_rows[half:]))
 
-                time.sleep(WAIT_TIME_BETWEEN_REQUESTS)
+                pieces.append((piece[:half], piece_ids[:half],
+                               piece_rows and piece_rows[:half]))
 
-            else:
+                continue
 
-                bg_list.append(row)
+            bgID = piece_ids[0]
 
-            # Add 1 to stop index since generator already moved line_num by 1
-            if num_bgs is not None and csv_contents.line_num > num_bgs + 1:
+            print "Game", bgID, "failed (" + error.__class__.__name__ +\
+                  "), dead lettered"
 
-                print "\nTotal Number of Erroneously Labeled Games Skipped:",\
-                                                               total_skipped
-                return
+            with conn:
+                with conn.cursor() as cursor:
 
-        # For last chunk in csv file that may reach end of file midway
-        else:
+                    _dead_letter(cursor, run_name, bgID,
+                                 piece_rows and piece_rows[0], error)
 
-            i += 1
+                    if piece_rows is not None:
 
-            if num_bgs:
+                        _journal_chunk(cursor, run_name, piece_rows, 'failed',
+                                       error=repr(error))
 
-                print "\nScraping chunk", i, "of", num_bgs/chunk_size
+            dead_lettered.append(bgID)
 
-            else:
+            continue
 
-                print "\nScraping chunk", i, "of", 10000/chunk_size
+        with conn:
+            with conn.cursor() as cursor:
 
-            total_skipped += scrape_list_of_games(labels, bg_list, db)
+                cursor.execute("""DELETE FROM scrape_dead_letters
+                                  WHERE run = %s AND bg_id = ANY(%s);""",
+                               (run_name, [int(bgID) for bgID in piece_ids]))
 
-    print "\nTotal Number of Erroneously Labeled Games Skipped:", total_skipped
+    return total, dead_lettered
+
+def _worth_splitting(error):
+    '''
+    False for errors a smaller request won't get past
+    '''
 
-def scrape_list_of_games(labels, bg_list, db):
+    # The database failing says nothing about the games
+    if isinstance(error, psycopg2.Error):
 
-    bg_index = labels.index('HRef')
+        return False
 
-    # Make a list of just the board game ID's
-    bgID_list = [bgame[bg_index].split('/')[2] for bgame in bg_list]
+    # 429 is about the request rate, a 503 can be BGG giving up on a big
+    #   request
+    if isinstance(error, requests.exceptions.HTTPError):
 
-    games = ','.join(bgID_list)
-    
-    r = requests.get(BGG_XMLAPI + games + '?stats=1')
+        return error.response.status_code != 429
 
-    soup = BeautifulSoup(r.text, 'xml')
+    return not isinstance(error, requests.exceptions.RequestException)
+
+def _dead_letter(cursor, run_name, bgID, csv_row, error):
+
+    cursor.execute("""INSERT INTO scrape_dead_letters (run, bg_id, csv_row,
+                                                       error)
+                      VALUES (%s, %s, %s, %s)
+                      ON CONFLICT (run, bg_id) DO UPDATE
+                      SET error     = EXCLUDED.error,
+                          failures  = scrape_dead_letters.failures + 1,
+                          logged_at = now();""",
+                   (run_name, int(bgID), csv_row, repr(error)))
+
+def dead_letters(run_name=None, db=DATABASE):
+    '''
+    Games that couldn't be scraped even on their own
+
+    run_name = only the games of this run
+               (string)
+
+    Returns a list of (run, bg_id, csv_row, error, failures) tuples
+    '''
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as cursor:
+
+            cursor.execute(JOURNAL_SQL)
+
+            cursor.execute("""SELECT run, bg_id, csv_row, error, failures
+                              FROM scrape_dead_letters
+                              WHERE %s IS NULL OR run = %s
+                              ORDER BY run, csv_row, bg_id;""",
+                           (run_name, run_name))
+
+            return cursor.fetchall()
+
+def data_changed(db=DATABASE):
+    '''
+    Everything to do after boardgames was written to: refresh the
+    item_rank_bands view, then bump the data version
+
+    db = database to connect to
+    '''
+
+    refresh_rank_bands(db)
+
+    bump_data_version(db)
+
+def bump_data_version(db=DATABASE):
+    '''
+    Move the data version on, making every cached analysis result stale.
+    Call it after the changes are committed, or a cache could store the old
+    results under the new version.
+
+    db = database to connect to
+
+    Returns the new version
+    '''
 
-    games_skipped = 0
-        
     with psycopg2.connect(db) as conn:
         with conn.cursor() as cursor:
 
-            for boardgame in soup.boardgames.find_all('boardgame'): 
+            cursor.execute("""CREATE SEQUENCE IF NOT EXISTS """ +\
+                           DATA_VERSION_SEQUENCE + """;
 
-                # Found weird bug where some items were listed as games inside
-                #   XML API. Used this conditional to make sure it's only
-                #   picking up games that are actually documented
-                if boardgame.attrs['objectid'] not in bgID_list:
+                              SELECT nextval(%s);""", (DATA_VERSION_SEQUENCE,))
 
-                    games_skipped += 1
+            return cursor.fetchone()[0]
 
-                else: 
+def refresh_rank_bands(db=DATABASE):
+    '''
+    Bring the item_rank_bands view (see normalize_database.py) up to date
+    with boardgames, if it has been made
 
-                    # Since we lost the index due to possible erroneously
-                    #    labeled games
-                    bg_index = bgID_list.index(boardgame.attrs['objectid'])
-                    
-                    bgID     = bgID_list[bg_index]
+    db = database to connect to
+    '''
 
-                    csv_row  = bg_list[bg_index]
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as cursor:
 
-                    bg_dict = scrape_game(boardgame, csv_row, bgID)
+            cursor.execute("""SELECT to_regclass(%s);""", (RANK_BANDS_VIEW,))
 
-                    add_to_table(cursor, bg_dict)
+            if cursor.fetchone()[0] is not None:
 
-    print "Erroneously Labeled Games Skipped This Chunk:", games_skipped
+                cursor.execute("""REFRESH MATERIALIZED VIEW """ +\
+                               RANK_BANDS_VIEW + """;""")
 
-    return games_skipped
+def _journal_chunk(cursor, run_name, csv_rows, status, skipped=None,
+                   error=None):
 
-def scrape_game(boardgame, csv_row, bgID):
+    cursor.execute("""INSERT INTO scrape_journal (run, csv_rows, status,
+                                                  skipped, error)
+                      VALUES (%s, %s, %s, %s, %s);""",
+                   (run_name, csv_rows, status, skipped, error))
+
+def _journaled_rows(cursor, run_name):
+    '''
+    Row numbers of the csv file that are in a chunk journaled as done
+    '''
+
+    cursor.execute("""SELECT DISTINCT unnest(csv_rows) FROM scrape_journal
+                      WHERE run = %s AND status = 'done';""", (run_name,))
+
+    return set(row_tuple[0] for row_tuple in cursor.fetchall())
+
+def parse_chunk(xml_content, bg_list, bgID_list):
+    '''
+    Turn the XML API response for a chunk of games into bg_dicts
+
+    The response is streamed through bgg_xml.iter_boardgames(), so only one
+    game at a time is ever held as parsed XML.
+
+    Returns the list of bg_dicts and the number of erroneously labeled games
+    that were skipped
+    '''
+
+    bg_dicts = []
+
+    games_skipped = 0
+
+    for record in bgg_xml.iter_boardgames(xml_content):
+
+        # Found weird bug where some items were listed as games inside
+        #   XML API. Used this conditional to make sure it's only
+        #   picking up games that are actually documented
+        if record.id not in bgID_list:
+
+            games_skipped += 1
+
+        else:
+
+            # Since we lost the index due to possible erroneously
+            #    labeled games
+            bg_index = bgID_list.index(record.id)
+
+            bg_dicts.append(scrape_game(record, bg_list[bg_index],
+                                        bgID_list[bg_index]))
+
+    return bg_dicts, games_skipped
+
+def parse_things(xml_content, bgID_list):
+    '''
+    Turn the XML API2 thing response for a chunk of games into bg_dicts,
+    streamed through bgg_xml.iter_things(). Items that weren't asked for
+    are left out.
+    '''
+
+    return [scrape_thing(record) for record in bgg_xml.iter_things(xml_content)
+            if record.id in bgID_list]
+
+def parse_chunk_soup(xml_text, bg_list, bgID_list):
+    '''
+    Original BeautifulSoup version of parse_chunk(), kept around to check the
+    streaming parser against (see benchmarks.bench_xml_parse())
+    '''
+
+    soup = BeautifulSoup(xml_text, 'xml')
+
+    bg_dicts = []
+
+    games_skipped = 0
+
+    for boardgame in soup.boardgames.find_all('boardgame'): 
+
+        # Found weird bug where some items were listed as games inside
+        #   XML API. Used this conditional to make sure it's only
+        #   picking up games that are actually documented
+        if boardgame.attrs['objectid'] not in bgID_list:
+
+            games_skipped += 1
+
+        else: 
+
+            # Since we lost the index due to possible erroneously
+            #    labeled games
+            bg_index = bgID_list.index(boardgame.attrs['objectid'])
+            
+            bgID     = bgID_list[bg_index]
+
+            csv_row  = bg_list[bg_index]
+
+            bg_dicts.append(scrape_game_soup(boardgame, csv_row, bgID))
+
+    return bg_dicts, games_skipped
+
+def write_chunk(cursor, bg_dicts, upsert=False):
+    '''
+    Add a chunk of parsed games to the boardgames table.
+
+    Uses the bulk loader (copy_to_table), so a chunk costs a few round trips
+    to the database no matter how many games are in it.
+    '''
+
+    copy_to_table(cursor, bg_dicts, upsert)
+
+def copy_to_table(cursor, bg_dicts, upsert=False):
+    '''
+    Bulk version of add_to_table() for a whole list of bg_dicts.
+
+    The games are streamed with COPY FROM STDIN into a temporary staging
+    table shaped like boardgames, then moved over with a single
+    INSERT ... SELECT. Games that are already in boardgames are skipped,
+    same as ON CONFLICT DO NOTHING in add_to_table(), unless upsert is
+    True, in which case their rows are replaced (by the last bg_dict of a
+    game listed more than once).
+    '''
+
+    if not bg_dicts:
+
+        return
+
+    if upsert:
+
+        # ON CONFLICT DO UPDATE fails on a game that is in the batch twice
+        bg_dicts = _last_per_game(bg_dicts)
+
+    _copy_to_staging(cursor, bg_dicts, BOARDGAMES_COLUMNS)
+
+    columns = ', '.join(BOARDGAMES_COLUMNS)
+
+    if upsert:
+
+        on_conflict = 'ON CONFLICT (id) DO UPDATE SET ' +\
+                      ', '.join(column + ' = EXCLUDED.' + column
+                                for column in BOARDGAMES_COLUMNS[1:])
+
+    else:
+
+        on_conflict = 'ON CONFLICT DO NOTHING'
+
+    cursor.execute('INSERT INTO boardgames (' + columns + ') ' +\
+                   'SELECT ' + columns + ' FROM boardgames_staging ' +\
+                   on_conflict + '; ' +\
+                   'TRUNCATE boardgames_staging;')
+
+def update_browse_columns(cursor, bg_dicts):
+    '''
+    Overwrite the browse page columns (BROWSE_COLUMNS) of games that are
+    already in boardgames, leaving the XML API columns as they are
+
+    bg_dicts = made from csv rows by _scrape_csv_row()
+    '''
+
+    if not bg_dicts:
+
+        return
+
+    # Otherwise which of a game's rows ends up in boardgames is up to
+    #   Postgres
+    _copy_to_staging(cursor, _last_per_game(bg_dicts), BROWSE_COLUMNS)
+
+    cursor.execute('UPDATE boardgames SET ' +\
+                   ', '.join(column + ' = boardgames_staging.' + column
+                             for column in BROWSE_COLUMNS[1:]) +\
+                   ' FROM boardgames_staging' +\
+                   ' WHERE boardgames.id = boardgames_staging.id; ' +\
+                   'TRUNCATE boardgames_staging;')
+
+def _last_per_game(bg_dicts):
+    '''
+    bg_dicts with only the last one of every id kept, in the order the ids
+    first appear
+
+    A crawl of the browse pages can list a game twice when the ranks shift
+    while it runs, the later page has the newer numbers.
+    '''
+
+    last = OrderedDict()
+
+    for bg_dict in bg_dicts:
+
+        last[int(bg_dict['id'])] = bg_dict
+
+    return list(last.values())
+
+def _copy_to_staging(cursor, bg_dicts, columns):
+    '''
+    COPY some columns of bg_dicts into the boardgames_staging temp table
+    '''
+
+    # Lives as long as the connection, so this only creates it once
+    cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS boardgames_staging
+                              (LIKE boardgames INCLUDING DEFAULTS);""")
+
+    cursor.copy_expert('COPY boardgames_staging (' + ', '.join(columns) +\
+                       ') FROM STDIN;', BytesIO(_copy_rows(bg_dicts, columns)))
+
+def _copy_rows(bg_dicts, columns=BOARDGAMES_COLUMNS):
+    '''
+    Write bg_dicts out in the text format read by COPY FROM STDIN
+
+    Returns the utf-8 encoded rows
+    '''
+
+    lines = []
+
+    for bg_dict in bg_dicts:
+
+        fields = []
+
+        for column in columns:
+
+            value = bg_dict[column]
+
+            if value is None:
+
+                fields.append(u'\\N')
+
+                continue
+
+            if column in ARRAY_COLUMNS:
+
+                value = _array_literal(value)
+
+            fields.append(_copy_escape(_to_unicode(value)))
+
+        lines.append(u'\t'.join(fields) + u'\n')
+
+    return u''.join(lines).encode('utf-8')
+
+def _array_literal(items):
+    '''
+    Postgres text[] literal for a list of strings, eg. {"Worker Placement"}
+    '''
+
+    elements = []
+
+    for item in items:
+
+        if item is None:
+
+            elements.append(u'NULL')
+
+        else:
+
+            item = _to_unicode(item).replace(u'\\', u'\\\\')\
+                                    .replace(u'"', u'\\"')
+
+            elements.append(u'"' + item + u'"')
+
+    return u'{' + u','.join(elements) + u'}'
+
+def _copy_escape(text):
+    '''
+    Escape the characters that mean something in COPY's text format
+    '''
+
+    return text.replace(u'\\', u'\\\\').replace(u'\t', u'\\t')\
+               .replace(u'\n', u'\\n').replace(u'\r', u'\\r')
+
+def _to_unicode(value):
+
+    # Values from the csv file are utf-8 bytes, values from the XML unicode
+    if isinstance(value, str):
+
+        return value.decode('utf-8')
+
+    return unicode(value)
+
+def scrape_game(record, csv_row, bgID):
+    '''
+    Combine a csv row and the bgg_xml.BoardgameRecord of the same game into
+    the bg_dict that gets inserted into the boardgames table
+    '''
+
+    bg_dict = _scrape_csv_row(csv_row, bgID)
+
+    for field in bgg_xml.BoardgameRecord._fields[1:]:
+
+        bg_dict[field] = getattr(record, field)
+
+    return bg_dict
+
+def scrape_thing(record):
+    '''
+    The bg_dict of a bgg_xml.ThingRecord, every column straight from XML
+    API2
+    '''
+
+    bg_dict = record._asdict()
+
+    bg_dict['href'] = u'/boardgame/' + record.id
+
+    return bg_dict
+
+def scrape_game_soup(boardgame, csv_row, bgID):
+
+    bg_dict = _scrape_csv_row(csv_row, bgID)
 
-    bg_dict = {}
-    
-    bg_dict['id']            = bgID
-    bg_dict['rank']          = csv_row[0]
-    bg_dict['name']          = csv_row[1]
-    bg_dict['href']          = csv_row[2]
-    bg_dict['pub_year']      = csv_row[3] if csv_row[3] != 'N/A' else None
-    bg_dict['geek_rating']   = csv_row[4] if csv_row[4] != 'N/A' else None
-    bg_dict['avg_rating']    = csv_row[5] if csv_row[5] != 'N/A' else None
-    bg_dict['num_voters']    = csv_row[6] if csv_row[6] != 'N/A' else None
     bg_dict['min_players']   = boardgame.minplayers.contents[0]
     bg_dict['max_players']   = boardgame.maxplayers.contents[0]
     bg_dict['play_time']     = boardgame.playingtime.contents[0]
@@ -202,6 +2077,21 @@ def scrape_game(boardgame, csv_row, bgID):
 
     return bg_dict
 
+def _scrape_csv_row(csv_row, bgID):
+
+    bg_dict = {}
+    
+    bg_dict['id']            = bgID
+    bg_dict['rank']          = csv_row[0]
+    bg_dict['name']          = csv_row[1]
+    bg_dict['href']          = csv_row[2]
+    bg_dict['pub_year']      = csv_row[3] if csv_row[3] != 'N/A' else None
+    bg_dict['geek_rating']   = csv_row[4] if csv_row[4] != 'N/A' else None
+    bg_dict['avg_rating']    = csv_row[5] if csv_row[5] != 'N/A' else None
+    bg_dict['num_voters']    = csv_row[6] if csv_row[6] != 'N/A' else None
+
+    return bg_dict
+
 def add_to_table(cursor, bg_dict):
 
     cursor.execute("""INSERT INTO boardgames (
@@ -275,29 +2165,19 @@ def _grab_multiple_contents(tag_obj_list):
 
 def get_bg_xml(bgid):
 
-    r = requests.get(BGG_XMLAPI + bgid + '?stats=1')
+    r = fetch(BGG_XMLAPI + bgid + '?stats=1')
 
     soup = BeautifulSoup(r.text, 'xml')
 
     return soup
 
 def grab_chunk_from_csv(csv_file_name, start, stop):
+    '''
+    Rows start up to (not including) stop of the csv file, read by seeking
+    to them (see game_list.GameList) instead of going through the whole file
+    '''
 
-    bg_list = []
-
-    with open(csv_file_name, 'rb') as csv_file:
-
-        csv_contents = csv.reader(csv_file, delimiter = '\t')
-
-        labels = csv_contents.next()
-
-        for row in csv_contents:
-
-            if csv_contents.line_num > start and csv_contents.line_num< stop + 1:
-
-                bg_list.append(row)
-    
-    return bg_list
+    return GameList(csv_file_name).raw_rows(start, stop)
 
 def make_game_id_list(bg_list):
     
@@ -0,0 +1,871 @@
+'''
+Shared helpers for talking to boardgamegeek.com without getting blacklisted.
+
+Both collect_games.py and bg_scraper.py go through these helpers so that
+every request to BGG is governed by the same rate limiting rules.
+
+They also share an optional on-disk response cache. Once it is switched on
+with use_cache(), every request made through fetch() is answered from disk
+while it is fresh, revalidated with ETag/Last-Modified once it is stale,
+and only downloaded again if BGG says it changed:
+
+    import bgg_http
+
+    bgg_http.use_cache(bgg_http.ResponseCache('bgg_cache', ttl=24*60*60))
+
+    # Re-runs only ever read from the cache, nothing goes to BGG
+    bgg_http.use_cache(bgg_http.ResponseCache('bgg_cache', offline=True))
+'''
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# (connect, read) seconds before a request to BGG is given up on. A stalled
+#   connection then raises requests.exceptions.Timeout, which
+#   fetch_with_retry() retries like any other failed request.
+REQUEST_TIMEOUT = (10., 60.)
+
+
+class TokenBucket(object):
+    '''
+    Token bucket rate limiter that can be shared between threads.
+
+    Tokens are added at "rate" tokens per second up to "capacity". Every
+    request takes one token, so the long run request rate never exceeds
+    "rate" while still allowing a small burst of "capacity" requests.
+
+    The bucket also adapts to the server: throttle() is called whenever BGG
+    answers with 429/503 and halves the rate (and pauses everybody for the
+    Retry-After time), while relax() slowly brings the rate back up to the
+    configured maximum after successful requests.
+
+    rate     : Maximum number of requests per second
+               (Type: float)
+
+    capacity : Number of requests that can be made back to back
+               (Type: integer)
+
+    min_rate : Lowest rate throttle() is allowed to fall back to
+               (Type: float)
+    '''
+
+    def __init__(self, rate, capacity=1, min_rate=None):
+
+        self.max_rate = float(rate)
+
+        self.rate     = float(rate)
+
+        self.min_rate = float(min_rate) if min_rate else self.max_rate/16.
+
+        self.capacity = float(capacity)
+
+        self._tokens  = float(capacity)
+
+        self._last    = time.time()
+
+        self._paused_until = 0.
+
+        self._lock    = threading.Lock()
+
+    def _refill(self, now):
+
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last)*self.rate)
+
+        self._last   = now
+
+    def acquire(self):
+        '''
+        Block until a request is allowed to go out
+        '''
+
+        while True:
+
+            with self._lock:
+
+                now = time.time()
+
+                self._refill(now)
+
+                if now < self._paused_until:
+
+                    wait = self._paused_until - now
+
+                elif self._tokens >= 1:
+
+                    self._tokens -= 1
+
+                    return
+
+                else:
+
+                    wait = (1 - self._tokens)/self.rate
+
+            time.sleep(wait)
+
+    def try_acquire(self):
+        '''
+        Take a token if one is available right now, never blocks.
+
+        Returns True if the token was taken
+        '''
+
+        with self._lock:
+
+            self._refill(time.time())
+
+            if self._tokens >= 1:
+
+                self._tokens -= 1
+
+                return True
+
+        return False
+
+    def throttle(self, retry_after=None):
+        '''
+        Server told us to slow down: halve the rate, drop any saved up burst
+        and pause every caller for retry_after seconds (or one request
+        interval if the server didn't say).
+        '''
+
+        with self._lock:
+
+            now = time.time()
+
+            self.rate    = max(self.min_rate, self.rate/2.)
+
+            self._tokens = 0.
+
+            self._last   = now
+
+            pause = retry_after if retry_after is not None else 1./self.rate
+
+            self._paused_until = max(self._paused_until, now + pause)
+
+    def relax(self):
+        '''
+        Successful request: creep back up towards the maximum rate
+        '''
+
+        with self._lock:
+
+            self.rate = min(self.max_rate, self.rate + self.max_rate/10.)
+
+
+class ChunkSizer(object):
+    '''
+    Picks how many games go into one XML API request.
+
+    Bigger chunks mean fewer requests (and fewer waits between them), but
+    the response gets bigger and slower, and a chunk that is too big times
+    out or gets refused. Like TokenBucket's rate, the size adapts to what
+    the server does:
+
+        - it starts by doubling after every good request, until the first
+          request that is too slow, too big or fails
+        - after that it grows by step games per good request
+        - a request that took longer than target_latency or returned more
+          than max_bytes shrinks it to what would have fit (at most
+          halving it)
+        - a failed request drops it to the largest size that went through
+          before, and it stays at or below that for probe_after good
+          requests before trying bigger chunks again
+
+    Pass one as the chunk_size of bg_scraper.scrape_bg_stats() or
+    scrape_changed_games() to let the chunk size adapt.
+
+    size           : Games in the first request
+                     (Type: integer)
+
+    min_size       : Fewest games ever asked for at once
+                     (Type: integer)
+
+    max_size       : Most games ever asked for at once
+                     (Type: integer)
+
+    target_latency : Seconds a request should take at most
+                     (Type: float)
+
+    max_bytes      : Largest response wanted
+                     (Type: integer)
+
+    step           : Games added after a good request once the doubling is
+                     over, a fiftieth of max_size if not given
+                     (Type: float)
+
+    probe_after    : Good requests before growing past a size that failed
+                     (Type: integer)
+    '''
+
+    def __init__(self, size, min_size=1, max_size=500, target_latency=5.,
+                 max_bytes=4*1024*1024, step=None, probe_after=20):
+
+        self.min_size = int(min_size)
+
+        self.max_size = int(max_size)
+
+        self.target_latency = float(target_latency)
+
+        self.max_bytes = int(max_bytes)
+
+        self.step = float(step) if step else max(1., max_size/50.)
+
+        self.probe_after = probe_after
+
+        # (games, seconds, bytes, ok) for every request recorded
+        self.history = []
+
+        self._size = self._clamp(size)
+
+        self._doubling = True
+
+        # Size not to grow past after a failure, and good requests since
+        self._ceiling = None
+
+        self._good_in_a_row = 0
+
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        '''
+        Number of games to put in the next request
+        '''
+
+        return int(self._size)
+
+    def record(self, num_games, seconds, num_bytes=0, ok=True):
+        '''
+        Adjust the size after a request for num_games games that took
+        seconds and returned num_bytes (ok=False if it failed)
+        '''
+
+        with self._lock:
+
+            within_targets = ok and seconds <= self.target_latency and\
+                             num_bytes <= self.max_bytes
+
+            if not ok:
+
+                # Largest request that went through fine, and was smaller
+                went_through = [games for games, s, b, good in self.history
+                                if good and games < num_games and
+                                s <= self.target_latency and
+                                b <= self.max_bytes]
+
+                self._ceiling = max(went_through) if went_through\
+                                else num_games/2.
+
+                size = min(self._size, self._ceiling)
+
+            elif not within_targets:
+
+                fits = num_games*min(self.target_latency/max(seconds, 1e-9),
+                                     self.max_bytes/max(num_bytes, 1.))
+
+                size = max(min(self._size, fits), self._size/2.)
+
+            else:
+
+                self._good_in_a_row += 1
+
+                size = self._size*2 if self._doubling\
+                       else self._size + self.step
+
+                if self._ceiling is not None:
+
+                    if self._good_in_a_row < self.probe_after:
+
+                        size = min(size, max(self._size, self._ceiling))
+
+                    else:
+
+                        self._ceiling = None
+
+            if not within_targets:
+
+                self._doubling = False
+
+                self._good_in_a_row = 0
+
+            self.history.append((num_games, seconds, num_bytes, ok))
+
+            self._size = self._clamp(size)
+
+    def summary(self):
+        '''
+        Dict with the chunk sizes that were used ('sizes'), the number of
+        'requests' and 'failed' ones, the 'next_size' and the
+        'games_per_second' the requests that went through delivered
+        '''
+
+        sizes = [num_games for num_games, seconds, num_bytes, ok
+                 in self.history]
+
+        good = [(num_games, seconds) for num_games, seconds, num_bytes, ok
+                in self.history if ok]
+
+        request_time = sum(seconds for num_games, seconds in good)
+
+        return {'requests'        : len(sizes),
+                'failed'          : len(sizes) - len(good),
+                'sizes'           : sizes,
+                'next_size'       : self.size,
+                'games_per_second': sum(num_games for num_games, seconds
+                                        in good)/request_time
+                                    if request_time else None}
+
+    def report(self):
+        '''
+        Print the chunk sizes that were used
+        '''
+
+        summary = self.summary()
+
+        sizes = summary['sizes']
+
+        if not sizes:
+
+            return
+
+        print "\nChunk sizes:", min(sizes), "to", max(sizes), "games,",\
+              "mean", round(sum(sizes)/float(len(sizes)), 1), "over",\
+              len(sizes), "requests (" + str(summary['failed']), "failed),",\
+              "next", summary['next_size']
+
+    def _clamp(self, size):
+
+        return float(min(self.max_size, max(self.min_size, size)))
+
+
+def is_throttled(response):
+    '''
+    True if BGG is asking us to back off (429 Too Many Requests, or the 503
+    the XML API hands out while it is busy)
+    '''
+
+    return response.status_code in (429, 503)
+
+
+def retry_after_seconds(response):
+    '''
+    Number of seconds from the Retry-After header, or None if the header is
+    missing or is given as an HTTP date
+    '''
+
+    value = response.headers.get('Retry-After')
+
+    try:
+
+        return max(0., float(value))
+
+    except (TypeError, ValueError):
+
+        return None
+
+
+class CacheMiss(requests.exceptions.ConnectionError):
+    '''
+    Raised by an offline ResponseCache for a url it doesn't have. Being a
+    ConnectionError, the scrapers treat it like any other failed request.
+    '''
+
+
+class ResponseCache(object):
+    '''
+    Persistent cache of successful (200) responses, keyed by url.
+
+    Every response is one file in the cache directory: a line of JSON
+    (status, the headers that matter, when it was stored) followed by the
+    zlib compressed body. When the cache grows past max_bytes the least
+    recently used files are deleted.
+
+    directory : Where the cache files live, made if it doesn't exist
+                (Type: String)
+
+    ttl       : Seconds a response is served without asking BGG. After
+                that it is revalidated with If-None-Match/If-Modified-Since
+                (Type: float)
+
+    max_bytes : Size on disk the cache is kept under
+                (Type: integer)
+
+    offline   : Never touch the network; urls that aren't cached raise
+                CacheMiss, stale responses are served as they are
+                (Type: bool)
+    '''
+
+    # Headers of the original response that are kept
+    KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Date']
+
+    def __init__(self, directory='bgg_cache', ttl=24*60*60.,
+                 max_bytes=512*1024*1024, offline=False):
+
+        self.directory = directory
+
+        self.ttl       = float(ttl)
+
+        self.max_bytes = max_bytes
+
+        self.offline   = offline
+
+        # Answered from disk without a request / after a 304 / downloaded
+        self.hits        = 0
+
+        self.revalidated = 0
+
+        self.misses      = 0
+
+        self._lock  = threading.Lock()
+
+        # cache file name -> [size in bytes, last used], read from the
+        #   directory the first time it is needed
+        self._index = None
+
+    def get(self, url):
+        '''
+        requests.get(url), answered from the cache whenever possible
+
+        Returns a requests.Response with an extra from_cache attribute,
+        True if no request was sent at all
+        '''
+
+        meta, body = self._read(url)
+
+        if meta is not None and (self.offline or self._is_fresh(meta)):
+
+            self._count('hits')
+
+            return _cached_response(url, meta, body)
+
+        if self.offline:
+
+            raise CacheMiss('Not in the response cache: ' + url)
+
+        headers = {}
+
+        if meta is not None:
+
+            if meta['headers'].get('ETag'):
+
+                headers['If-None-Match'] = meta['headers']['ETag']
+
+            if meta['headers'].get('Last-Modified'):
+
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        response = requests.get(url, headers=headers,
+                                timeout=REQUEST_TIMEOUT)
+
+        if meta is not None and response.status_code == 304:
+
+            # Still the same, good for another ttl
+            meta['stored_at'] = time.time()
+
+            self._write(url, meta, body)
+
+            self._count('revalidated')
+
+            cached = _cached_response(url, meta, body)
+
+            cached.from_cache = False
+
+            return cached
+
+        self._count('misses')
+
+        if response.status_code == 200:
+
+            self.store(url, response)
+
+        response.from_cache = False
+
+        return response
+
+    def sends_request(self, url):
+        '''
+        True if get(url) would send a request (a download or a
+        revalidation), False if it is answered from disk or, when offline,
+        fails without one
+        '''
+
+        if self.offline:
+
+            return False
+
+        meta, body = self._read(url, meta_only=True)
+
+        return meta is None or not self._is_fresh(meta)
+
+    def store(self, url, response):
+        '''
+        Put a response in the cache
+        '''
+
+        meta = {'url'      : url,
+                'status'   : response.status_code,
+                'encoding' : response.encoding,
+                'headers'  : dict((key, response.headers[key]) for key
+                                  in self.KEPT_HEADERS
+                                  if key in response.headers),
+                'stored_at': time.time()}
+
+        self._write(url, meta, response.content)
+
+    def clear(self):
+        '''
+        Delete everything in the cache
+        '''
+
+        with self._lock:
+
+            for file_name in self._load_index().keys():
+
+                self._remove(file_name)
+
+    def size(self):
+        '''
+        Bytes the cache takes up on disk
+        '''
+
+        with self._lock:
+
+            return sum(size for size, last_used
+                       in self._load_index().values())
+
+    def _is_fresh(self, meta):
+
+        return time.time() - meta['stored_at'] < self.ttl
+
+    def _count(self, counter):
+
+        with self._lock:
+
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _file_name(self, url):
+
+        if isinstance(url, unicode):
+
+            url = url.encode('utf-8')
+
+        return hashlib.sha1(url).hexdigest() + '.cache'
+
+    def _read(self, url, meta_only=False):
+        '''
+        (meta, body) of a cached url, (None, None) if it isn't cached
+        '''
+
+        file_name = self._file_name(url)
+
+        try:
+
+            with open(os.path.join(self.directory, file_name), 'rb') as f:
+
+                meta = json.loads(f.readline())
+
+                body = None if meta_only else zlib.decompress(f.read())
+
+        except (IOError, ValueError, zlib.error):
+
+            return None, None
+
+        # Two urls with the same sha1 are not going to happen, but be sure
+        if meta.get('url') != url:
+
+            return None, None
+
+        if not meta_only:
+
+            self._touch(file_name)
+
+        return meta, body
+
+    def _write(self, url, meta, body):
+
+        file_name = self._file_name(url)
+
+        data = json.dumps(meta) + '\n' + zlib.compress(body)
+
+        if not os.path.isdir(self.directory):
+
+            try:
+
+                os.makedirs(self.directory)
+
+            except OSError:
+
+                # Another thread got there first
+                if not os.path.isdir(self.directory):
+
+                    raise
+
+        # Written next to the real file and renamed over it, so readers
+        #   never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        with os.fdopen(fd, 'wb') as f:
+
+            f.write(data)
+
+        os.rename(temp_path, os.path.join(self.directory, file_name))
+
+        with self._lock:
+
+            self._load_index()[file_name] = [len(data), time.time()]
+
+            self._evict()
+
+    def _touch(self, file_name):
+
+        with self._lock:
+
+            index = self._load_index()
+
+            if file_name in index:
+
+                index[file_name][1] = time.time()
+
+        try:
+
+            # So the order survives to the next run
+            os.utime(os.path.join(self.directory, file_name), None)
+
+        except OSError:
+
+            pass
+
+    def _load_index(self):
+
+        if self._index is None:
+
+            self._index = {}
+
+            if os.path.isdir(self.directory):
+
+                for file_name in os.listdir(self.directory):
+
+                    if file_name.endswith('.cache'):
+
+                        stat = os.stat(os.path.join(self.directory, file_name))
+
+                        self._index[file_name] = [stat.st_size, stat.st_mtime]
+
+        return self._index
+
+    def _evict(self):
+        '''
+        Delete least recently used files until the cache fits in max_bytes
+        '''
+
+        total = sum(size for size, last_used in self._index.values())
+
+        if total <= self.max_bytes:
+
+            return
+
+        for file_name in sorted(self._index,
+                                key=lambda file_name: self._index[file_name][1]):
+
+            total -= self._index[file_name][0]
+
+            self._remove(file_name)
+
+            if total <= self.max_bytes:
+
+                break
+
+    def _remove(self, file_name):
+
+        self._index.pop(file_name, None)
+
+        try:
+
+            os.remove(os.path.join(self.directory, file_name))
+
+        except OSError:
+
+            pass
+
+
+def _cached_response(url, meta, body):
+    '''
+    A requests.Response rebuilt from a cache file
+    '''
+
+    response = requests.models.Response()
+
+    response.url         = url
+
+    response.status_code = meta['status']
+
+    response.headers     = CaseInsensitiveDict(meta['headers'])
+
+    response.encoding    = meta['encoding']
+
+    response._content    = body
+
+    response.from_cache  = True
+
+    return response
+
+
+# The ResponseCache used by fetch(), see use_cache()
+_cache = None
+
+
+def use_cache(cache):
+    '''
+    Send every fetch() through a ResponseCache, or straight to BGG again
+    with use_cache(None)
+
+    cache : eg. ResponseCache('bgg_cache')
+            (Type: ResponseCache)
+    '''
+
+    global _cache
+
+    _cache = cache
+
+
+def fetch(url):
+    '''
+    requests.get(url), through the response cache if there is one
+
+    The response has a from_cache attribute that is True if no request
+    was sent, so callers know they don't need to wait before the next one
+    '''
+
+    if _cache is not None:
+
+        return _cache.get(url)
+
+    response = requests.get(url, timeout=REQUEST_TIMEOUT)
+
+    response.from_cache = False
+
+    return response
+
+
+def sends_request(url):
+    '''
+    True if fetch(url) will send a request to BGG, so the caller has to
+    wait for the rate limiter first. False when the response cache will
+    answer it.
+    '''
+
+    return _cache is None or _cache.sends_request(url)
+
+
+def is_retryable(response):
+    '''
+    True for responses worth asking again for: throttled, or any 5xx
+    '''
+
+    return is_throttled(response) or response.status_code >= 500
+
+
+def backoff_seconds(attempt, base_delay=1., max_delay=60.):
+    '''
+    Seconds to wait before retry number attempt (1 for the first retry):
+    a random time up to base_delay*2**(attempt-1), capped at max_delay.
+    The randomness ("full jitter") keeps clients that failed together from
+    all coming back at the same moment.
+    '''
+
+    return random.uniform(0, min(max_delay, base_delay*2**(attempt - 1)))
+
+
+def fetch_with_retry(url, max_attempts=5, base_delay=1., max_delay=60.,
+                     bucket=None):
+    '''
+    fetch(url), asked again with exponential backoff while the request
+    errors out (connection errors, timeouts) or the response is
+    retryable (429/5xx)
+
+    url          : Url to request
+                   (Type: String)
+
+    max_attempts : Requests sent at most
+                   (Type: integer)
+
+    base_delay   : Backoff of the first retry, doubled for every next one
+                   (see backoff_seconds())
+                   (Type: float)
+
+    max_delay    : Longest backoff
+                   (Type: float)
+
+    bucket       : TokenBucket to take a token from before every request.
+                   Throttled responses then throttle() the bucket (which
+                   pauses everybody sharing it) instead of sleeping here.
+
+    A Retry-After header is always honored: the wait is at least that
+    long. Returns the last response, with an attempts attribute saying
+    how many requests it took; it is only an error response if every
+    attempt failed. The last connection error is raised if even the last
+    attempt didn't get a response.
+    '''
+
+    attempt = 0
+
+    while True:
+
+        attempt += 1
+
+        if bucket is not None and sends_request(url):
+
+            bucket.acquire()
+
+        try:
+
+            response = fetch(url)
+
+        except CacheMiss:
+
+            # Asking again won't put it in the cache
+            raise
+
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+
+            if attempt >= max_attempts:
+
+                raise
+
+            time.sleep(backoff_seconds(attempt, base_delay, max_delay))
+
+            continue
+
+        response.attempts = attempt
+
+        if not is_retryable(response) or attempt >= max_attempts:
+
+            return response
+
+        retry_after = retry_after_seconds(response)
+
+        if bucket is not None and is_throttled(response):
+
+            bucket.throttle(retry_after)
+
+            continue
+
+        delay = backoff_seconds(attempt, base_delay, max_delay)
+
+        if retry_after is not None:
+
+            # A little jitter on top, so everybody doesn't come back at once
+            delay = retry_after + min(delay, base_delay)
+
+        time.sleep(delay)
@@ -0,0 +1,726 @@
+'''
+A local stand-in for boardgamegeek.com so the scrapers can be run and
+benchmarked without sending a single request to BGG.
+
+The browse pages are rebuilt from a game list csv file (the one made by
+collect_games.py) using the same markup that get_game_info() picks apart.
+The XML API (BGG_XMLAPI in bg_scraper.py) is faked the same way: games
+from the csv file get made up but repeatable player counts, designers,
+mechanics, etc. XML API2's thing?stats=1 (BGG_XMLAPI2) answers with the
+same made up values in the v2 format, except for the games in a fixture
+file (fixtures/xmlapi2_thing.xml), whose <item>'s are sent back as is.
+
+Like the real site, the server can be slow (latency, plus
+latency_per_game for every game in an XML API request), it hands out
+429's with a Retry-After header when it is hit harder than
+max_requests_per_second, it refuses XML API requests for more than
+max_games_per_request games and it can fail every request that has one of
+broken_game_ids in it. Every 200 response carries an ETag, and a request
+whose If-None-Match still matches gets a 304 (for bgg_http's cache).
+
+    import bgg_stand_in
+    import collect_games
+
+    with bgg_stand_in.StandInServer(latency=0.2) as server:
+
+        collect_games.scrape_list_of_top_games_concurrent(1000,
+                                     base_url=server.game_list_page)
+'''
+
+import BaseHTTPServer
+import SocketServer
+import cgi
+import csv
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+import urlparse
+
+from bgg_http import TokenBucket
+
+GAMES_PER_PAGE = 100
+
+ROW_TEMPLATE = u'''<tr id='row_'>
+<td class="collection_rank"><a name="{rank}"></a>{rank}</td>
+<td class="collection_thumbnail"></td>
+<td id='CEcell_objectname{row}' class='collection_objectname'>
+<div id='results_objectname{row}' style='z-index:1000;' onclick=''>
+<a href="{href}">{name}</a>{year}</div>
+</td>
+<td class='collection_bggrating' align='center'>{geek_rating}</td>
+<td class='collection_bggrating' align='center'>{avg_rating}</td>
+<td class='collection_bggrating' align='center'>{num_voters}</td>
+</tr>
+'''
+
+PAGE_TEMPLATE = u'''<html><head><title>Browse Board Games</title></head>
+<body><table class='collection_table' id='collectionitems'>
+<tr><th>Board Game Rank</th><th>Thumbnail</th><th>Title</th>
+<th>Geek Rating</th><th>Avg Rating</th><th>Num Voters</th></tr>
+{rows}</table></body></html>
+'''
+
+# Made up values for the XML API, picked per game from a seeded random.
+#   Mechanics and categories are BGG's own lists, designers and artists are
+#   padded out to roughly as many people as the top 10000 games credit.
+DESIGNERS  = [u'Uwe Rosenberg', u'Reiner Knizia', u'Stefan Feld',
+              u'Vital Lacerda', u'Martin Wallace', u'Rob Daviau',
+              u'Matt Leacock', u'Vlaada Chv\xe1til', u'(Uncredited)'] +\
+             [u'Designer ' + unicode(n) for n in range(1, 4000)]
+
+ARTISTS    = [u'Klemens Franz', u'Ian O\'Toole', u'Michael Menzel',
+              u'Franz Vohwinkel', u'Chechu Nieto', u'Vincent Dutrait'] +\
+             [u'Artist ' + unicode(n) for n in range(1, 4000)]
+
+CATEGORIES = [u'Abstract Strategy', u'Action / Dexterity', u'Adventure',
+              u'Age of Reason', u'American Civil War', u'American Indian Wars',
+              u'American Revolutionary War', u'American West', u'Ancient',
+              u'Animals', u'Arabian', u'Aviation / Flight', u'Bluffing',
+              u'Book', u'Card Game', u"Children's Game", u'City Building',
+              u'Civil War', u'Civilization', u'Collectible Components',
+              u'Comic Book / Strip', u'Deduction', u'Dice', u'Economic',
+              u'Educational', u'Electronic', u'Environmental',
+              u'Expansion for Base-game', u'Exploration', u'Fantasy',
+              u'Farming', u'Fighting', u'Game System', u'Horror', u'Humor',
+              u'Industry / Manufacturing', u'Korean War', u'Mafia', u'Math',
+              u'Mature / Adult', u'Maze', u'Medical', u'Medieval', u'Memory',
+              u'Miniatures', u'Modern Warfare', u'Movies / TV / Radio theme',
+              u'Murder/Mystery', u'Music', u'Mythology', u'Napoleonic',
+              u'Nautical', u'Negotiation', u'Novel-based', u'Number',
+              u'Party Game', u'Pike and Shot', u'Pirates', u'Political',
+              u'Post-Napoleonic', u'Prehistoric', u'Print & Play', u'Puzzle',
+              u'Racing', u'Real-time', u'Religious', u'Renaissance',
+              u'Science Fiction', u'Space Exploration',
+              u'Spies/Secret Agents', u'Sports', u'Territory Building',
+              u'Trains', u'Transportation', u'Travel', u'Trivia',
+              u'Video Game Theme', u'Vietnam War', u'Wargame', u'Word Game',
+              u'World War I', u'World War II', u'Zombies']
+
+MECHANICS  = [u'Acting', u'Action / Movement Programming',
+              u'Action Point Allowance System',
+              u'Area Control / Area Influence', u'Area Enclosure',
+              u'Area Movement', u'Area-Impulse', u'Auction/Bidding',
+              u'Betting/Wagering', u'Campaign / Battle Card Driven',
+              u'Card Drafting', u'Chit-Pull System', u'Co-operative Play',
+              u'Commodity Speculation', u'Crayon Rail System',
+              u'Deck / Pool Building', u'Dice Rolling', u'Grid Movement',
+              u'Hand Management', u'Hex-and-Counter', u'Line Drawing',
+              u'Memory', u'Modular Board', u'Paper-and-Pencil',
+              u'Partnerships', u'Pattern Building', u'Pattern Recognition',
+              u'Pick-up and Deliver', u'Player Elimination',
+              u'Point to Point Movement', u'Press Your Luck',
+              u'Rock-Paper-Scissors', u'Role Playing', u'Roll / Spin and Move',
+              u'Route/Network Building', u'Secret Unit Deployment',
+              u'Set Collection', u'Simulation',
+              u'Simultaneous Action Selection', u'Singing', u'Stock Holding',
+              u'Storytelling', u'Take That', u'Tile Placement', u'Time Track',
+              u'Trading', u'Trick-taking', u'Variable Phase Order',
+              u'Variable Player Powers', u'Voting', u'Worker Placement']
+
+FAMILIES   = [u'Crowdfunding: Kickstarter', u'Country: Germany',
+              u'Series: Euro Games', u'Components: Miniatures',
+              u'Theme: Trains & Railroads'] +\
+             [u'Family ' + unicode(n) for n in range(1, 1500)]
+
+SUBDOMAINS = [u'Strategy Games', u'Family Games', u'Thematic Games',
+              u'Wargames', u'Party Games', u'Abstract Games',
+              u"Children's Games", u'Customizable Games']
+
+BOARDGAME_XML_TEMPLATE = u'''<boardgame objectid="{id}">
+<yearpublished>{year}</yearpublished>
+<minplayers>{minplayers}</minplayers>
+<maxplayers>{maxplayers}</maxplayers>
+<playingtime>{playtime}</playingtime>
+<minplaytime>{playtime}</minplaytime>
+<maxplaytime>{playtime}</maxplaytime>
+<age>{age}</age>
+<name primary="true" sortindex="1">{name}</name>
+<description>{description}</description>
+<thumbnail>//cf.geekdo-images.com/images/pic{id}_t.jpg</thumbnail>
+<image>//cf.geekdo-images.com/images/pic{id}.jpg</image>
+{links}<poll title="User Suggested Number of Players" totalvotes="{votes}" name="suggested_numplayers">
+{poll}</poll>
+<statistics page="1">
+<ratings>
+<usersrated>{num_voters}</usersrated>
+<average>{avg_rating}</average>
+<bayesaverage>{geek_rating}</bayesaverage>
+<ranks><rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" value="{rank}" bayesaverage="{geek_rating}" /></ranks>
+<stddev>1.5</stddev>
+<median>0</median>
+<owned>{owned}</owned>
+<trading>12</trading>
+<wanting>34</wanting>
+<wishing>567</wishing>
+<numcomments>{comments}</numcomments>
+<numweights>{weights}</numweights>
+<averageweight>{weight}</averageweight>
+</ratings>
+</statistics>
+</boardgame>
+'''
+
+THING_XML_TEMPLATE = u'''<item type="boardgame" id="{id}">
+<thumbnail>https://cf.geekdo-images.com/images/pic{id}_t.jpg</thumbnail>
+<image>https://cf.geekdo-images.com/images/pic{id}.jpg</image>
+<name type="primary" sortindex="1" value="{name}" />
+<description>{description}</description>
+<yearpublished value="{year}" />
+<minplayers value="{minplayers}" />
+<maxplayers value="{maxplayers}" />
+<poll name="suggested_numplayers" title="User Suggested Number of Players" totalvotes="{votes}">
+{poll}</poll>
+<playingtime value="{playtime}" />
+<minplaytime value="{playtime}" />
+<maxplaytime value="{playtime}" />
+<minage value="{age}" />
+{links}<statistics page="1">
+<ratings>
+<usersrated value="{num_voters}" />
+<average value="{avg_rating}" />
+<bayesaverage value="{geek_rating}" />
+<ranks>
+<rank type="subtype" id="1" name="boardgame" friendlyname="Board Game Rank" value="{rank}" bayesaverage="{geek_rating}" />
+{family_ranks}</ranks>
+<stddev value="1.5" />
+<median value="0" />
+<owned value="{owned}" />
+<trading value="12" />
+<wanting value="34" />
+<wishing value="567" />
+<numcomments value="{comments}" />
+<numweights value="{weights}" />
+<averageweight value="{weight}" />
+</ratings>
+</statistics>
+</item>
+'''
+
+# Subdomain -> name of its family rank in XML API2
+RANK_NAMES = {u'Strategy Games'    : u'strategygames',
+              u'Family Games'      : u'familygames',
+              u'Thematic Games'    : u'thematic',
+              u'Wargames'          : u'wargames',
+              u'Party Games'       : u'partygames',
+              u'Abstract Games'    : u'abstracts',
+              u"Children's Games"  : u'childrensgames',
+              u'Customizable Games': u'cgs'}
+
+THING_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'fixtures', 'xmlapi2_thing.xml')
+
+
+class StandInServer(object):
+    '''
+    Threaded HTTP server on localhost that serves fake BGG browse pages
+    and XML API responses.
+
+    csv_file_name           : Game list the pages are built from
+                              (Type: String)
+
+    latency                 : Seconds every response is delayed by
+                              (Type: float)
+
+    max_requests_per_second : Requests faster than this get a 429 back.
+                              None turns the throttling off.
+                              (Type: float)
+
+    error_rate              : Fraction of requests answered with a 503
+                              (Type: float)
+
+    latency_per_game        : Extra seconds an XML API response takes for
+                              every game asked for
+                              (Type: float)
+
+    max_games_per_request   : XML API requests for more games than this get
+                              a 503, like a request BGG gives up on. None
+                              means no limit.
+                              (Type: integer)
+
+    broken_game_ids         : XML API requests with any of these games in
+                              them always get a 500
+                              (Type: collection of Strings)
+
+    thing_fixture           : XML API2 thing response whose <item>'s are
+                              sent back instead of made up ones for their
+                              games. None for made up ones only.
+                              (Type: String)
+
+    port                    : Port to listen on, 0 picks a free one
+                              (Type: integer)
+    '''
+
+    def __init__(self, csv_file_name='BGG_GameList_tabbed.csv', latency=0.,
+                 max_requests_per_second=None, error_rate=0., port=0,
+                 latency_per_game=0., max_games_per_request=None,
+                 broken_game_ids=(), thing_fixture=THING_FIXTURE):
+
+        self.latency    = latency
+
+        self.latency_per_game = latency_per_game
+
+        self.max_games_per_request = max_games_per_request
+
+        self.broken_game_ids = set(broken_game_ids)
+
+        self.error_rate = error_rate
+
+        self.bucket     = TokenBucket(max_requests_per_second) \
+                            if max_requests_per_second else None
+
+        self.games      = _read_game_list(csv_file_name)
+
+        self.games_by_id = dict((game[2].split(u'/')[2], game)
+                                for game in self.games)
+
+        self.fixture_items = _read_fixture_items(thing_fixture) \
+                               if thing_fixture else {}
+
+        self.requests_served = 0
+
+        self.requests_throttled = 0
+
+        # Answered 304 because the client's ETag still matched
+        self.requests_not_modified = 0
+
+        self._lock   = threading.Lock()
+
+        self._server = _ThreadedHTTPServer(('127.0.0.1', port), _Handler)
+
+        self._server.stand_in = self
+
+        self._thread = None
+
+    @property
+    def url(self):
+
+        return 'http://127.0.0.1:' + str(self._server.server_address[1])
+
+    @property
+    def game_list_page(self):
+        '''
+        Stand-in for collect_games.BGG_GAME_LIST_PAGE
+        '''
+
+        return self.url + '/browse/boardgame/page/'
+
+    @property
+    def xmlapi(self):
+        '''
+        Stand-in for bg_scraper.BGG_XMLAPI
+        '''
+
+        return self.url + '/xmlapi/boardgame/'
+
+    @property
+    def xmlapi2(self):
+        '''
+        Stand-in for bg_scraper.BGG_XMLAPI2
+        '''
+
+        return self.url + '/xmlapi2/'
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+
+        self._thread.daemon = True
+
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+
+        # shutdown() waits on serve_forever(), which never ran if not started
+        if self._thread is not None:
+
+            self._server.shutdown()
+
+            self._thread = None
+
+        self._server.server_close()
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, *exc_info):
+
+        self.stop()
+
+    def allow_request(self):
+        '''
+        Server side version of the rate limit BGG enforces. Unlike the
+        client's bucket this never blocks, it just says no.
+        '''
+
+        return self.bucket is None or self.bucket.try_acquire()
+
+    def render_game_list_page(self, page):
+
+        start = (page - 1)*GAMES_PER_PAGE
+
+        rows = []
+
+        for row_num, game in enumerate(self.games[start:start+GAMES_PER_PAGE]):
+
+            rank, name, href, pub_year, geek_r, avg_r, num_v = game
+
+            year = u'' if pub_year == u'N/A' else \
+                   u"<span class='smallerfont dull'>(" + pub_year + u")</span>"
+
+            rows.append(ROW_TEMPLATE.format(rank=rank, row=row_num + 1,
+                                            href=cgi.escape(href, True),
+                                            name=cgi.escape(name), year=year,
+                                            geek_rating=geek_r,
+                                            avg_rating=avg_r,
+                                            num_voters=num_v))
+
+        return PAGE_TEMPLATE.format(rows=u''.join(rows))
+
+    def render_boardgames_xml(self, bg_ids):
+        '''
+        Response of the legacy XML API for a list of game ID's
+        '''
+
+        games = [self._boardgame_xml(bg_id) for bg_id in bg_ids]
+
+        return u'<?xml version="1.0" encoding="utf-8"?>\n' +\
+               u'<boardgames termsofuse="https://boardgamegeek.com/xmlapi/' +\
+               u'termsofuse">\n' + u''.join(games) + u'</boardgames>\n'
+
+    def render_things_xml(self, bg_ids):
+        '''
+        Response of XML API2's thing?stats=1 for a list of game ID's. Games
+        that don't exist are left out, like BGG does.
+        '''
+
+        items = [self.fixture_items.get(bg_id) or self._thing_xml(bg_id)
+                 for bg_id in bg_ids]
+
+        return u'<?xml version="1.0" encoding="utf-8"?>\n' +\
+               u'<items termsofuse="https://boardgamegeek.com/xmlapi/' +\
+               u'termsofuse">\n' + u''.join(items) + u'</items>\n'
+
+    def _boardgame_xml(self, bg_id):
+
+        values = self._made_up_values(bg_id)
+
+        if values is None:
+
+            return u'<boardgame objectid="' + bg_id + u'"><error message=' +\
+                   u'"Item not found"/></boardgame>\n'
+
+        links = u''.join(u'<' + tag + u' objectid="' + unicode(link_id) +\
+                         u'">' + cgi.escape(name) + u'</' + tag + u'>\n'
+                         for tag, link_id, name in values['links'])
+
+        poll = u''.join(u'<results numplayers="' + unicode(n) + u'">' +\
+                        u'<result value="Best" numvotes="' +\
+                        unicode(best) + u'" />' +\
+                        u'<result value="Recommended" numvotes="' +\
+                        unicode(recommended) + u'" />' +\
+                        u'<result value="Not Recommended" numvotes="' +\
+                        unicode(not_recommended) + u'" /></results>\n'
+                        for n, best, recommended, not_recommended
+                        in values['poll'])
+
+        return BOARDGAME_XML_TEMPLATE.format(**dict(values, links=links,
+                                                    poll=poll))
+
+    def _thing_xml(self, bg_id):
+
+        values = self._made_up_values(bg_id)
+
+        if values is None:
+
+            return u''
+
+        # XML API2 has 0's where the browse pages have N/A
+        for key in ('num_voters', 'avg_rating', 'geek_rating'):
+
+            if values[key] == u'N/A':
+
+                values[key] = u'0'
+
+        links = []
+
+        family_ranks = []
+
+        for tag, link_id, name in values['links']:
+
+            if tag == 'boardgamesubdomain':
+
+                family_ranks.append(u'<rank type="family" id="' +\
+                                    unicode(5496 + link_id) + u'" name="' +\
+                                    RANK_NAMES[name] + u'" friendlyname="' +\
+                                    cgi.escape(name[:-1], True) +\
+                                    u' Rank" value="' + values['rank'] +\
+                                    u'" bayesaverage="' +\
+                                    values['geek_rating'] + u'" />\n')
+
+            else:
+
+                links.append(u'<link type="' + tag + u'" id="' +\
+                             unicode(link_id) + u'" value="' +\
+                             cgi.escape(name, True) + u'" />\n')
+
+        poll = u''.join(u'<results numplayers="' + unicode(n) + u'">' +\
+                        u'<result value="Best" numvotes="' +\
+                        unicode(best) + u'" />' +\
+                        u'<result value="Recommended" numvotes="' +\
+                        unicode(recommended) + u'" />' +\
+                        u'<result value="Not Recommended" numvotes="' +\
+                        unicode(not_recommended) + u'" /></results>\n'
+                        for n, best, recommended, not_recommended
+                        in values['poll'])
+
+        # Attributes need their quotes escaped too
+        return THING_XML_TEMPLATE.format(**dict(values,
+                   name=cgi.escape(values['game_name'], True),
+                   rank=u'Not Ranked' if values['geek_rating'] == u'0'
+                        else values['rank'],
+                   links=u''.join(links),
+                   family_ranks=u''.join(family_ranks),
+                   poll=poll))
+
+    def _made_up_values(self, bg_id):
+        '''
+        Everything the XML APIs say about a game from the csv file, None if
+        it isn't in there. Links are (tag, id, name) tuples, the player
+        poll (players, best, recommended, not recommended) tuples.
+        '''
+
+        game = self.games_by_id.get(bg_id)
+
+        if game is None:
+
+            return
+
+        rank, name, href, pub_year, geek_r, avg_r, num_v = game
+
+        # Same made up values every time the game is asked for
+        rand = random.Random(int(bg_id))
+
+        minplayers = rand.randint(1, 3)
+
+        links = []
+
+        for tag, pool, count in (('boardgamedesigner', DESIGNERS, 2),
+                                 ('boardgameartist', ARTISTS, 3),
+                                 ('boardgamecategory', CATEGORIES, 3),
+                                 ('boardgamemechanic', MECHANICS, 4),
+                                 ('boardgamefamily', FAMILIES, 2),
+                                 ('boardgamesubdomain', SUBDOMAINS, 1)):
+
+            for index in rand.sample(xrange(len(pool)), rand.randint(1, count)):
+
+                links.append((tag, index + 1, pool[index]))
+
+        maxplayers = minplayers + rand.randint(0, 5)
+
+        poll = [(n, rand.randint(0, 50), rand.randint(0, 50),
+                 rand.randint(0, 50)) for n in range(minplayers, maxplayers + 2)]
+
+        values = {'id'         : bg_id,
+                  'year'       : u'0' if pub_year == u'N/A' else pub_year,
+                  'minplayers' : minplayers,
+                  'maxplayers' : maxplayers,
+                  'game_name'  : name,
+                  'name'       : cgi.escape(name),
+                  'description': cgi.escape(name) + u' is a game. ' * 40,
+                  'links'      : links,
+                  'poll'       : poll,
+                  'num_voters' : num_v,
+                  'avg_rating' : avg_r,
+                  'geek_rating': geek_r,
+                  'rank'       : rank}
+
+        # Drawn in the order the values always were
+        values['playtime'] = rand.choice([15, 30, 45, 60, 90, 120, 180, 240])
+        values['age']      = rand.choice([0, 6, 8, 10, 12, 13, 14, 16])
+        values['votes']    = rand.randint(0, 500)
+        values['owned']    = rand.randint(100, 50000)
+        values['comments'] = rand.randint(10, 5000)
+        values['weights']  = rand.randint(0, 2000)
+        values['weight']   = u'%.4f' % rand.choice([0, rand.uniform(1, 5)])
+
+        return values
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    routes = [(re.compile(r'^/browse/boardgame/page/(\d+)$'),
+               '_game_list_page'),
+              (re.compile(r'^/xmlapi/boardgame/([\d,]+)$'),
+               '_boardgames_xml'),
+              (re.compile(r'^/xmlapi2/thing$'),
+               '_things_xml')]
+
+    def do_GET(self):
+
+        stand_in = self.server.stand_in
+
+        if stand_in.latency:
+
+            time.sleep(stand_in.latency)
+
+        if not stand_in.allow_request():
+
+            with stand_in._lock:
+
+                stand_in.requests_throttled += 1
+
+            return self._respond(429, 'Rate limit exceeded',
+                                 {'Retry-After': '1'})
+
+        if stand_in.error_rate and random.random() < stand_in.error_rate:
+
+            return self._respond(503, 'Service unavailable')
+
+        with stand_in._lock:
+
+            stand_in.requests_served += 1
+
+        for pattern, method_name in self.routes:
+
+            match = pattern.match(urlparse.urlparse(self.path).path)
+
+            if match:
+
+                return getattr(self, method_name)(stand_in, *match.groups())
+
+        self._respond(404, 'Not found')
+
+    def _game_list_page(self, stand_in, page):
+
+        self._respond(200, stand_in.render_game_list_page(int(page)),
+                      {'Content-Type': 'text/html; charset=utf-8'})
+
+    def _boardgames_xml(self, stand_in, bg_ids):
+
+        bg_ids = bg_ids.split(',')
+
+        if self._refuse_xmlapi_request(stand_in, bg_ids):
+
+            return
+
+        self._respond(200, stand_in.render_boardgames_xml(bg_ids),
+                      {'Content-Type': 'text/xml; charset=utf-8'})
+
+    def _things_xml(self, stand_in):
+
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+
+        bg_ids = [bg_id for bg_id in query.get('id', [''])[0].split(',')
+                  if bg_id]
+
+        if not bg_ids:
+
+            return self._respond(400, 'No id given')
+
+        if self._refuse_xmlapi_request(stand_in, bg_ids):
+
+            return
+
+        self._respond(200, stand_in.render_things_xml(bg_ids),
+                      {'Content-Type': 'text/xml; charset=utf-8'})
+
+    def _refuse_xmlapi_request(self, stand_in, bg_ids):
+        '''
+        Slow down an XML API request for its size, and answer it with an
+        error if it is too big or has a broken game. True if it was.
+        '''
+
+        if stand_in.latency_per_game:
+
+            time.sleep(stand_in.latency_per_game*len(bg_ids))
+
+        if stand_in.max_games_per_request is not None and\
+           len(bg_ids) > stand_in.max_games_per_request:
+
+            self._respond(503, 'Too many games requested')
+
+            return True
+
+        if stand_in.broken_game_ids.intersection(bg_ids):
+
+            self._respond(500, 'Internal server error')
+
+            return True
+
+        return False
+
+    def _respond(self, status, body, headers=None):
+
+        if isinstance(body, unicode):
+
+            body = body.encode('utf-8')
+
+        if status == 200:
+
+            # Lets clients revalidate what they cached with If-None-Match
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+
+            headers = dict(headers or {}, ETag=etag)
+
+            if self.headers.get('If-None-Match') == etag:
+
+                with self.server.stand_in._lock:
+
+                    self.server.stand_in.requests_not_modified += 1
+
+                status, body = 304, ''
+
+        self.send_response(status)
+
+        for key, value in (headers or {}).items():
+
+            self.send_header(key, value)
+
+        self.send_header('Content-Length', str(len(body)))
+
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+
+        # Keep the benchmark output readable
+        pass
+
+
+def _read_game_list(csv_file_name):
+
+    with open(csv_file_name, 'rb') as csv_file:
+
+        csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+        labels = csv_contents.next()
+
+        return [[field.decode('utf-8') for field in row]
+                for row in csv_contents]
+
+
+def _read_fixture_items(fixture_file_name):
+    '''
+    The <item>'s of a saved XML API2 thing response, as text by game ID
+    '''
+
+    with open(fixture_file_name, 'rb') as fixture_file:
+
+        fixture = fixture_file.read().decode('utf-8')
+
+    return dict((match.group(1), match.group(0) + u'\n') for match
+                in re.finditer(r'<item [^>]*\bid="(\d+)".*?</item>', fixture,
+                               re.DOTALL))
@@ -0,0 +1,299 @@
+'''
+Streaming parser for the XML that BGG's XML API sends back.
+
+Building a whole BeautifulSoup tree for a 100 game response and then
+searching it over and over for every game is slow and holds the entire
+response in memory. Instead this walks the XML once with iterparse and
+hands back each <boardgame> as a small record as soon as its end tag is
+reached, after which the element is thrown away.
+
+iter_things() does the same for the <item>'s of XML API2's
+thing?stats=1, which also has the name, year, rank and ratings.
+
+Uses lxml if it is installed, otherwise the C ElementTree from the
+standard library.
+'''
+
+from collections import namedtuple
+from io import BytesIO
+
+try:
+    from lxml.etree import iterparse
+
+except ImportError:
+    from xml.etree.cElementTree import iterparse
+
+
+# Fields pulled out of every <boardgame>, named after the bg_dict keys
+BoardgameRecord = namedtuple('BoardgameRecord', ['id',
+                                                 'min_players',
+                                                 'max_players',
+                                                 'play_time',
+                                                 'sugg_age',
+                                                 'complx_rating',
+                                                 'designers',
+                                                 'artists',
+                                                 'categories',
+                                                 'mechanics',
+                                                 'family',
+                                                 'type'])
+
+# Tags that hold a single value -> record field
+SINGLE_VALUE_TAGS = {'minplayers'   : 'min_players',
+                     'maxplayers'   : 'max_players',
+                     'playingtime'  : 'play_time',
+                     'age'          : 'sugg_age',
+                     'averageweight': 'complx_rating'}
+
+# Tags that show up once per item -> record field holding the list of items
+MULTI_VALUE_TAGS  = {'boardgamedesigner' : 'designers',
+                     'boardgameartist'   : 'artists',
+                     'boardgamecategory' : 'categories',
+                     'boardgamemechanic' : 'mechanics',
+                     'boardgamefamily'   : 'family',
+                     'boardgamesubdomain': 'type'}
+
+# Every boardgames column, which a thing?stats=1 <item> has all of (but
+#   href, which is made from the id)
+ThingRecord = namedtuple('ThingRecord', ['id',
+                                         'rank',
+                                         'name',
+                                         'pub_year',
+                                         'geek_rating',
+                                         'avg_rating',
+                                         'num_voters',
+                                         'min_players',
+                                         'max_players',
+                                         'play_time',
+                                         'sugg_age',
+                                         'complx_rating',
+                                         'designers',
+                                         'artists',
+                                         'categories',
+                                         'mechanics',
+                                         'family',
+                                         'type'])
+
+# XML API2 tags with a value attribute -> record field
+THING_VALUE_TAGS = {'yearpublished': 'pub_year',
+                    'minplayers'   : 'min_players',
+                    'maxplayers'   : 'max_players',
+                    'playingtime'  : 'play_time',
+                    'minage'       : 'sugg_age',
+                    'usersrated'   : 'num_voters',
+                    'average'      : 'avg_rating',
+                    'bayesaverage' : 'geek_rating',
+                    'averageweight': 'complx_rating'}
+
+# XML API2 <link type=...> -> record field. Other links (publishers,
+#   expansions, ...) are left out like they are in the legacy API.
+THING_LINK_TYPES = {'boardgamedesigner': 'designers',
+                    'boardgameartist'  : 'artists',
+                    'boardgamecategory': 'categories',
+                    'boardgamemechanic': 'mechanics',
+                    'boardgamefamily'  : 'family'}
+
+# XML API2 has no subdomain links, a game's subdomains are the family
+#   ranks it has: <rank type="family" name=...> -> subdomain
+RANK_SUBDOMAINS = {'strategygames' : u'Strategy Games',
+                   'familygames'   : u'Family Games',
+                   'thematic'      : u'Thematic Games',
+                   'wargames'      : u'Wargames',
+                   'partygames'    : u'Party Games',
+                   'abstracts'     : u'Abstract Games',
+                   'childrensgames': u"Children's Games",
+                   'cgs'           : u'Customizable Games'}
+
+
+def iter_boardgames(xml_source):
+    '''
+    Yield a BoardgameRecord for every <boardgame> in an XML API response.
+
+    xml_source : The response, either as text/bytes or as a file object
+                 (Type: String or file)
+
+    Single values keep the first occurrence inside the game (what
+    boardgame.minplayers does in BeautifulSoup) and every value is unicode,
+    or None if the tag was empty or missing.
+    '''
+
+    root   = None
+
+    fields = None
+
+    for event, elem in iterparse(_byte_stream(xml_source),
+                                 events=('start', 'end')):
+
+        tag = elem.tag
+
+        if event == 'start':
+
+            if root is None:
+
+                root = elem
+
+            elif tag == 'boardgame':
+
+                fields = dict((field, []) for field in
+                              MULTI_VALUE_TAGS.values())
+
+                fields['id'] = _unicode(elem.get('objectid'))
+
+            continue
+
+        # Anything outside of a <boardgame> (the root tag) is not wanted
+        if fields is None:
+
+            continue
+
+        if tag in MULTI_VALUE_TAGS:
+
+            fields[MULTI_VALUE_TAGS[tag]].append(_unicode(elem.text))
+
+        elif tag in SINGLE_VALUE_TAGS:
+
+            fields.setdefault(SINGLE_VALUE_TAGS[tag], _unicode(elem.text))
+
+        elif tag == 'boardgame':
+
+            yield BoardgameRecord(**dict((field, fields.get(field)) for field
+                                         in BoardgameRecord._fields))
+
+            fields = None
+
+            # Done with this game, free it and everything the root holds
+            elem.clear()
+
+            root.clear()
+
+
+def iter_things(xml_source):
+    '''
+    Yield a ThingRecord for every <item> in an XML API2 thing?stats=1
+    response.
+
+    xml_source : The response, either as text/bytes or as a file object
+                 (Type: String or file)
+
+    Values are unicode, or None where BGG has nothing: a rank of
+    "Not Ranked", a geek_rating of 0 (unranked), an avg_rating without any
+    voters and a pub_year of 0 (unknown). Raises ValueError if the
+    response isn't an <items> list (eg. an error or busy page).
+    '''
+
+    root   = None
+
+    fields = None
+
+    for event, elem in iterparse(_byte_stream(xml_source),
+                                 events=('start', 'end')):
+
+        tag = elem.tag
+
+        if event == 'start':
+
+            if root is None:
+
+                if tag != 'items':
+
+                    raise ValueError("Expected an XML API2 <items> response, "
+                                     "got <" + tag + ">")
+
+                root = elem
+
+            elif tag == 'item' and fields is None:
+
+                fields = dict((field, []) for field in
+                              THING_LINK_TYPES.values() + ['type'])
+
+                fields['id'] = _unicode(elem.get('id'))
+
+            continue
+
+        if fields is None:
+
+            continue
+
+        if tag in THING_VALUE_TAGS:
+
+            fields.setdefault(THING_VALUE_TAGS[tag], _unicode(elem.get('value')))
+
+        elif tag == 'name':
+
+            if elem.get('type') == 'primary':
+
+                fields['name'] = _unicode(elem.get('value'))
+
+        elif tag == 'link':
+
+            if elem.get('type') in THING_LINK_TYPES:
+
+                fields[THING_LINK_TYPES[elem.get('type')]].append(
+                    _unicode(elem.get('value')))
+
+        elif tag == 'rank':
+
+            if elem.get('name') == 'boardgame':
+
+                fields['rank'] = _unicode(elem.get('value'))
+
+            elif elem.get('type') == 'family':
+
+                # Unknown subdomains by their friendly name ("... Rank")
+                fields['type'].append(RANK_SUBDOMAINS.get(elem.get('name'),
+                    _unicode(elem.get('friendlyname', '')).replace(u' Rank',
+                                                                   u's')))
+
+        elif tag == 'item':
+
+            yield ThingRecord(**_thing_fields(fields))
+
+            fields = None
+
+            elem.clear()
+
+            root.clear()
+
+
+def _thing_fields(fields):
+    '''
+    Fields of a ThingRecord from what was found in an <item>, with BGG's
+    stand-ins for nothing turned into None
+    '''
+
+    fields = dict((field, fields.get(field)) for field in ThingRecord._fields)
+
+    if fields['rank'] is not None and not fields['rank'].isdigit():
+
+        fields['rank'] = None
+
+    if fields['num_voters'] in (None, u'0'):
+
+        fields['avg_rating'] = None
+
+    for field in ('geek_rating', 'pub_year'):
+
+        if fields[field] is not None and float(fields[field]) == 0:
+
+            fields[field] = None
+
+    return fields
+
+
+def _byte_stream(xml_source):
+
+    if isinstance(xml_source, unicode):
+
+        # BGG declares utf-8 in the XML header, so the parser wants bytes
+        xml_source = xml_source.encode('utf-8')
+
+    if isinstance(xml_source, str):
+
+        xml_source = BytesIO(xml_source)
+
+    return xml_source
+
+
+def _unicode(text):
+
+    return None if text is None else unicode(text)
@@ -0,0 +1,338 @@
+'''
+Query plan checks for the analysis queries in data_analysis.py.
+
+On a few thousand games Postgres is happy to scan whole tables, so a
+missing or unusable index doesn't show. This script fills its own
+database with a synthetic catalog (200k games by default, with about as
+many items per column as BGG has), normalizes it, and then runs every
+data_analysis function that should only touch a few rows. The SQL each
+one runs is collected with query_executor.logged_queries() and EXPLAINed.
+A check fails when a plan reads all of boardgames, a normalized table or
+the item_rank_bands view: a Seq Scan, or an index scan without an index
+condition.
+
+The items looked up are rare ones (a designer's handful of games), the
+case the indexes are there for. Functions that read every row by design
+(count_column(), time_vs_complexity(), ...) are explained too, but only
+reported.
+
+The catalog is written to PLAN_CHECK_DATABASE, which has to be created
+first:
+
+$ createdb bggdb_plans
+$ python check_query_plans.py              # build the catalog and check
+$ python check_query_plans.py --no-build   # check the catalog already there
+
+Exits with status 1 if any check fails.
+'''
+
+import json
+import sys
+import time
+
+import psycopg2
+
+import bg_scraper
+import data_analysis
+import normalize_database
+import query_cache
+import query_executor
+
+PLAN_CHECK_DATABASE = "dbname = 'bggdb_plans'"
+
+NUM_GAMES = 200000
+
+# boardgames column -> (number of distinct items, items per game). The
+#   first item of a game is spread evenly, the others are picked with a
+#   multiplier so games don't all share the same combinations.
+SYNTHETIC_ITEMS = [('designers',  (50000, 2)),
+                   ('artists',    (50000, 1)),
+                   ('categories', (84,    2)),
+                   ('mechanics',  (51,    3)),
+                   ('family',     (20000, 1)),
+                   ('type',       (8,     1))]
+
+# Item given to RARE_ITEM_GAMES games in every column, the one looked up
+RARE_ITEM = 'Plan Check Item'
+
+RARE_ITEM_GAMES = 20
+
+# Tables that must not be read from end to end by a selective query
+WATCHED_RELATIONS = [table for column, (table, item)
+                     in normalize_database.LINK_TABLES] +\
+                    ['boardgames', bg_scraper.RANK_BANDS_VIEW]
+
+
+def build_synthetic_catalog(num_games=NUM_GAMES, db=PLAN_CHECK_DATABASE):
+    '''
+    Replace boardgames in db with num_games made up games and normalize
+    them
+
+    num_games : Games in the catalog
+                (Type: int)
+
+    db        : database to fill (everything in it that depends on
+                boardgames is dropped)
+    '''
+
+    start_time = time.time()
+
+    every = num_games // RARE_ITEM_GAMES
+
+    arrays = []
+
+    for column, (num_items, per_game) in SYNTHETIC_ITEMS:
+
+        items = ["""'""" + column + """ ' || ((g * """ + str(2*i + 1) +\
+                 """ + """ + str(i) + """) %% """ + str(num_items) + """)"""
+                 for i in range(per_game)]
+
+        arrays.append("""CASE WHEN g %% """ + str(every) + """ = 7
+                              THEN ARRAY[""" + ', '.join(items) + """, %(rare)s]
+                              ELSE ARRAY[""" + ', '.join(items) + """]
+                         END""")
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""DROP TABLE IF EXISTS boardgames CASCADE;""")
+
+    bg_scraper.create_table_in_database(db)
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""INSERT INTO boardgames
+                            SELECT g, g, 'Game ' || g, '/boardgame/' || g,
+                                   1950 + g %% 70,
+                                   (8.5 - 3. * g / %(num_games)s)::real,
+                                   (9. - 3. * g / %(num_games)s
+                                       + (g %% 7) / 10.)::real,
+                                   100 * %(num_games)s / g,
+                                   1 + g %% 3, 2 + g %% 6, 15 * (1 + g %% 12),
+                                   6 + g %% 12, (1. + (g %% 40) / 10.)::real,
+                                   """ + """,
+                                   """.join(arrays) + """
+                            FROM generate_series(1, %(num_games)s) AS g;""",
+                         {'num_games': num_games, 'rare': RARE_ITEM})
+
+    normalize_database.normalize_database(db=db)
+
+    with psycopg2.connect(db) as conn:
+
+        conn.autocommit = True
+
+        with conn.cursor() as curs:
+
+            curs.execute("""ANALYZE boardgames;""")
+
+    print "Built a synthetic catalog of", num_games, "games in",\
+          time.time() - start_time, "seconds"
+
+
+def plan_checks():
+    '''
+    (description, function, args, must_use_indexes) for every check
+    '''
+
+    checks = []
+
+    for column, link in normalize_database.LINK_TABLES:
+
+        for function, args in [
+                (data_analysis.geek_rating_avg_rating_for_item_in_column,
+                 (column, RARE_ITEM)),
+                (data_analysis.num_voters_for_item_in_column,
+                 (column, RARE_ITEM, 0)),
+                (data_analysis.geek_rating_comp_rating_for_item_in_column,
+                 (column, RARE_ITEM, 0)),
+                (data_analysis.comp_rating_sugg_age_for_item_in_column,
+                 (column, RARE_ITEM, 0)),
+                (data_analysis.stats_for_items_in_column,
+                 (column, [RARE_ITEM])),
+                (data_analysis.list_of_unique_items_for_rank, (column, 100)),
+                (data_analysis.item_stats_above_rank, (column, 101))]:
+
+            checks.append((function, args, True))
+
+    for sortby in (None, 'num', 'geek', 'playtime'):
+
+        checks.append((data_analysis.avg_geek_rating_playtime_per_mechanic,
+                       (101, sortby), True))
+
+    # Read every row by design
+    for column in ('designers', 'mechanics'):
+
+        checks.append((data_analysis.count_column, (column,), False))
+
+        checks.append((data_analysis.list_of_unique_items, (column,), False))
+
+        checks.append((data_analysis.stats_for_items_in_column, (column,),
+                       False))
+
+    checks.append((data_analysis.time_vs_complexity, (300, 5), False))
+
+    checks.append((data_analysis.avg_geek_rating_playtime_per_mechanic,
+                   (NUM_GAMES + 1,), False))
+
+    return [(function.__name__ + repr(args), function, args, must_use_indexes)
+            for function, args, must_use_indexes in checks]
+
+
+def check_query_plans(db=PLAN_CHECK_DATABASE, verbose=False):
+    '''
+    EXPLAIN the queries of every check in plan_checks() on db
+
+    verbose : Print every plan, not just the ones that fail
+              (Type: bool)
+
+    Returns the number of failed checks
+    '''
+
+    query_executor.use_database(db)
+
+    cache = query_cache.cache
+
+    query_cache.use_cache(None)
+
+    failed = 0
+
+    try:
+
+        with psycopg2.connect(db) as conn:
+            with conn.cursor() as curs:
+
+                for description, function, args, must_use_indexes\
+                        in plan_checks():
+
+                    with query_executor.logged_queries() as queries:
+
+                        function(*args)
+
+                    full_scans = []
+
+                    plans = []
+
+                    for sql, params in queries:
+
+                        plan = explain(curs, sql, params)
+
+                        plans.append(plan)
+
+                        full_scans += _full_scans(plan)
+
+                    # '--' for the ones that may read everything
+                    status = 'ok' if not must_use_indexes or not full_scans\
+                             else 'FAIL'
+
+                    if status == 'FAIL':
+
+                        failed += 1
+
+                    print '%-4s %s' % (status if must_use_indexes else '--',
+                                       description),
+
+                    if full_scans:
+
+                        print '(reads all of ' +\
+                              ', '.join(sorted(set(full_scans))) + ')',
+
+                    print
+
+                    if status == 'FAIL' or verbose:
+
+                        for plan in plans:
+
+                            print _plan_text(plan)
+
+    finally:
+
+        query_cache.use_cache(cache)
+
+        query_executor.close_pool()
+
+        query_executor.use_database(bg_scraper.DATABASE)
+
+    print "\n" + str(failed), "of", len(plan_checks()), "checks failed"
+
+    return failed
+
+
+def explain(curs, sql, params=()):
+    '''
+    The plan Postgres picks for a query, as the dict EXPLAIN (FORMAT JSON)
+    gives
+    '''
+
+    query = curs.mogrify(sql.strip().rstrip(';'), params or None)
+
+    curs.execute("""EXPLAIN (FORMAT JSON) """ + query)
+
+    plan = curs.fetchone()[0]
+
+    # Older psycopg2 hands json back as text
+    if isinstance(plan, basestring):
+
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']
+
+
+def _full_scans(plan):
+    '''
+    Watched relations that a plan (or any node under it) reads end to end
+    '''
+
+    scans = []
+
+    relation = plan.get('Relation Name')
+
+    if relation in WATCHED_RELATIONS:
+
+        if plan['Node Type'] == 'Seq Scan' or\
+           (plan['Node Type'] in ('Index Scan', 'Index Only Scan') and
+            'Index Cond' not in plan):
+
+            scans.append(relation)
+
+    for child in plan.get('Plans', []):
+
+        scans += _full_scans(child)
+
+    return scans
+
+
+def _plan_text(plan, depth=1):
+    '''
+    A short indented outline of a plan, one node per line
+    '''
+
+    line = '    ' * depth + plan['Node Type']
+
+    if 'Relation Name' in plan:
+
+        line += ' on ' + plan['Relation Name']
+
+    if 'Index Name' in plan:
+
+        line += ' using ' + plan['Index Name']
+
+    for key in ('Index Cond', 'Filter'):
+
+        if key in plan:
+
+            line += '  ' + key + ': ' + plan[key]
+
+    return '\n'.join([line] + [_plan_text(child, depth + 1)
+                               for child in plan.get('Plans', [])])
+
+
+if __name__ == "__main__":
+
+    if '--no-build' not in sys.argv[1:]:
+
+        build_synthetic_catalog()
+
+    if check_query_plans(verbose='--verbose' in sys.argv[1:]):
+
+        sys.exit(1)
@@ -1,7 +1,18 @@
 import requests
 from bs4 import BeautifulSoup
 import time
+import threading
+import multiprocessing
+import Queue
 import numpy as np
+from bgg_http import TokenBucket, is_throttled, retry_after_seconds, fetch,\
+                     sends_request
+
+try:
+    from lxml.html import fromstring as parse_html
+
+except ImportError:
+    parse_html = None
 
 # Global Variables 
 
@@ -11,8 +22,18 @@ BGG_SITE = 'https://boardgamegeek.com'
 
 BGG_GAME_LIST_PAGE = 'https://boardgamegeek.com/browse/boardgame/page/'
 
+GAMES_PER_PAGE = 100 # bgg lists 100 games on every browse page
+
+MAX_PAGE_ATTEMPTS = 5 # give up on a page after this many failed requests
+
+# give up on a page BGG keeps answering with 429/503. Every one of those
+#   slows the bucket down and waits out Retry-After, so it takes a while
+MAX_THROTTLED_ATTEMPTS = 50
+
 
-def scrape_list_of_top_games(num_games, out_file_name = 'BGG_GameList.csv'):
+def scrape_list_of_top_games(num_games, out_file_name = 'BGG_GameList.csv',
+                             base_url = BGG_GAME_LIST_PAGE,
+                             wait_time = WAIT_TIME_BETWEEN_REQUESTS):
     '''
     Go to boardgamegeek.com's board game browser and get data on the top ranked
     games on their site and save it to a CSV file. 
@@ -22,6 +43,13 @@ def scrape_list_of_top_games(num_games, out_file_name = 'BGG_GameList.csv'):
 
     out_file_name : Name of the text file to be written.
                     (Type: String) 
+
+    base_url      : Browse page url that the page number gets appended to.
+                    Only needs changing to point at a local stand-in server.
+                    (Type: String)
+
+    wait_time     : Seconds to sleep between page requests
+                    (Type: float)
          
     '''
     start_time = time.time()
@@ -38,11 +66,11 @@ def scrape_list_of_top_games(num_games, out_file_name = 'BGG_GameList.csv'):
 
         for i in range(num_pages):
 
-            bggURL = BGG_GAME_LIST_PAGE + str(i + 1)
+            bggURL = base_url + str(i + 1)
 
             print('Scraping: ' + bggURL)
 
-            r = requests.get(bggURL)
+            r = fetch(bggURL)
 
             soup = BeautifulSoup(r.text, 'html.parser')
 
@@ -72,8 +100,357 @@ def scrape_list_of_top_games(num_games, out_file_name = 'BGG_GameList.csv'):
                 csv_file.write( '\t'.join(game_info).encode('utf-8') + '\n') 
 
             # So I don't get blacklisted on bgg...
-            # time to wait between requests 
-            time.sleep(WAIT_TIME_BETWEEN_REQUESTS)
+            # time to wait between requests (not needed if the page came
+            # out of the response cache)
+            if not r.from_cache:
+
+                time.sleep(wait_time)
+
+def scrape_list_of_top_games_concurrent(num_games,
+                                        out_file_name = 'BGG_GameList.csv',
+                                        num_workers = 4,
+                                        requests_per_second = 1.,
+                                        base_url = BGG_GAME_LIST_PAGE,
+                                        parse_processes = 0):
+    '''
+    Same output as scrape_list_of_top_games() but keeps several page requests
+    in flight at once instead of sleeping a fixed amount between each page.
+
+    All workers share a token bucket, so BGG never sees more than
+    requests_per_second requests. When BGG answers with 429/503 the bucket
+    halves its rate and honors Retry-After, and the page is put back on the
+    queue to be requested again.
+
+    Pages can come back out of order, so finished pages are held until every
+    page before them has been written. The CSV is always in rank order.
+
+    num_games           : Number of games to scrape on the website ranking list.
+                          (Type: integer)
+
+    out_file_name       : Name of the text file to be written.
+                          (Type: String)
+
+    num_workers         : Number of threads requesting pages at the same time
+                          (Type: integer)
+
+    requests_per_second : Maximum rate of requests sent to BGG
+                          (Type: float)
+
+    base_url            : Browse page url that the page number gets appended
+                          to. Only needs changing to point at a local stand-in
+                          server.
+                          (Type: String)
+
+    parse_processes     : Pages are parsed with parse_list_page_lxml(). With
+                          0 the workers parse them themselves, otherwise
+                          they hand them to a pool of this many processes,
+                          so parsing isn't held up by the GIL.
+                          (Type: integer)
+    '''
+    start_time = time.time()
+
+    # Made before any thread is started, forking a threaded process isn't safe
+    pool = multiprocessing.Pool(parse_processes) if parse_processes else None
+
+    num_pages = (int(num_games) + GAMES_PER_PAGE - 1)//GAMES_PER_PAGE
+
+    bucket = TokenBucket(requests_per_second, capacity=num_workers)
+
+    page_queue   = Queue.Queue()
+
+    result_queue = Queue.Queue()
+
+    stop_event   = threading.Event()
+
+    for page in range(1, num_pages + 1):
+
+        page_queue.put(page)
+
+    # page -> [failed requests, throttled requests], shared by the workers
+    #   since a page that is put back can be picked up by any of them
+    attempts = {}
+
+    workers = [threading.Thread(target=_page_worker,
+                                args=(base_url, bucket, page_queue,
+                                      result_queue, stop_event, pool,
+                                      attempts))
+               for _ in range(num_workers)]
+
+    for worker in workers:
+
+        worker.daemon = True
+
+        worker.start()
+
+    # Pages that arrived before the pages in front of them were written
+    finished_pages = {}
+
+    next_page = 1
+
+    games_written = 0
+
+    try:
+
+        with open(out_file_name, 'w') as csv_file:
+
+            # Write header information for csv 
+            csv_file.write('Rank\tName\tHRef\tYear Published\tGeek Rating\t'+\
+                                      'Average Rating\tNumber of Voters\n')
+
+            while next_page <= num_pages and games_written < num_games:
+
+                page, game_infos, error = result_queue.get()
+
+                if error is not None:
+
+                    raise error
+
+                finished_pages[page] = game_infos
+
+                while next_page in finished_pages:
+
+                    game_infos = finished_pages.pop(next_page)
+
+                    print('Writing page: ' + str(next_page))
+
+                    for game_info in game_infos:
+
+                        if games_written == num_games:
+
+                            break
+
+                        # Same layout as the sequential scraper, no newline
+                        #   after the very last game
+                        if games_written:
+
+                            csv_file.write('\n')
+
+                        csv_file.write('\t'.join(game_info).encode('utf-8'))
+
+                        games_written += 1
+
+                    next_page += 1
+
+                    # Ran out of ranked games before reaching num_games
+                    if not game_infos:
+
+                        next_page = num_pages + 1
+
+                        break
+
+    finally:
+
+        stop_event.set()
+
+        if pool is not None:
+
+            pool.terminate()
+
+    total_time = time.time() - start_time
+
+    print('Total time to scrape: ' +\
+           str(total_time) + ' seconds ('+\
+           str(total_time/60.) +' minutes)')
+
+def _page_worker(base_url, bucket, page_queue, result_queue, stop_event,
+                 pool=None, attempts=None):
+    '''
+    Thread target for scrape_list_of_top_games_concurrent()
+
+    Pulls page numbers off page_queue and puts (page, game_infos, error)
+    tuples on result_queue. Pages are parsed in pool if one is given.
+    attempts counts the failed and throttled requests of every page (a page
+    is only ever in one worker's hands, so it needs no lock).
+    '''
+
+    if attempts is None:
+
+        attempts = {}
+
+    while not stop_event.is_set():
+
+        try:
+
+            page = page_queue.get_nowait()
+
+        except Queue.Empty:
+
+            return
+
+        bggURL = base_url + str(page)
+
+        page_attempts = attempts.setdefault(page, [0, 0])
+
+        # Pages in the response cache don't count against the rate limit
+        if sends_request(bggURL):
+
+            bucket.acquire()
+
+        try:
+
+            r = fetch(bggURL)
+
+        except requests.RequestException as error:
+
+            r = None
+
+        if r is not None and is_throttled(r):
+
+            # Not a failed attempt, the server just wants us slower. It
+            #   still has its own limit, or a page that is never let
+            #   through would keep the crawl going forever.
+            bucket.throttle(retry_after_seconds(r))
+
+            page_attempts[1] += 1
+
+            if page_attempts[1] < MAX_THROTTLED_ATTEMPTS:
+
+                page_queue.put(page)
+
+            else:
+
+                result_queue.put((page, None,
+                                  IOError('Gave up on ' + bggURL +\
+                                          ', throttled ' +\
+                                          str(page_attempts[1]) +\
+                                          ' times (HTTP ' +\
+                                          str(r.status_code) + ')')))
+
+            continue
+
+        if r is None or r.status_code != 200:
+
+            page_attempts[0] += 1
+
+            if page_attempts[0] < MAX_PAGE_ATTEMPTS:
+
+                page_queue.put(page)
+
+            else:
+
+                if r is not None:
+
+                    error = IOError('Failed to get ' + bggURL + ' (HTTP ' +\
+                                    str(r.status_code) + ')')
+
+                result_queue.put((page, None, error))
+
+            continue
+
+        bucket.relax()
+
+        print('Scraped: ' + bggURL)
+
+        # Hand parse errors to the main thread instead of dying silently
+        try:
+
+            if pool is None:
+
+                game_infos = parse_list_page_lxml(r.text)
+
+            else:
+
+                # Only this thread waits, the others keep fetching
+                game_infos = pool.apply(parse_list_page_lxml, (r.text,))
+
+            result_queue.put((page, game_infos, None))
+
+        except Exception as error:
+
+            result_queue.put((page, None, error))
+
+def parse_list_page(html):
+    '''
+    Grab the info of every game listed on a single boardgame ranking page
+
+    Returns a list of the tuples made by get_game_info()
+    '''
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    return [get_game_info(game) for game in soup.select('#row_')]
+
+def parse_list_page_lxml(html):
+    '''
+    parse_list_page() using lxml instead of BeautifulSoup's html.parser.
+    Several times quicker, and it returns the same tuples (see
+    benchmarks.bench_list_page_parse()). Falls back to parse_list_page() if
+    lxml isn't installed.
+    '''
+
+    if parse_html is None:
+
+        return parse_list_page(html)
+
+    page = parse_html(html)
+
+    return [_game_info_lxml(game) for game in page.xpath("//*[@id='row_']")]
+
+def parse_list_pages(html_pages, num_processes=None):
+    '''
+    Parse a list of saved ranking pages in a pool of processes
+
+    html_pages    : The pages' HTML
+                    (Type: list of Strings)
+
+    num_processes : Size of the pool, one per CPU if not given
+                    (Type: integer)
+
+    Returns a list of what parse_list_page_lxml() gives for each page, in
+    the same order
+    '''
+
+    pool = multiprocessing.Pool(num_processes)
+
+    try:
+
+        return pool.map(parse_list_page_lxml, html_pages)
+
+    finally:
+
+        pool.close()
+
+        pool.join()
+
+def _game_info_lxml(game):
+    '''
+    get_game_info() for an lxml element
+    '''
+
+    rank       = _text(_with_class(game, 'collection_rank')[0]).strip()
+
+    objectname = _with_class(game, 'collection_objectname')[0]
+
+    name_ref   = objectname.find('.//a')
+
+    name       = _text(name_ref)
+
+    reference  = unicode(name_ref.get('href'))
+
+    year       = objectname.find('.//span')
+
+    pub_year   = _text(year).strip('()') if year is not None else u'N/A'
+
+    g_rating, a_rating, num_voters = [_text(cell).strip() for cell
+                                      in _with_class(game,
+                                                     'collection_bggrating')]
+
+    return rank, name, reference, pub_year, g_rating, a_rating, num_voters
+
+def _with_class(element, class_name):
+    '''
+    Elements under element that have class_name among their classes, like
+    the CSS select .class_name
+    '''
+
+    return element.xpath("descendant::*[contains(concat(' ', " +\
+                         "normalize-space(@class), ' '), ' " + class_name +\
+                         " ')]")
+
+def _text(element):
+
+    # lxml hands back plain str for ascii text
+    return unicode(element.text_content())
 
 def get_game_info(game):
     '''
@@ -1,13 +1,55 @@
 import numpy as np
 import csv
-import psycopg2
 import seaborn
 import matplotlib.pyplot as plt
-from bg_scraper import DATABASE # Global Variable
+import query_cache
+import query_executor
+from bg_scraper import RANK_BANDS_VIEW
+from normalize_database import LINK_TABLES, RANK_BAND_WIDTH, RANK_BAND_STATS
+
+# Columns of boardgames returned for every game by stats_for_items_in_column()
+ITEM_STAT_COLUMNS = ['geek_rating',
+                     'avg_rating',
+                     'complx_rating',
+                     'sugg_age',
+                     'num_voters']
+
+ITEM_STAT_SELECT = ', '.join('boardgames.' + stat for stat in ITEM_STAT_COLUMNS)
+
+# A game_store.GameStore to answer from instead of the database, see
+#   use_game_store()
+game_store = None
+
+# Set to False to always join and group the link tables, even when the
+#   item_rank_bands view is there (used by the benchmarks)
+USE_RANK_BANDS = True
 
 colors = seaborn.color_palette("deep")
 seaborn.set_palette(colors)
 
+def use_game_store(store):
+    '''
+    Answer every function below from an in-memory game_store.GameStore
+    instead of querying the database. use_game_store(None) goes back to the
+    database.
+
+    store : eg. game_store.GameStore.from_database()
+            (Type: GameStore)
+    '''
+
+    global game_store
+
+    game_store = store
+
+def _using_game_store():
+
+    return game_store is not None
+
+# Functions marked @memoized keep their results in query_cache's cache,
+#   except when they are answered by a GameStore (just as quick)
+memoized = query_cache.memoize(skip=_using_game_store)
+
+@memoized
 def list_of_unique_items(column):
     '''
     Access database and create a list of all unique items in a specific 
@@ -20,6 +62,10 @@ def list_of_unique_items(column):
     Returns a list of unique column values
     '''
 
+    if game_store is not None:
+
+        return game_store.list_of_unique_items(column)
+
     sql_dict = {'designers' :"SELECT DISTINCT designer FROM designers;",
                 'artists'   :"SELECT DISTINCT artist FROM artists;", 
                 'categories':"SELECT DISTINCT category FROM categories;", 
@@ -36,27 +82,23 @@ def list_of_unique_items(column):
 
     item_list = []
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+    try:
 
-            try:
-                
-                curs.execute(sql_dict[column])
+        rows = query_executor.execute(sql_dict[column])
 
-            except:
+    except:
 
-                curs.execute("""ROLLBACK;""")
+        print "Failed to SELECT from table"
 
-                print "Failed to SELECT from table"
+        return
 
-                return
+    for row_tuple in rows:
 
-            for row_tuple in curs.fetchall():
-                    
-                item_list.append(row_tuple[0])
+        item_list.append(row_tuple[0])
     
     return item_list
 
+@memoized
 def list_of_unique_items_for_rank(column, rank):
     '''
     Same as list_of_unique_items() but can filter results for games that
@@ -72,6 +114,10 @@ def list_of_unique_items_for_rank(column, rank):
     Returns a list of unique column values that are within a top rank
     '''
 
+    if game_store is not None:
+
+        return game_store.list_of_unique_items_for_rank(column, rank)
+
     sql_dict = {'designers' :"""SELECT DISTINCT designer
                                 FROM designers 
                                 INNER JOIN boardgames 
@@ -96,13 +142,13 @@ def list_of_unique_items_for_rank(column, rank):
                                 ON boardgames.id=mechanics.bg_id 
                                 WHERE boardgames.rank < %s;
                              """,
-                'family'    :"""SELECT DISTINCT family
+                'family'    :"""SELECT DISTINCT families.family
                                 FROM families 
                                 INNER JOIN boardgames 
                                 ON boardgames.id=families.bg_id 
                                 WHERE boardgames.rank < %s;
                              """, 
-                'type'      :"""SELECT DISTINCT type
+                'type'      :"""SELECT DISTINCT types.type
                                 FROM types 
                                 INNER JOIN boardgames 
                                 ON boardgames.id=types.bg_id 
@@ -118,27 +164,23 @@ def list_of_unique_items_for_rank(column, rank):
 
     item_list = []
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+    try:
 
-            try:
-                
-                curs.execute(sql_dict[column], (rank,))
+        rows = query_executor.execute(sql_dict[column], (rank,))
 
-            except:
+    except:
 
-                curs.execute("""ROLLBACK;""")
+        print "Failed to SELECT from table"
 
-                print "Failed to SELECT from table"
+        return
 
-                return
+    for row_tuple in rows:
 
-            for row_tuple in curs.fetchall():
-                    
-                item_list.append(row_tuple[0])
+        item_list.append(row_tuple[0])
     
     return item_list
 
+@memoized
 def count_column(column):
     '''
     Counts number of games associated with each unique value in a specified
@@ -150,6 +192,29 @@ def count_column(column):
     and the number of gaems associated with it.
     '''
 
+    if game_store is not None:
+
+        return game_store.count_column(column)
+
+    if column in dict(LINK_TABLES) and _rank_bands_ready():
+
+        try:
+
+            rows = query_executor.execute("""SELECT item, SUM(num_games)
+                                             FROM """ + RANK_BANDS_VIEW + """
+                                             WHERE link_column = %s
+                                             GROUP BY item
+                                             ORDER BY SUM(num_games) DESC;""",
+                                          (column,))
+
+        except:
+
+            print "Failed to SELECT from table"
+
+            return
+
+        return [[row_tuple[0], int(row_tuple[1])] for row_tuple in rows]
+
     sql_dict = {'designers' :"""SELECT designer, COUNT(bg_id) FROM designers 
                                 GROUP BY designer ORDER BY COUNT(bg_id) DESC;
                              """,
@@ -178,117 +243,114 @@ def count_column(column):
 
     item_list = []
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+    try:
 
-            try:
-                
-                curs.execute(sql_dict[column])
+        rows = query_executor.execute(sql_dict[column])
 
-            except:
+    except:
 
-                print "Failed to SELECT from table"
+        print "Failed to SELECT from table"
+
+        return
 
-                return
+    for row_tuple in rows:
 
-            for row_tuple in curs.fetchall():
-                    
-                item_list.append([row_tuple[0], int(row_tuple[1])])
+        item_list.append([row_tuple[0], int(row_tuple[1])])
     
     
     return item_list
 
+@memoized
 def time_vs_max_players(time_cutoff = 1e10, player_cutoff = 1e10):
     '''
     Select games from boardgames that have a play_time less than the
     time_cutoff as well as a max_players below the player_cutoff.
 
-    Returns two lists, one of the play_time's and one of max_players for
+    Returns two arrays, one of the play_time's and one of max_players for
     the selected games
     '''
 
-    time     = []
-    max_plyr = []
-
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-
-            try:
-                
-                curs.execute("""SELECT play_time, max_players 
-                                FROM boardgames
-                                WHERE play_time < %s AND max_players < %s;""",
-                                (time_cutoff, player_cutoff))
-
-            except:
+    if game_store is not None:
 
-                print "Failed to SELECT from table"
+        return game_store.time_vs_max_players(time_cutoff, player_cutoff)
 
-                return None,None
+    try:
 
-            for row_tuple in curs.fetchall():
+        return query_executor.fetch_arrays("""SELECT play_time, max_players 
+                                              FROM boardgames
+                                              WHERE play_time < %s AND max_players < %s;""",
+                                              (time_cutoff, player_cutoff))
 
-                time.append(row_tuple[0])
+    except:
 
-                max_plyr.append(row_tuple[1])
+        print "Failed to SELECT from table"
 
-    return time, max_plyr
+        return None,None
 
+@memoized
 def time_vs_complexity(time_cutoff = 1e10, cmplx_cutoff = 5):
     '''
     Select games from boardgames that have a play_time less than the
     time_cutoff as well as a complexity below the cmplx_cutoff.
 
-    Returns two lists, one of the play_time's and one of complx_rating for
+    Returns two arrays, one of the play_time's and one of complx_rating for
     the selected games
     '''
 
-    time       = []
-    complexity = []
+    if game_store is not None:
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+        return game_store.time_vs_complexity(time_cutoff, cmplx_cutoff)
 
-            try:
-                
-                curs.execute("""SELECT play_time, complx_rating 
-                                FROM boardgames
-                                WHERE play_time < %s AND complx_rating < %s;
-                             """,(time_cutoff, cmplx_cutoff))
+    try:
 
-            except:
+        return query_executor.fetch_arrays("""SELECT play_time, complx_rating 
+                                              FROM boardgames
+                                              WHERE play_time < %s AND complx_rating < %s;
+                                           """,(time_cutoff, cmplx_cutoff))
 
-                print "Failed to SELECT from table"
+    except:
 
-                return None,None
+        print "Failed to SELECT from table"
 
-            for row_tuple in curs.fetchall():
-
-                time.append(row_tuple[0])
-
-                complexity.append(row_tuple[1])
-
-    return time, complexity
+        return None,None
 
+@memoized
 def avg_geek_rating_playtime_per_mechanic(rank=10001, sortby=None):
     '''
     Same exact capabilities as avg_rating_per_mechanic() but it only
     considers games that are above a specified rank on boardgamegeek.com.
 
-    Returns a list of the unique mechanics, a list of the average geek rating 
-    for the games associated with those mechanics, and a list of the number of
+    Returns a list of the unique mechanics, an array of the average geek
+    rating and one of the average play time for the games associated with
+    those mechanics (NaN where there is none), and an array of the number of
     games associated with those mechanics; All for games above a specified rank.
     '''
+
+    if game_store is not None:
+
+        return game_store.avg_geek_rating_playtime_per_mechanic(rank, sortby)
+
+    rank_bands = _rank_bands_ready()
+
     if sortby is not None:
         if sortby is 'num':
             sortby = 'ORDER BY COUNT(boardgames.id) DESC;'
 
+            if rank_bands:
+                sortby = 'ORDER BY 6 DESC;'
+
         elif sortby is 'geek':
             sortby = 'ORDER BY AVG(boardgames.geek_rating) DESC;'
 
+            if rank_bands:
+                sortby = 'ORDER BY 2 DESC;'
+
         elif sortby is 'playtime':
             sortby = 'ORDER BY AVG(boardgames.play_time) DESC;'
 
+            if rank_bands:
+                sortby = 'ORDER BY 3 DESC;'
+
         else:
 
             print "Requested sortby is not an option. Options include:"
@@ -298,57 +360,176 @@ def avg_geek_rating_playtime_per_mechanic(rank=10001, sortby=None):
     else:
         sortby = ';'
 
-    mechanic     = []
+    try:
 
-    avg_rating   = []
+        if rank_bands:
 
-    avg_playtime = []
+            rows = query_executor.execute(_rank_bands_sql('mechanics') + sortby,
+                                          _rank_bands_params('mechanics', rank))
 
-    num_games    = []
+        else:
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+            rows = query_executor.execute("""SELECT mechanics.mechanic, 
+                                                    AVG(boardgames.geek_rating),
+                                                    AVG(boardgames.play_time),
+                                                    COUNT(boardgames.id)
+                                             FROM mechanics
+                                             INNER JOIN boardgames
+                                             ON boardgames.id=mechanics.bg_id
+                                             WHERE boardgames.rank < %s
+                                             GROUP BY mechanics.mechanic
+                                         """ + sortby, (rank,))
 
-            try:
+    except:
 
-                curs.execute("""SELECT mechanics.mechanic, 
-                                       AVG(boardgames.geek_rating),
-                                       AVG(boardgames.play_time),
-                                       COUNT(boardgames.id)
-                                FROM mechanics
-                                INNER JOIN boardgames
-                                ON boardgames.id=mechanics.bg_id
-                                WHERE boardgames.rank < %s
-                                GROUP BY mechanics.mechanic
-                            """ + sortby, (rank,))
+        print "Failed to SELECT from table"
 
-            except:
+        return
 
-                print "Failed to SELECT from table"
+    mechanic = [row_tuple[0] for row_tuple in rows]
 
-                return
+    avg_rating, avg_playtime = _column_arrays([row_tuple[1:3]
+                                               for row_tuple in rows], 2)
 
-            for row_tuple in curs.fetchall():
+    num_games = np.array([row_tuple[-1] for row_tuple in rows], dtype=np.int64)
 
-                mechanic.append(row_tuple[0])
+    return mechanic, avg_rating, avg_playtime, num_games
 
-                avg_rating.append(row_tuple[1])
+@memoized
+def item_stats_above_rank(column, rank=10001):
+    '''
+    Number of games and average geek_rating, play_time, complx_rating and
+    num_voters per item in a column, for games ranked above a specified
+    rank (rank < rank). Needs the item_rank_bands view made by
+    normalize_database.py.
+
+    Returns a list of lists, each sublist containing the item name, its
+    number of games and the four averages (None where no game had a
+    value), most games first.
+    '''
 
-                avg_playtime.append(row_tuple[2])
+    if column not in dict(LINK_TABLES):
 
-                num_games.append(int(row_tuple[3]))
+        print "\nRequested column does not exist in table."
+        print "Options for column:", [name for name, link in LINK_TABLES]
 
-    return mechanic, avg_rating, avg_playtime, num_games
+        return
 
+    if not _rank_bands_ready():
+
+        print "\nNo", RANK_BANDS_VIEW, "view, run normalize_database.py first"
+
+        return
+
+    try:
+
+        rows = query_executor.execute(_rank_bands_sql(column) +\
+                                      """ORDER BY 6 DESC, 1;""",
+                                      _rank_bands_params(column, rank))
+
+    except:
+
+        print "Failed to SELECT from table"
+
+        return
+
+    return [[row_tuple[0], int(row_tuple[5])] + list(row_tuple[1:5])
+            for row_tuple in rows]
+
+def _rank_bands_ready():
+    '''
+    Whether the item_rank_bands view exists (and is to be used)
+    '''
+
+    if not USE_RANK_BANDS:
+
+        return False
+
+    try:
+
+        rows = query_executor.execute("""SELECT to_regclass(%s);""",
+                                      (RANK_BANDS_VIEW,))
+
+    except:
+
+        return False
+
+    return rows[0][0] is not None
+
+def _rank_bands_sql(column):
+    '''
+    Per item averages of the RANK_BAND_STATS columns and number of games,
+    for games with rank < some rank, in that column order. Whole bands
+    come from item_rank_bands, the games of the band the cutoff falls in
+    come straight from boardgames. See _rank_bands_params().
+
+    Sums are divided by non NULL counts the same way AVG() does it, so the
+    numbers match a GROUP BY over the whole table.
+    '''
+
+    table, item = dict(LINK_TABLES)[column]
+
+    band_columns = ''
+
+    game_columns = ''
+
+    averages = ''
+
+    for stat, sum_type in RANK_BAND_STATS:
+
+        band_columns += ', ' + stat + '_sum, ' + stat + '_count'
+
+        game_columns += """,
+                           boardgames.""" + stat + """::""" + sum_type + """,
+                           (boardgames.""" + stat + """ IS NOT NULL)::int"""
+
+        # AVG() of an int column is a numeric
+        total = 'SUM(' + stat + '_sum)' +\
+                ('::numeric' if sum_type == 'bigint' else '')
+
+        averages += """,
+                   """ + total + """ / NULLIF(SUM(""" + stat + """_count), 0)"""
+
+    return """WITH bands AS (
+                SELECT item, num_games""" + band_columns + """
+                FROM """ + RANK_BANDS_VIEW + """
+                WHERE link_column = %s AND band < %s
+                UNION ALL
+                SELECT """ + table + """.""" + item + """, 1""" + game_columns + """
+                FROM """ + table + """
+                INNER JOIN boardgames ON boardgames.id = """ + table + """.bg_id
+                WHERE boardgames.rank >= %s AND boardgames.rank < %s)
+             SELECT item""" + averages + """,
+                    SUM(num_games)
+             FROM bands
+             GROUP BY item
+             """
+
+def _rank_bands_params(column, rank):
+    '''
+    Parameters of _rank_bands_sql(): the bands that are entirely below
+    rank, and the first rank of the band rank falls in
+    '''
+
+    full_bands = int((rank - 1) // RANK_BAND_WIDTH)
+
+    return (column, full_bands, full_bands * RANK_BAND_WIDTH + 1, rank)
+
+@memoized
 def geek_rating_avg_rating_for_item_in_column(column, item_name):
     '''
     Grab the geek_rating and avg_rating from boardgames table
     for a specified column and a specified item in that column
 
-    Returns a list of geek ratings and a list of average ratings
+    Returns an array of geek ratings and an array of average ratings
     from the boardgames table. 
     '''
 
+    if game_store is not None:
+
+        return game_store.geek_rating_avg_rating_for_item_in_column(column,
+                                                                    item_name)
+
     sql_dict = {'designers' :"""SELECT boardgames.geek_rating, 
                                        boardgames.avg_rating
                                 FROM designers 
@@ -399,30 +580,19 @@ def geek_rating_avg_rating_for_item_in_column(column, item_name):
 
         return
 
-    geek_r = []
-    avg_r  = []
-
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-
-            try:
-                
-                curs.execute(sql_dict[column], (item_name,))
+    try:
 
-            except:
+        rows = query_executor.execute(sql_dict[column], (item_name,))
 
-                print "Failed to SELECT from table"
+    except:
 
-                return
+        print "Failed to SELECT from table"
 
-            for row_tuple in curs.fetchall():
-                    
-                geek_r.append(row_tuple[0])
+        return
 
-                avg_r.append(row_tuple[1])
-    
-    return geek_r, avg_r
+    return _column_arrays(rows, 2)
 
+@memoized
 def num_voters_for_item_in_column(column, item_name, voter_threshold):
     '''
     Grab the num_voters from boardgames table
@@ -430,9 +600,14 @@ def num_voters_for_item_in_column(column, item_name, voter_threshold):
     Can filter the games selected by specifying how many voters there must
     be associated with a game (num_voters column)
 
-    Returns a list of number of voters from the boardgames table.
+    Returns an array of number of voters from the boardgames table.
     '''
 
+    if game_store is not None:
+
+        return game_store.num_voters_for_item_in_column(column, item_name,
+                                                        voter_threshold)
+
     sql_dict = {'designers' :"""SELECT boardgames.num_voters
                                 FROM designers 
                                 INNER JOIN boardgames 
@@ -483,27 +658,19 @@ def num_voters_for_item_in_column(column, item_name, voter_threshold):
 
         return
 
-    num_voters = []
-
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+    try:
 
-            try:
-                
-                curs.execute(sql_dict[column], (item_name, voter_threshold))
+        rows = query_executor.execute(sql_dict[column], (item_name, voter_threshold))
 
-            except:
+    except:
 
-                print "Failed to SELECT from table"
+        print "Failed to SELECT from table"
 
-                return
+        return
 
-            for row_tuple in curs.fetchall():
-                    
-                num_voters.append(int(row_tuple[0]))
-    
-    return num_voters
+    return _column_arrays(rows, 1)[0]
 
+@memoized
 def geek_rating_comp_rating_for_item_in_column(column, item_name, num_voters):
     '''
     Grab the geek_rating and complx_rating from boardgames table
@@ -511,10 +678,16 @@ def geek_rating_comp_rating_for_item_in_column(column, item_name, num_voters):
     Can filter the games selected by specifying how many voters there must
     be associated with a game (num_voters column)
 
-    Returns a list of geek ratings and a list of complexity ratings
+    Returns an array of geek ratings and an array of complexity ratings
     from the boardgames table. 
     '''
 
+    if game_store is not None:
+
+        return game_store.geek_rating_comp_rating_for_item_in_column(column,
+                                                                     item_name,
+                                                                     num_voters)
+
     sql_dict = {'designers' :"""SELECT boardgames.geek_rating, 
                                        boardgames.complx_rating
                                 FROM designers 
@@ -577,30 +750,19 @@ def geek_rating_comp_rating_for_item_in_column(column, item_name, num_voters):
 
         return
 
-    geek_r = []
-    comp_r  = []
+    try:
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+        rows = query_executor.execute(sql_dict[column], (item_name,num_voters))
 
-            try:
-                
-                curs.execute(sql_dict[column], (item_name,num_voters))
+    except:
 
-            except:
+        print "Failed to SELECT from table"
 
-                print "Failed to SELECT from table"
-
-                return
-
-            for row_tuple in curs.fetchall():
-                    
-                geek_r.append(row_tuple[0])
+        return
 
-                comp_r.append(row_tuple[1])
-    
-    return geek_r, comp_r
+    return _column_arrays(rows, 2)
 
+@memoized
 def comp_rating_sugg_age_for_item_in_column(column, item_name, num_voters):
     '''
     Grab the complx_rating and sugg_age from boardgames table
@@ -608,10 +770,16 @@ def comp_rating_sugg_age_for_item_in_column(column, item_name, num_voters):
     Can filter the games selected by specifying how many voters there must
     be associated with a game (num_voters column)
 
-    Returns a list of complexity ratings and a list of suggested ages
+    Returns an array of complexity ratings and an array of suggested ages
     from the boardgames table.
     '''
 
+    if game_store is not None:
+
+        return game_store.comp_rating_sugg_age_for_item_in_column(column,
+                                                                  item_name,
+                                                                  num_voters)
+
     sql_dict = {'designers' :"""SELECT boardgames.complx_rating, 
                                        boardgames.sugg_age
                                 FROM designers 
@@ -680,29 +848,161 @@ def comp_rating_sugg_age_for_item_in_column(column, item_name, num_voters):
 
         return
 
-    comp_r  = []
-    sugg_a  = []
+    try:
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+        rows = query_executor.execute(sql_dict[column], (item_name,num_voters))
 
-            try:
-                
-                curs.execute(sql_dict[column], (item_name,num_voters))
+    except:
 
-            except:
+        print "Failed to SELECT from table"
 
-                print "Failed to SELECT from table"
+        return
+
+    return _column_arrays(rows, 2)
 
-                return
+@memoized
+def stats_for_items_in_column(column, item_subset=None):
+    '''
+    Grab the geek_rating, avg_rating, complx_rating, sugg_age and num_voters
+    of every game for every item in a specified column, all with one query.
 
-            for row_tuple in curs.fetchall():
+    Plotting a whole column with the *_for_item_in_column functions above
+    takes one or two queries per item. Here every (item, game) row comes
+    back at once and gets split up into the separate items with numpy.
 
-                comp_r.append(row_tuple[0])
+    item_subset = only grab these items, all items if not given
+                  (list of strings)
 
-                sugg_a.append(row_tuple[1])
-    
-    return comp_r, sugg_a
+    Returns a dict of item name -> dict of boardgames column -> numpy array
+    of that column's values (floats, NaN where the value is NULL), all in
+    the same game order. Filtering on num_voters etc. is left to the caller,
+    see ITEM_STAT_COLUMNS.
+    '''
+
+    if game_store is not None:
+
+        return game_store.stats_for_items_in_column(column, item_subset,
+                                                    ITEM_STAT_COLUMNS)
+
+    sql_dict = {'designers' :"""SELECT designers.designer, """ +\
+                                       ITEM_STAT_SELECT + """
+                                FROM designers 
+                                INNER JOIN boardgames 
+                                ON boardgames.id=designers.bg_id
+                             """,
+                'artists'   :"""SELECT artists.artist, """ +\
+                                       ITEM_STAT_SELECT + """
+                                FROM artists 
+                                INNER JOIN boardgames 
+                                ON boardgames.id=artists.bg_id
+                             """, 
+                'categories':"""SELECT categories.category, """ +\
+                                       ITEM_STAT_SELECT + """
+                                FROM categories 
+                                INNER JOIN boardgames 
+                                ON boardgames.id=categories.bg_id
+                             """, 
+                'mechanics' :"""SELECT mechanics.mechanic, """ +\
+                                       ITEM_STAT_SELECT + """
+                                FROM mechanics 
+                                INNER JOIN boardgames 
+                                ON boardgames.id=mechanics.bg_id
+                             """,
+                'family'    :"""SELECT families.family, """ +\
+                                       ITEM_STAT_SELECT + """
+                                FROM families 
+                                INNER JOIN boardgames 
+                                ON boardgames.id=families.bg_id
+                             """, 
+                'type'      :"""SELECT types.type, """ +\
+                                       ITEM_STAT_SELECT + """
+                                FROM types 
+                                INNER JOIN boardgames 
+                                ON boardgames.id=types.bg_id
+                             """}
+
+    where_dict = {'designers' :"WHERE designers.designer = ANY(%s::text[]);",
+                  'artists'   :"WHERE artists.artist = ANY(%s::text[]);",
+                  'categories':"WHERE categories.category = ANY(%s::text[]);",
+                  'mechanics' :"WHERE mechanics.mechanic = ANY(%s::text[]);",
+                  'family'    :"WHERE families.family = ANY(%s::text[]);",
+                  'type'      :"WHERE types.type = ANY(%s::text[]);"}
+
+    if column not in sql_dict.keys():
+
+        print "\nRequested column does not exist in table."
+        print "Options for column:", sql_dict.keys()
+
+        return
+
+    try:
+
+        # Streamed, the rows of a big column never all exist as tuples
+        if item_subset is None:
+
+            columns = query_executor.fetch_arrays(sql_dict[column] + ";")
+
+        else:
+
+            columns = query_executor.fetch_arrays(sql_dict[column] +\
+                                                  where_dict[column],
+                                                  (list(item_subset),))
+
+    except:
+
+        print "Failed to SELECT from table"
+
+        return
+
+    item_names, values = columns[0], columns[1:]
+
+    if len(item_names) == 0:
+
+        return {}
+
+    # Sort the rows by item (stable, so games keep their order within an
+    #   item) and cut the sorted rows wherever the item changes
+    unique_names, item_index = np.unique(item_names, return_inverse=True)
+
+    order = np.argsort(item_index, kind='mergesort')
+
+    bounds = np.cumsum(np.bincount(item_index))[:-1]
+
+    stats = {}
+
+    for item_name, game_rows in zip(unique_names, np.split(order, bounds)):
+
+        stats[item_name] = dict((stat, values[i][game_rows]) for i, stat
+                                in enumerate(ITEM_STAT_COLUMNS))
+
+    return stats
+
+def count_items_in_stats(stats):
+    '''
+    Same as count_column() but for the output of stats_for_items_in_column(),
+    so the plots don't need a second query.
+
+    Returns a list of lists, each sublist containing the item name and the
+    number of games associated with it, most games first.
+    '''
+
+    item_list = [[item_name, len(item_stats['num_voters'])]
+                 for item_name, item_stats in stats.items()]
+
+    item_list.sort(key=lambda item: (-item[1], item[0]))
+
+    return item_list
+
+def _column_arrays(rows, num_columns):
+    '''
+    The columns of a query's rows as float arrays (NaN where the value is
+    NULL), made in one go instead of appending row by row
+    '''
+
+    values = np.array(rows, dtype=float).reshape(len(rows), num_columns)
+
+    return tuple(np.ascontiguousarray(values[:, i])
+                 for i in range(num_columns))
 
 # =============================================================================
 #  Start of Plotting Functions
@@ -783,48 +1083,44 @@ def scatter_plot_mechanics_with_rank(rank, top=3):
 
     plt.show()
 
-def scatter_plot_geekr_vs_avgr_for_column(column, item_subset=None):
+def scatter_plot_geekr_vs_avgr_for_column(column, item_subset=None,
+                                          voter_threshold=0):
     '''
     Creates a scatter plot for a given column from the boardgames table.
 
     Y-axis will be the Geek Rating; X-axis the Average Rating
 
     column examples: mechanics, categories, type
+
+    voter_threshold = only games with more voters than this count towards
+                      the Average Num Voters in the legend
     '''
 
     fig, ax = plt.subplots(1,1)
 
-    col_data = count_column(column)
+    stats = stats_for_items_in_column(column, item_subset)
 
-    for item_name, game_count in col_data:
+    if stats is None:
 
-        # If you only want to plot a few items from the full list
-        if item_subset is not None:
-            if item_name in item_subset:
-
-                geekr, avgr = geek_rating_avg_rating_for_item_in_column(column,
-                                                                     item_name)
+        return
 
-                num_v = num_voters_for_item_in_column(column, item_name)
+    for item_name, game_count in count_items_in_stats(stats):
 
-                avg_num_v = int(np.mean(num_v).round())
+        item_stats = stats[item_name]
 
-                plt.scatter(avgr, geekr, alpha=0.3,
-                            label=str(game_count)+' '+item_name \
-                            +' \nAverage Num Voters: ' + str(avg_num_v))
+        num_v = item_stats['num_voters']
 
-        else:
+        num_v = num_v[num_v > voter_threshold]
 
-            geekr, avgr = geek_rating_avg_rating_for_item_in_column(column,
-                                                                item_name)
+        if len(num_v) == 0:
 
-            num_v = num_voters_for_item_in_column(column, item_name)
+            continue
 
-            avg_num_v = int(np.mean(num_v).round())
+        avg_num_v = int(np.mean(num_v).round())
 
-            plt.scatter(avgr, geekr, alpha=0.3,
-                        label=str(game_count)+' '+item_name \
-                        +' \nAverage Num Voters: ' + str(avg_num_v))
+        plt.scatter(item_stats['avg_rating'], item_stats['geek_rating'],
+                    alpha=0.3, label=str(game_count)+' '+item_name \
+                    +' \nAverage Num Voters: ' + str(avg_num_v))
 
     plt.plot(np.linspace(5.5, 9.5), np.linspace(5.5,9.5), c='k', lw=2, 
              label='Geek Rating = Average Rating')
@@ -841,35 +1137,31 @@ def scatter_plot_geekr_vs_avgr_for_column(column, item_subset=None):
 
 def scatter_plot_diffr_vs_num_voters():
 
-    avg_geekr = []
-    avg_avg_r = []
-    num_v = []
+    if game_store is not None:
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
+        num_v, avg_geekr, avg_avg_r = game_store.avg_ratings_per_num_voters()
 
-            try:
-                
-                curs.execute("""SELECT num_voters, 
-                                       AVG(geek_rating),
-                                       AVG(avg_rating)
-                                FROM boardgames
-                                GROUP BY num_voters
-                                ORDER BY num_voters ASC;""")
+    else:
+
+        try:
 
-            except:
+            rows = query_executor.execute("""SELECT num_voters, 
+                                                    AVG(geek_rating),
+                                                    AVG(avg_rating)
+                                             FROM boardgames
+                                             WHERE num_voters IS NOT NULL
+                                             GROUP BY num_voters
+                                             ORDER BY num_voters ASC;""")
 
-                print "Failed to SELECT from table"
+        except:
 
-                return
+            print "Failed to SELECT from table"
+
+            return
 
-            for row_tuple in curs.fetchall():
-                
-                num_v.append(int(row_tuple[0]))
-                avg_geekr.append(row_tuple[1])
-                avg_avg_r.append(row_tuple[2])
-    #return num_v, avg_geekr, avg_avg_r
-    diff = [a-g for a,g in zip(avg_avg_r, avg_geekr)]
+        num_v, avg_geekr, avg_avg_r = _column_arrays(rows, 3)
+
+    diff = avg_avg_r - avg_geekr
 
     fig, ax = plt.subplots(1,1)
 
@@ -894,39 +1186,31 @@ def scatter_plot_geekr_vs_complxr(column, item_subset=None, num_voters=1000):
 
     fig, ax = plt.subplots(1,1)
 
-    col_data = count_column(column)
+    stats = stats_for_items_in_column(column, item_subset)
 
-    for item_name, game_count in col_data:
+    if stats is None:
 
-        # If you only want to plot a few items from the full list
-        if item_subset is not None:
-            if item_name in item_subset:
+        return
 
-                geekr, compr = geek_rating_comp_rating_for_item_in_column(column,
-                                                                       item_name, 
-                                                                      num_voters)
+    for item_name, game_count in count_items_in_stats(stats):
 
-                num_v = num_voters_for_item_in_column(column, item_name, num_voters)
+        item_stats = stats[item_name]
 
-                avg_num_v = int(np.mean(num_v).round())
+        enough_voters = item_stats['num_voters'] > num_voters
 
-                plt.scatter(compr, geekr, alpha=0.75,
-                            label=str(game_count)+' '+item_name \
-                            +' \nAverage Num Voters: ' + str(avg_num_v))
+        # Same games as geek_rating_comp_rating_for_item_in_column()
+        rated = enough_voters & (item_stats['complx_rating'] > 0)
 
-        else:
+        if not enough_voters.any():
 
-            geekr, compr = geek_rating_comp_rating_for_item_in_column(column,
-                                                                   item_name,
-                                                                  num_voters)
-
-            num_v = num_voters_for_item_in_column(column, item_name, num_voters)
+            continue
 
-            avg_num_v = int(np.mean(num_v).round())
+        avg_num_v = int(np.mean(item_stats['num_voters'][enough_voters]).round())
 
-            plt.scatter(compr, geekr, alpha=0.75,
-                        label=str(game_count)+' '+item_name \
-                        +' \nAverage Num Voters: ' + str(avg_num_v))
+        plt.scatter(item_stats['complx_rating'][rated],
+                    item_stats['geek_rating'][rated], alpha=0.75,
+                    label=str(game_count)+' '+item_name \
+                    +' \nAverage Num Voters: ' + str(avg_num_v))
 
     #plt.plot(np.linspace(5.5, 9.5), np.linspace(5.5,9.5), c='k', lw=2, 
     #         label='Geek Rating = Average Rating')
@@ -961,43 +1245,24 @@ def scatter_plot_complxr_vs_sugg_age(column, item_subset=None, num_voters=0):
 
     ax.set_title(column.capitalize() + " In Games", fontsize=20)
 
-    col_data = count_column(column)
-
-    for item_name, game_count in col_data:
-
-        # If you only want to plot a few items from the full list
-        if item_subset is not None:
-            if item_name in item_subset:
-
-                compr, sugg_age = comp_rating_sugg_age_for_item_in_column(column,
-                                                                       item_name, 
-                                                                      num_voters)
-
-                num_v = num_voters_for_item_in_column(column, item_name, num_voters)
+    stats = stats_for_items_in_column(column, item_subset)
 
-                avg_num_v = int(np.mean(num_v).round())
+    if stats is None:
 
-                plt.scatter(sugg_age, compr, alpha=0.75, s=75,
-                            label=item_name)# \
-                            #+' \nAverage Num Voters: ' + str(avg_num_v))
-                            #label=str(game_count)+' '+item_name \
-                            #+' \nAverage Num Voters: ' + str(avg_num_v))
-
-        else:
+        return
 
-            compr, sugg_age = comp_rating_sugg_age_for_item_in_column(column,
-                                                                   item_name,
-                                                                  num_voters)
+    for item_name, game_count in count_items_in_stats(stats):
 
-            num_v = num_voters_for_item_in_column(column, item_name, num_voters)
+        item_stats = stats[item_name]
 
-            avg_num_v = int(np.mean(num_v).round())
+        # Same games as comp_rating_sugg_age_for_item_in_column()
+        rated = (item_stats['num_voters'] > num_voters) &\
+                (item_stats['complx_rating'] > 0) &\
+                (item_stats['sugg_age'] > 0)
 
-            plt.scatter(sugg_age, compr, alpha=0.75, s=75,
-                        label=item_name)# \
-                         #   +' \nAverage Num Voters: ' + str(avg_num_v))
-                        #label=str(game_count)+' '+item_name \
-                        #+' \nAverage Num Voters: ' + str(avg_num_v))
+        plt.scatter(item_stats['sugg_age'][rated],
+                    item_stats['complx_rating'][rated], alpha=0.75, s=75,
+                    label=item_name)
 
     ax.legend(fontsize=14)
     plt.xticks(fontsize=14)
@@ -1008,10 +1273,23 @@ def scatter_plot_complxr_vs_sugg_age(column, item_subset=None, num_voters=0):
 def __scale_size(val_list, min=25, max=1000):
     '''
     Helper function to maintain scale of the circle sizes in scatter plots
+
+    Returns an array of sizes from min (smallest value) to max (largest
+    value), all min if every value is the same
     '''
-    
-    return [float(val - np.min(val_list))/
-            (np.max(val_list) - np.min(val_list))*(max-min) + min \
-            for val in val_list]
+
+    values = np.asarray(val_list, dtype=float)
+
+    if len(values) == 0:
+
+        return values
+
+    low, high = values.min(), values.max()
+
+    if high == low:
+
+        return np.full(len(values), float(min))
+
+    return (values - low) / (high - low) * (max - min) + min
 
 
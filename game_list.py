@@ -0,0 +1,294 @@
+'''
+Typed, indexed reader for the game list csv file made by collect_games.py.
+
+csv.reader hands back every row as a list of strings, and getting at a
+range of ranks (or one game) means reading the file from the top. A
+GameList scans the file once, without parsing it, to note the byte offset
+every row starts at together with its rank and game ID. After that a rank
+range, a range of rows or a single game is read by seeking straight to it,
+and rows come back as GameRecords with ints and floats already parsed
+('N/A' becomes None):
+
+    from game_list import GameList
+
+    games = GameList('BGG_GameList_tabbed.csv')
+
+    games.by_id(174430)             # GameRecord(id=174430, rank=4, ...)
+
+    games.by_rank(101, 200)         # list of GameRecords
+
+    for record in games.records():  # streams the whole file
+        ...
+
+The index can be kept next to the csv file (index_file_name), it is
+rebuilt whenever the csv file changes.
+'''
+
+import csv
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# One row of the game list, named after the bg_dict keys. id is taken
+#   from href (/boardgame/<id>/<slug>).
+GameRecord = namedtuple('GameRecord', ['id',
+                                       'rank',
+                                       'name',
+                                       'href',
+                                       'pub_year',
+                                       'geek_rating',
+                                       'avg_rating',
+                                       'num_voters'])
+
+
+class GameList(object):
+    '''
+    A game list csv file with an offset index of its rows
+
+    csv_file_name   : csv file made by collect_games.py
+                      (Type: String)
+
+    index_file_name : .npz file to keep the index in between runs, None to
+                      build it every time (one quick pass over the file)
+                      (Type: String)
+
+    Row numbers start at 1 for the first row after the header, like in
+    bg_scraper's scrape_journal.
+    '''
+
+    def __init__(self, csv_file_name, index_file_name=None):
+
+        self.csv_file_name = csv_file_name
+
+        stat = os.stat(csv_file_name)
+
+        # Size and mtime of the csv file, to tell a stale index file apart
+        self._file_stamp = np.array([stat.st_size, stat.st_mtime])
+
+        index = _load_index(index_file_name, self._file_stamp) \
+                    if index_file_name else None
+
+        if index is None:
+
+            index = self._build_index()
+
+            if index_file_name:
+
+                np.savez(index_file_name, stamp=self._file_stamp, **index)
+
+        self.offsets = index['offsets']
+
+        self.ranks   = index['ranks']
+
+        self.ids     = index['ids']
+
+        self.num_games = len(self.offsets)
+
+        # For by_id(): rows in order of game ID
+        self._id_order = np.argsort(self.ids, kind='mergesort')
+
+        # The list is normally in rank order, then by_rank() can bisect
+        self._ranks_sorted = bool(np.all(np.diff(self.ranks) >= 0))
+
+        with open(csv_file_name, 'rb') as csv_file:
+
+            self.labels = csv.reader(csv_file, delimiter = '\t').next()
+
+    def __len__(self):
+
+        return self.num_games
+
+    def _build_index(self):
+        '''
+        Byte offset, rank and game ID of every row, from one pass over the
+        raw lines
+        '''
+
+        offsets = []
+
+        ranks   = []
+
+        ids     = []
+
+        with open(self.csv_file_name, 'rb') as csv_file:
+
+            offset = len(csv_file.readline())
+
+            for line in csv_file:
+
+                if line.strip():
+
+                    fields = line.split('\t', 3)
+
+                    offsets.append(offset)
+
+                    # -1 for a game without a rank
+                    ranks.append(-1 if fields[0] == 'N/A' else int(fields[0]))
+
+                    ids.append(int(fields[2].split('/')[2]))
+
+                offset += len(line)
+
+        return {'offsets': np.array(offsets, dtype=np.int64),
+                'ranks'  : np.array(ranks, dtype=np.int64),
+                'ids'    : np.array(ids, dtype=np.int64)}
+
+    def raw_rows(self, start, stop=None):
+        '''
+        Rows start up to (not including) stop as lists of strings, the
+        way csv.reader gives them. Every row from start if stop isn't given.
+        '''
+
+        start = max(start, 1)
+
+        stop = self.num_games + 1 if stop is None else\
+               min(stop, self.num_games + 1)
+
+        if start >= stop:
+
+            return []
+
+        with open(self.csv_file_name, 'rb') as csv_file:
+
+            csv_file.seek(self.offsets[start - 1])
+
+            csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+            return [csv_contents.next() for _ in xrange(stop - start)]
+
+    def rows(self, start, stop=None):
+        '''
+        raw_rows() as GameRecords
+        '''
+
+        return [to_record(row) for row in self.raw_rows(start, stop)]
+
+    def by_rank(self, first_rank, last_rank):
+        '''
+        GameRecords of the games ranked first_rank to last_rank (both
+        included)
+        '''
+
+        if self._ranks_sorted:
+
+            start = np.searchsorted(self.ranks, first_rank, 'left')
+
+            stop  = np.searchsorted(self.ranks, last_rank, 'right')
+
+            return self.rows(int(start) + 1, int(stop) + 1)
+
+        row_numbers = np.flatnonzero((self.ranks >= first_rank) &\
+                                     (self.ranks <= last_rank)) + 1
+
+        return [self.rows(row, row + 1)[0] for row in row_numbers]
+
+    def by_id(self, bg_id):
+        '''
+        GameRecord of a game, or None if it isn't in the list
+        '''
+
+        row = self.row_number(bg_id)
+
+        if row is None:
+
+            return
+
+        return self.rows(row, row + 1)[0]
+
+    def row_number(self, bg_id):
+        '''
+        Row number of a game, or None if it isn't in the list
+        '''
+
+        i = np.searchsorted(self.ids, int(bg_id), sorter=self._id_order)
+
+        if i == self.num_games or self.ids[self._id_order[i]] != int(bg_id):
+
+            return
+
+        return int(self._id_order[i]) + 1
+
+    def records(self, start=1, stop=None):
+        '''
+        Stream GameRecords from row start on, one row in memory at a time
+        '''
+
+        start = max(start, 1)
+
+        with open(self.csv_file_name, 'rb') as csv_file:
+
+            csv_file.seek(self.offsets[start - 1] if start <= self.num_games
+                          else os.path.getsize(self.csv_file_name))
+
+            csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+            for row_number, row in enumerate(csv_contents, start):
+
+                if stop is not None and row_number >= stop:
+
+                    break
+
+                yield to_record(row)
+
+
+def iter_game_list(csv_file_name):
+    '''
+    Stream the GameRecords of a game list csv file, no index needed
+    '''
+
+    with open(csv_file_name, 'rb') as csv_file:
+
+        csv_contents = csv.reader(csv_file, delimiter = '\t')
+
+        csv_contents.next()
+
+        for row in csv_contents:
+
+            yield to_record(row)
+
+
+def to_record(row):
+    '''
+    GameRecord of a csv row (list of strings)
+    '''
+
+    rank, name, href, pub_year, geek_rating, avg_rating, num_voters = row
+
+    return GameRecord(int(href.split('/')[2]),
+                      _int(rank),
+                      name.decode('utf-8'),
+                      href.decode('utf-8'),
+                      _int(pub_year),
+                      _float(geek_rating),
+                      _float(avg_rating),
+                      _int(num_voters))
+
+
+def _load_index(index_file_name, file_stamp):
+    '''
+    The index saved in an .npz file, None if there isn't one or it was made
+    for another version of the csv file
+    '''
+
+    if not os.path.exists(index_file_name):
+
+        return
+
+    saved = np.load(index_file_name)
+
+    if not np.array_equal(saved['stamp'], file_stamp):
+
+        return
+
+    return dict((key, saved[key]) for key in ('offsets', 'ranks', 'ids'))
+
+
+def _int(text):
+
+    return None if text == 'N/A' else int(text)
+
+
+def _float(text):
+
+    return None if text == 'N/A' else float(text)
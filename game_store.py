@@ -0,0 +1,487 @@
+'''
+In-memory copy of the boardgames table for interactive analysis.
+
+The catalog is only ~10k games, so instead of going back to Postgres for
+every question a GameStore loads boardgames once and keeps each column as
+a numpy array with one entry per game (the game's row). The text array
+columns (mechanics, categories, ...) become CSR style indexes: a sorted
+array of the column's unique items, and the rows of the games with item i
+are game_rows[indptr[i]:indptr[i+1]].
+
+It answers the same questions as the functions in data_analysis.py, with
+the same return values, and data_analysis can be told to use it instead of
+the database:
+
+    import data_analysis
+    from game_store import GameStore
+
+    data_analysis.use_game_store(GameStore.from_database())
+
+Integer columns are stored as floats so that NULL can be NaN. Columns of
+values are handed out as float arrays too, like data_analysis returns them
+(values() gives the lists psycopg2 would).
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+import query_executor
+from normalize_database import LINK_TABLES
+
+# Columns of boardgames kept as float arrays
+NUMERIC_COLUMNS = ['id',
+                   'rank',
+                   'pub_year',
+                   'geek_rating',
+                   'avg_rating',
+                   'num_voters',
+                   'min_players',
+                   'max_players',
+                   'play_time',
+                   'sugg_age',
+                   'complx_rating']
+
+# The ones that are int in Postgres
+INT_COLUMNS = ['id', 'rank', 'pub_year', 'num_voters', 'min_players',
+               'max_players', 'play_time', 'sugg_age']
+
+# Columns of boardgames kept as object arrays
+TEXT_COLUMNS = ['name', 'href']
+
+# Text array columns of boardgames, turned into an ItemIndex each
+LINK_COLUMNS = [column for column, link in LINK_TABLES]
+
+STORE_COLUMNS = NUMERIC_COLUMNS + TEXT_COLUMNS + LINK_COLUMNS
+
+# For item number i of a column, the rows of its games are
+#   game_rows[indptr[i]:indptr[i+1]]
+ItemIndex = namedtuple('ItemIndex', ['items', 'indptr', 'game_rows'])
+
+
+class GameStore(object):
+    '''
+    The boardgames table as numpy arrays
+
+    columns : boardgames column -> array with one value per game, for every
+              column in NUMERIC_COLUMNS and TEXT_COLUMNS
+              (Type: dict)
+
+    links   : boardgames column -> ItemIndex, for every column in
+              LINK_COLUMNS
+              (Type: dict)
+
+    Usually made with GameStore.from_database()
+    '''
+
+    def __init__(self, columns, links):
+
+        self.columns = columns
+
+        self.links = links
+
+        self.num_games = len(columns['id'])
+
+        # link column -> {item name -> item number}, made the first time an
+        #   item of the column is looked up (a snapshot only decodes the
+        #   item names then)
+        self._item_numbers = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        '''
+        Build a store from boardgames rows
+
+        rows : one tuple per game with the values of STORE_COLUMNS in order
+               (Type: list of tuples)
+        '''
+
+        columns = {}
+
+        for i, name in enumerate(NUMERIC_COLUMNS):
+
+            # None (NULL) turns into NaN in a float array
+            columns[name] = np.array([row[i] for row in rows], dtype=float)
+
+        for i, name in enumerate(TEXT_COLUMNS, len(NUMERIC_COLUMNS)):
+
+            columns[name] = np.array([row[i] for row in rows], dtype=object)
+
+        links = {}
+
+        for i, column in enumerate(LINK_COLUMNS, len(NUMERIC_COLUMNS) +\
+                                                 len(TEXT_COLUMNS)):
+
+            links[column] = _item_index([row[i] for row in rows])
+
+        return cls(columns, links)
+
+    @classmethod
+    def from_database(cls, db=None):
+        '''
+        Load the whole boardgames table with one query
+
+        db : database to read from, query_executor's database if not given
+        '''
+
+        rows = query_executor.execute("""SELECT """ + ', '.join(STORE_COLUMNS) +\
+                                      """ FROM boardgames ORDER BY rank;""",
+                                      db=db)
+
+        return cls.from_rows(rows)
+
+    def item_rows(self, column, item_name):
+        '''
+        Rows of the games associated with an item of a link column (empty
+        if no game has it)
+        '''
+
+        index = self.links[column]
+
+        if column not in self._item_numbers:
+
+            self._item_numbers[column] = dict((name, i) for i, name
+                                              in enumerate(index.items))
+
+        i = self._item_numbers[column].get(item_name)
+
+        if i is None:
+
+            return index.game_rows[:0]
+
+        return index.game_rows[index.indptr[i]:index.indptr[i+1]]
+
+    def array(self, name, rows=None):
+        '''
+        Values of a numeric column for some rows (all rows if not given) as
+        a float array, NaN where the value is NULL
+        '''
+
+        values = self.columns[name]
+
+        return values.copy() if rows is None else values[rows]
+
+    def values(self, name, rows=None):
+        '''
+        Values of a column for some rows (all rows if not given) as a list,
+        the way psycopg2 would return them
+        '''
+
+        values = self.columns[name]
+
+        if rows is not None:
+
+            values = values[rows]
+
+        if name not in NUMERIC_COLUMNS:
+
+            return values.tolist()
+
+        nulls = np.isnan(values)
+
+        if name in INT_COLUMNS:
+
+            values = np.where(nulls, 0, values).astype(np.int64)
+
+        values = values.tolist()
+
+        for i in np.flatnonzero(nulls):
+
+            values[i] = None
+
+        return values
+
+    # =========================================================================
+    #  Same functions as in data_analysis.py
+    # =========================================================================
+
+    def list_of_unique_items(self, column):
+
+        if not self._is_link_column(column):
+
+            return
+
+        return self.links[column].items.tolist()
+
+    def list_of_unique_items_for_rank(self, column, rank):
+
+        if not self._is_link_column(column):
+
+            return
+
+        counts = self._count_per_item(column, self.columns['rank'] < rank)
+
+        return self.links[column].items[counts > 0].tolist()
+
+    def count_column(self, column):
+
+        if not self._is_link_column(column):
+
+            return
+
+        index = self.links[column]
+
+        counts = np.diff(index.indptr)
+
+        # Most games first, ties in item order
+        order = np.argsort(-counts, kind='mergesort')
+
+        return [[item_name, count] for item_name, count
+                in zip(index.items[order].tolist(), counts[order].tolist())]
+
+    def time_vs_max_players(self, time_cutoff=1e10, player_cutoff=1e10):
+
+        rows = np.flatnonzero((self.columns['play_time'] < time_cutoff) &\
+                              (self.columns['max_players'] < player_cutoff))
+
+        return self.array('play_time', rows), self.array('max_players', rows)
+
+    def time_vs_complexity(self, time_cutoff=1e10, cmplx_cutoff=5):
+
+        rows = np.flatnonzero((self.columns['play_time'] < time_cutoff) &\
+                              (self.columns['complx_rating'] < cmplx_cutoff))
+
+        return self.array('play_time', rows), self.array('complx_rating', rows)
+
+    def avg_geek_rating_playtime_per_mechanic(self, rank=10001, sortby=None):
+
+        if sortby not in (None, 'num', 'geek', 'playtime'):
+
+            print "Requested sortby is not an option. Options include:"
+            print "num, geek, playtime"
+            return
+
+        in_rank = self.columns['rank'] < rank
+
+        num_games = self._count_per_item('mechanics', in_rank)
+
+        avg_rating = self._mean_per_item('mechanics', 'geek_rating', in_rank)
+
+        avg_playtime = self._mean_per_item('mechanics', 'play_time', in_rank)
+
+        # Only mechanics of games within the rank, like the INNER JOIN
+        mechanics = np.flatnonzero(num_games > 0)
+
+        if sortby is not None:
+
+            sort_values = {'num'     : num_games,
+                           'geek'    : avg_rating,
+                           'playtime': avg_playtime}[sortby][mechanics]
+
+            # Descending, with NULL averages first like Postgres's DESC
+            sort_values = np.where(np.isnan(sort_values), np.inf, sort_values)
+
+            mechanics = mechanics[np.argsort(-sort_values, kind='mergesort')]
+
+        return (self.links['mechanics'].items[mechanics].tolist(),
+                avg_rating[mechanics],
+                avg_playtime[mechanics],
+                num_games[mechanics].astype(np.int64))
+
+    def geek_rating_avg_rating_for_item_in_column(self, column, item_name):
+
+        if not self._is_link_column(column):
+
+            return
+
+        rows = self.item_rows(column, item_name)
+
+        return self.array('geek_rating', rows), self.array('avg_rating', rows)
+
+    def num_voters_for_item_in_column(self, column, item_name,
+                                      voter_threshold=0):
+
+        if not self._is_link_column(column):
+
+            return
+
+        rows = self.item_rows(column, item_name)
+
+        rows = rows[self.columns['num_voters'][rows] > voter_threshold]
+
+        return self.array('num_voters', rows)
+
+    def geek_rating_comp_rating_for_item_in_column(self, column, item_name,
+                                                   num_voters):
+
+        if not self._is_link_column(column):
+
+            return
+
+        rows = self.item_rows(column, item_name)
+
+        rows = rows[(self.columns['complx_rating'][rows] > 0) &\
+                    (self.columns['num_voters'][rows] > num_voters)]
+
+        return self.array('geek_rating', rows), self.array('complx_rating',
+                                                             rows)
+
+    def comp_rating_sugg_age_for_item_in_column(self, column, item_name,
+                                                num_voters):
+
+        if not self._is_link_column(column):
+
+            return
+
+        rows = self.item_rows(column, item_name)
+
+        rows = rows[(self.columns['complx_rating'][rows] > 0) &\
+                    (self.columns['sugg_age'][rows] > 0) &\
+                    (self.columns['num_voters'][rows] > num_voters)]
+
+        return self.array('complx_rating', rows), self.array('sugg_age', rows)
+
+    def stats_for_items_in_column(self, column, item_subset=None,
+                                  stat_columns=None):
+
+        if not self._is_link_column(column):
+
+            return
+
+        if item_subset is None:
+
+            item_subset = self.links[column].items
+
+        if stat_columns is None:
+
+            stat_columns = NUMERIC_COLUMNS
+
+        stats = {}
+
+        for item_name in item_subset:
+
+            rows = self.item_rows(column, item_name)
+
+            if len(rows):
+
+                stats[item_name] = dict((stat, self.columns[stat][rows])
+                                        for stat in stat_columns)
+
+        return stats
+
+    def avg_ratings_per_num_voters(self):
+        '''
+        AVG(geek_rating) and AVG(avg_rating) for every num_voters value,
+        fewest voters first (for scatter_plot_diffr_vs_num_voters)
+        '''
+
+        num_voters = self.columns['num_voters']
+
+        voted = ~np.isnan(num_voters)
+
+        values, groups = np.unique(num_voters[voted], return_inverse=True)
+
+        return (values.astype(np.int64),
+                _group_mean(groups, self.columns['geek_rating'][voted],
+                            len(values)),
+                _group_mean(groups, self.columns['avg_rating'][voted],
+                            len(values)))
+
+    def _is_link_column(self, column):
+
+        if column not in self.links:
+
+            print "\nRequested column does not exist in table."
+            print "Options for column:", self.links.keys()
+
+            return False
+
+        return True
+
+    def _count_per_item(self, column, game_mask):
+        '''
+        Number of games in game_mask (a boolean array over the rows) that
+        each item of a link column is associated with
+        '''
+
+        index = self.links[column]
+
+        entries = game_mask[index.game_rows]
+
+        return np.bincount(_entry_items(index)[entries],
+                           minlength=len(index.items))
+
+    def _mean_per_item(self, column, name, game_mask):
+        '''
+        Average of a column over the games in game_mask, for each item of a
+        link column. NULLs are left out like AVG() does; NaN if there is
+        nothing to average.
+        '''
+
+        index = self.links[column]
+
+        values = self.columns[name][index.game_rows]
+
+        entries = game_mask[index.game_rows] & ~np.isnan(values)
+
+        return _group_mean(_entry_items(index)[entries], values[entries],
+                           len(index.items))
+
+
+def _item_index(item_lists):
+    '''
+    Build the ItemIndex of a link column from its arrays, one per game row
+    (None for a NULL array). NULL items are left out, and an item listed
+    twice for a game counts once, like the (item, bg_id) rows
+    normalize_database makes.
+    '''
+
+    items = []
+
+    rows  = []
+
+    for row, item_list in enumerate(item_lists):
+
+        seen = set()
+
+        for item_name in item_list or ():
+
+            if item_name is not None and item_name not in seen:
+
+                seen.add(item_name)
+
+                items.append(item_name)
+
+                rows.append(row)
+
+    if not items:
+
+        return ItemIndex(np.array([], dtype=object), np.zeros(1, dtype=np.int64),
+                         np.array([], dtype=np.int64))
+
+    unique_items, item_numbers = np.unique(np.array(items, dtype=object),
+                                           return_inverse=True)
+
+    # Stable, so every item's games stay in row order
+    order = np.argsort(item_numbers, kind='mergesort')
+
+    indptr = np.zeros(len(unique_items) + 1, dtype=np.int64)
+
+    indptr[1:] = np.cumsum(np.bincount(item_numbers))
+
+    return ItemIndex(unique_items, indptr,
+                     np.array(rows, dtype=np.int64)[order])
+
+
+def _entry_items(index):
+    '''
+    Item number of every entry of index.game_rows
+    '''
+
+    return np.repeat(np.arange(len(index.items)), np.diff(index.indptr))
+
+
+def _group_mean(groups, values, num_groups):
+
+    counts = np.bincount(groups, minlength=num_groups)
+
+    sums = np.bincount(groups, weights=values, minlength=num_groups)
+
+    means = np.empty(num_groups)
+
+    means.fill(np.nan)
+
+    np.divide(sums, counts, out=means, where=counts > 0)
+
+    return means
+
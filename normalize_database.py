@@ -3,244 +3,421 @@ Since 6 columns in the boardgames table contain text arrays,
 it makes it significantly more difficult to query based on those
 columns. Therefore this script normalizes the database by creating
 separate tables for those 6 columns.
+
+All of the work happens inside Postgres: the arrays are unnested with
+INSERT ... SELECT, and all six tables are filled by a single statement
+that reads the boardgames table once.
+
+After the first full run, a trigger logs the id of every game that gets
+inserted, updated or deleted in boardgames. normalize_changes() only
+redoes the normalized rows of those games, so a refresh after a re-scrape
+costs time in proportion to what changed rather than to the whole table.
+
+Once all six tables exist, the item_rank_bands materialized view keeps, for
+every item of every table and every band of RANK_BAND_WIDTH ranks, the
+number of games and the sums (and non NULL counts) of their geek_rating,
+play_time, complx_rating and num_voters. data_analysis.py answers its
+"per item, for games ranked above X" questions by adding up bands instead
+of joining and grouping the whole table again. It is refreshed at the end
+of both functions below and after every scrape in bg_scraper.py.
+
+$ python normalize_database.py                # rebuild everything
+$ python normalize_database.py --incremental  # only what changed
 '''
 
+import sys
+import time
 import psycopg2
 from bg_scraper import DATABASE # Global Variable
+from bg_scraper import RANK_BANDS_VIEW
+from bg_scraper import bump_data_version
+
+# boardgames column -> (normalized table, column holding one item per row)
+LINK_TABLES = [('designers',  ('designers',  'designer')),
+               ('artists',    ('artists',    'artist')),
+               ('categories', ('categories', 'category')),
+               ('mechanics',  ('mechanics',  'mechanic')),
+               ('family',     ('families',   'family')),
+               ('type',       ('types',      'type'))]
+
+# Ranks in a band of item_rank_bands, band b holds ranks b*W+1 to (b+1)*W.
+#   Games without a rank are in band NULL.
+RANK_BAND_WIDTH = 100
+
+# boardgames columns rolled up in item_rank_bands, with the type their sum
+#   is kept as (the same one AVG() adds them up in)
+RANK_BAND_STATS = [('geek_rating',   'double precision'),
+                   ('play_time',     'bigint'),
+                   ('complx_rating', 'double precision'),
+                   ('num_voters',    'bigint')]
+
+# Keeps track of which games need to be normalized again. Updates only count
+#   when one of the array columns actually changed.
+CHANGE_TRACKING_SQL = """
+    CREATE TABLE IF NOT EXISTS boardgames_changes (bg_id int NOT NULL);
+
+    CREATE OR REPLACE FUNCTION log_boardgame_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO boardgames_changes (bg_id) VALUES (OLD.id);
+        ELSE
+            INSERT INTO boardgames_changes (bg_id) VALUES (NEW.id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS boardgames_insert_delete_log ON boardgames;
+
+    CREATE TRIGGER boardgames_insert_delete_log
+        AFTER INSERT OR DELETE ON boardgames
+        FOR EACH ROW EXECUTE PROCEDURE log_boardgame_change();
+
+    DROP TRIGGER IF EXISTS boardgames_update_log ON boardgames;
+
+    CREATE TRIGGER boardgames_update_log
+        AFTER UPDATE ON boardgames
+        FOR EACH ROW
+        WHEN (OLD.id         IS DISTINCT FROM NEW.id
+           OR OLD.designers  IS DISTINCT FROM NEW.designers
+           OR OLD.artists    IS DISTINCT FROM NEW.artists
+           OR OLD.categories IS DISTINCT FROM NEW.categories
+           OR OLD.mechanics  IS DISTINCT FROM NEW.mechanics
+           OR OLD.family     IS DISTINCT FROM NEW.family
+           OR OLD.type       IS DISTINCT FROM NEW.type)
+        EXECUTE PROCEDURE log_boardgame_change();
+"""
+
+def normalize_database(columns=None, db=DATABASE):
+    '''
+    (Re)build the normalized tables for the text array columns of the
+    boardgames table.
+
+    Every table gets emptied and refilled in the same transaction, so this
+    can be re-run after every scrape. Each table gets a primary key on
+    (item, bg_id), which doubles as the index for item lookups, an index on
+    bg_id for joins and a foreign key to boardgames (deleting a game
+    deletes its rows). They are added the first time around, also to
+    tables made before they existed, and kept up to date by Postgres after
+    that.
+
+    columns = boardgames columns to normalize, all six if not given
+              (list of strings, see LINK_TABLES)
+
+    db      = database to connect to
+    '''
+
+    start_time = time.time()
+
+    link_tables = [(column, link) for column, link in LINK_TABLES
+                   if columns is None or column in columns]
+
+    if not link_tables:
+
+        print "\nRequested column does not exist in table."
+        print "Options for column:", [column for column, link in LINK_TABLES]
+
+        return
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
 
-def create_designers_table():
+            curs.execute(CHANGE_TRACKING_SQL)
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-            try:
-                
-                curs.execute("""CREATE TABLE designers (designer text,
-                                                        bg_id     int);""")
+            # Rebuilding every table catches up on all logged changes. Done
+            #   first so changes made while this runs stay logged.
+            if len(link_tables) == len(LINK_TABLES):
 
-            except:
+                curs.execute("""DELETE FROM boardgames_changes;""")
 
-                curs.execute("""ROLLBACK;""")
+            for column, (table, item) in link_tables:
 
-                print "Failed to create new designers table"
+                curs.execute("""CREATE TABLE IF NOT EXISTS """ + table +\
+                             """ (""" + item + """ text, bg_id int);""")
 
-                return
+            curs.execute("""TRUNCATE """ +\
+                         ', '.join(table for column, (table, item)
+                                   in link_tables) + """;""")
 
-            try:
-                
-                curs.execute("""SELECT designers, id FROM boardgames;""")
+            curs.execute(_single_pass_insert(link_tables))
 
-            except:
+            counts = curs.fetchone()
 
-                curs.execute("""ROLLBACK;""")
+            for column, (table, item) in link_tables:
 
-                print "Failed to select designers,id from boardgames"
+                _create_indexes(curs, table, item)
 
-                return
+            curs.execute("""CREATE INDEX IF NOT EXISTS boardgames_rank_idx
+                                   ON boardgames (rank);""")
 
-            for row_tuple in curs.fetchall():
+    # ANALYZE so the planner knows about the new rows straight away
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
 
-                designer_list, bg_id = row_tuple
+            for column, (table, item) in link_tables:
 
-                for designer in designer_list:
+                curs.execute("""ANALYZE """ + table + """;""")
 
-                    curs.execute("""INSERT INTO designers (designer, bg_id)
-                                      VALUES (%s, %s);""", (designer, bg_id))
+            _build_rank_bands(curs)
 
-def create_artists_table():
+    bump_data_version(db)
+
+    for (column, (table, item)), count in zip(link_tables, counts):
+
+        print "Normalized", column, "into", table, "(" + str(count), "rows)"
 
-    with psycopg2.connect(DATABASE) as conn:
+    print "Total time to normalize:", time.time() - start_time, "seconds"
+
+def normalize_changes(db=DATABASE):
+    '''
+    Bring the normalized tables up to date with the games that were
+    inserted, updated or deleted in boardgames since the last run.
+
+    Falls back to a full normalize_database() if the tables have never been
+    built (there is no change log yet), or only some of them were (eg. by
+    create_designers_table()).
+
+    db = database to connect to
+
+    Returns the number of games that were normalized again
+    '''
+
+    start_time = time.time()
+
+    with psycopg2.connect(db) as conn:
         with conn.cursor() as curs:
-            try:
-                
-                curs.execute("""CREATE TABLE artists (artist text,
-                                                      bg_id   int);""")
 
-            except:
+            curs.execute("""SELECT to_regclass('boardgames_changes');""")
 
-                curs.execute("""ROLLBACK;""")
+            if curs.fetchone()[0] is None:
 
-                print "Failed to create new artists table"
+                print "No change log yet, normalizing everything"
 
-                return
+                normalize_database(db=db)
 
-            try:
-                
-                curs.execute("""SELECT artists, id FROM boardgames;""")
+                return None
 
-            except:
+            link_tables = _existing_link_tables(curs)
 
-                curs.execute("""ROLLBACK;""")
+            # The change log is made by partial builds too. Taking changes
+            #   for tables that don't exist would fail, and keep failing.
+            if len(link_tables) < len(LINK_TABLES):
 
-                print "Failed to select artists,id from boardgames"
+                print "Not every table has been built, normalizing everything"
 
-                return
+                normalize_database(db=db)
 
-            for row_tuple in curs.fetchall():
+                return None
 
-                artist_list, bg_id = row_tuple
+            # Take the logged changes, any logged after this stay for next time
+            curs.execute("""CREATE TEMP TABLE changed_games (bg_id int)
+                                   ON COMMIT DROP;
 
-                for artist in artist_list:
+                            WITH taken AS (DELETE FROM boardgames_changes
+                                           RETURNING bg_id)
+                            INSERT INTO changed_games
+                            SELECT DISTINCT bg_id FROM taken;
 
-                    curs.execute("""INSERT INTO artists (artist, bg_id)
-                                      VALUES (%s, %s);""", (artist, bg_id))
+                            SELECT COUNT(*) FROM changed_games;""")
 
-def create_categories_table():
+            num_changed = curs.fetchone()[0]
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-            try:
-                
-                curs.execute("""CREATE TABLE categories (category text,
-                                                         bg_id     int);""")
+            if num_changed:
 
-            except:
+                for column, (table, item) in link_tables:
 
-                curs.execute("""ROLLBACK;""")
+                    curs.execute("""DELETE FROM """ + table + """
+                                    WHERE bg_id IN (SELECT bg_id
+                                                    FROM changed_games);""")
 
-                print "Failed to create new categories table"
+                # Deleted games are no longer in boardgames, so they only
+                #   lose their rows
+                curs.execute(_single_pass_insert(link_tables,
+                                   """WHERE id IN (SELECT bg_id
+                                                FROM changed_games)"""))
 
-                return
+            # Ratings may have changed even if no array column did
+            _build_rank_bands(curs)
 
-            try:
-                
-                curs.execute("""SELECT categories, id FROM boardgames;""")
+    bump_data_version(db)
 
-            except:
+    print "Normalized", num_changed, "changed games in",\
+          time.time() - start_time, "seconds"
 
-                curs.execute("""ROLLBACK;""")
+    return num_changed
 
-                print "Failed to select categories,id from boardgames"
+def _single_pass_insert(link_tables, where=''):
+    '''
+    One statement that fills every link table from a single scan of
+    boardgames, using one data modifying WITH query per table.
 
-                return
+    where = optional WHERE clause limiting the games that get normalized
 
-            for row_tuple in curs.fetchall():
+    Returns the SQL, which selects the number of rows put in each table.
+    '''
 
-                category_list, bg_id = row_tuple
+    columns = ', '.join(column for column, link in link_tables)
 
-                for category in category_list:
+    sql = """WITH games AS (SELECT id, """ + columns + """ FROM boardgames
+                            """ + where + """)"""
 
-                    curs.execute("""INSERT INTO categories (category, bg_id)
-                                      VALUES (%s, %s);""", (category, bg_id))
+    # An item listed twice for a game (or a NULL item) would break the
+    #   primary key
+    for column, (table, item) in link_tables:
 
-def create_mechanics_table():
+        sql += """,
+                 """ + table + """_rows AS (
+                     INSERT INTO """ + table + """ (""" + item + """, bg_id)
+                     SELECT DISTINCT item, id
+                     FROM games, unnest(games.""" + column + """) AS item
+                     WHERE item IS NOT NULL
+                     RETURNING 1)"""
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-            try:
-                
-                curs.execute("""CREATE TABLE mechanics (mechanic text,
-                                                        bg_id     int);""")
+    return sql + """
+             SELECT """ + ', '.join("""(SELECT COUNT(*) FROM """ + table +\
+                                    """_rows)"""
+                                    for column, (table, item)
+                                    in link_tables) + """;"""
 
-            except:
+def _create_indexes(curs, table, item):
+    '''
+    Primary key on (item, bg_id) for looking up games by item ("WHERE
+    mechanic = ..."), an index for joining back to boardgames on bg_id and
+    a foreign key to boardgames. Run after the table was filled, the
+    constraints are checked against its rows.
+    '''
 
-                curs.execute("""ROLLBACK;""")
+    constraints = [(table + '_pkey',
+                    """PRIMARY KEY (""" + item + """, bg_id)"""),
+                   (table + '_bg_id_fkey',
+                    """FOREIGN KEY (bg_id) REFERENCES boardgames (id)
+                       ON DELETE CASCADE""")]
 
-                print "Failed to create new mechanics table"
+    for name, constraint in constraints:
 
-                return
+        curs.execute("""SELECT 1 FROM pg_constraint
+                        WHERE conrelid = %s::regclass AND conname = %s;""",
+                     (table, name))
 
-            try:
-                
-                curs.execute("""SELECT mechanics, id FROM boardgames;""")
+        if curs.fetchone() is None:
 
-            except:
+            curs.execute("""ALTER TABLE """ + table + """
+                            ADD CONSTRAINT """ + name + """ """ + constraint + """;""")
 
-                curs.execute("""ROLLBACK;""")
+    # Made by earlier versions, the primary key covers it
+    curs.execute("""DROP INDEX IF EXISTS """ + table + """_""" + item +\
+                 """_bg_id_idx;""")
 
-                print "Failed to select mechanics,id from boardgames"
+    curs.execute("""CREATE INDEX IF NOT EXISTS """ + table + """_bg_id_idx
+                           ON """ + table + """ (bg_id);""")
 
-                return
+def _existing_link_tables(curs):
+    '''
+    The entries of LINK_TABLES whose tables have been made
+    '''
 
-            for row_tuple in curs.fetchall():
+    link_tables = []
 
-                mechanic_list, bg_id = row_tuple
+    for column, (table, item) in LINK_TABLES:
 
-                for mechanic in mechanic_list:
+        curs.execute("""SELECT to_regclass(%s);""", (table,))
 
-                    curs.execute("""INSERT INTO mechanics (mechanic, bg_id)
-                                      VALUES (%s, %s);""", (mechanic, bg_id))
+        if curs.fetchone()[0] is not None:
 
-def create_families_table():
+            link_tables.append((column, (table, item)))
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-            try:
-                
-                curs.execute("""CREATE TABLE families (family text,
-                                                       bg_id   int);""")
+    return link_tables
 
-            except:
+def _build_rank_bands(curs):
+    '''
+    Create the item_rank_bands materialized view, or refresh it if it
+    already exists. Nothing happens until every link table has been made.
+    '''
 
-                curs.execute("""ROLLBACK;""")
+    if len(_existing_link_tables(curs)) < len(LINK_TABLES):
 
-                print "Failed to create new families table"
+        return
 
-                return
+    curs.execute("""SELECT to_regclass(%s);""", (RANK_BANDS_VIEW,))
 
-            try:
-                
-                curs.execute("""SELECT family, id FROM boardgames;""")
+    if curs.fetchone()[0] is not None:
 
-            except:
+        curs.execute("""REFRESH MATERIALIZED VIEW """ + RANK_BANDS_VIEW +\
+                     """;""")
 
-                curs.execute("""ROLLBACK;""")
+        return
 
-                print "Failed to select family,id from boardgames"
+    curs.execute("""CREATE MATERIALIZED VIEW """ + RANK_BANDS_VIEW + """ AS
+                    """ + _rank_bands_select() + """;
 
-                return
+                    CREATE INDEX """ + RANK_BANDS_VIEW + """_band_idx
+                           ON """ + RANK_BANDS_VIEW + """ (link_column, band);
+""")
 
-            for row_tuple in curs.fetchall():
+def _rank_bands_select():
+    '''
+    The query behind item_rank_bands: one GROUP BY per link table, put
+    together with UNION ALL. Rows of a link table whose game isn't in
+    boardgames are only counted (band NULL), like count_column() does.
+    '''
 
-                family_list, bg_id = row_tuple
+    stats = ''
 
-                for family in family_list:
+    for stat, sum_type in RANK_BAND_STATS:
 
-                    curs.execute("""INSERT INTO families (family, bg_id)
-                                      VALUES (%s, %s);""", (family, bg_id))
+        stats += """,
+                  SUM(boardgames.""" + stat + """::""" + sum_type + """)
+                      AS """ + stat + """_sum,
+                  COUNT(boardgames.""" + stat + """)::int
+                      AS """ + stat + """_count"""
 
-def create_types_table():
+    selects = []
 
-    with psycopg2.connect(DATABASE) as conn:
-        with conn.cursor() as curs:
-            try:
-                
-                curs.execute("""CREATE TABLE types (type text,
-                                                    bg_id int);""")
+    for column, (table, item) in LINK_TABLES:
 
-            except:
+        selects.append("""
+            SELECT '""" + column + """'::text AS link_column,
+                   """ + table + """.""" + item + """ AS item,
+                   (boardgames.rank - 1) / """ + str(RANK_BAND_WIDTH) + """
+                       AS band,
+                   COUNT(""" + table + """.bg_id)::int AS num_games""" +\
+                   stats + """
+            FROM """ + table + """
+            LEFT JOIN boardgames ON boardgames.id = """ + table + """.bg_id
+            GROUP BY 1, 2, 3""")
 
-                curs.execute("""ROLLBACK;""")
+    return '\n            UNION ALL'.join(selects)
+
+def create_designers_table():
 
-                print "Failed to create new types table"
+    normalize_database(['designers'])
 
-                return
+def create_artists_table():
 
-            try:
-                
-                curs.execute("""SELECT type, id FROM boardgames;""")
+    normalize_database(['artists'])
 
-            except:
+def create_categories_table():
 
-                curs.execute("""ROLLBACK;""")
+    normalize_database(['categories'])
 
-                print "Failed to select type,id from boardgames"
+def create_mechanics_table():
 
-                return
+    normalize_database(['mechanics'])
 
-            for row_tuple in curs.fetchall():
+def create_families_table():
 
-                type_list, bg_id = row_tuple
+    normalize_database(['family'])
 
-                for bg_type in type_list:
+def create_types_table():
 
-                    curs.execute("""INSERT INTO types (type, bg_id)
-                                      VALUES (%s, %s);""", (bg_type, bg_id))
+    normalize_database(['type'])
 
 if __name__ ==  "__main__":
 
-    create_designers_table()
-    create_artists_table()
-    create_categories_table()
-    create_mechanics_table()
-    create_families_table()
-    create_types_table()
+    if '--incremental' in sys.argv[1:]:
+
+        normalize_changes()
+
+    else:
+
+        normalize_database()
@@ -0,0 +1,295 @@
+'''
+Memoizing cache for the analysis functions in data_analysis.py
+
+In a notebook the same count_column('mechanics') or
+geek_rating_avg_rating_for_item_in_column('mechanics', 'Dice Rolling')
+gets asked for over and over, and every time the database runs the query
+again. Functions wrapped with memoize() keep their results in a bounded
+LRU cache, keyed by the function, its arguments (defaults filled in) and
+the database query_executor points at.
+
+Every entry is stamped with the data version: a Postgres sequence that
+bg_scraper.bump_data_version() moves on after every scrape and every
+normalization. Checking the version is one tiny query, so a result is
+never served once the data it came from has changed.
+
+    import query_cache
+
+    data_analysis.count_column('mechanics')   # miss, runs the query
+    data_analysis.count_column('mechanics')   # hit
+
+    query_cache.cache.stats()                 # {'hits': 1, 'misses': 1, ...}
+
+    query_cache.use_cache(None)               # back to querying every time
+
+Results are kept pickled, so a hit hands back a fresh copy the caller can
+change freely. A cache given a file_name is read from that file when it is
+made and written back by save() (and when Python exits), so it survives
+restarting the notebook kernel.
+'''
+
+import atexit
+import cPickle
+import functools
+import inspect
+import os
+import threading
+from collections import OrderedDict
+
+import query_executor
+from bg_scraper import DATA_VERSION_SEQUENCE
+
+MAX_ENTRIES = 256
+
+
+class QueryCache(object):
+    '''
+    A bounded LRU cache of pickled function results
+
+    max_entries : Entries kept before the least recently used ones are
+                  dropped
+                  (Type: int)
+
+    file_name   : File to keep the entries in between sessions, None to
+                  keep them in memory only
+                  (Type: String)
+    '''
+
+    def __init__(self, max_entries=MAX_ENTRIES, file_name=None):
+
+        self.max_entries = max_entries
+
+        self.file_name = file_name
+
+        # key -> (data version, pickled result), least recently used first
+        self._entries = OrderedDict()
+
+        self._lock = threading.Lock()
+
+        self.hits = 0
+
+        self.misses = 0
+
+        self.invalidations = 0
+
+        self.evictions = 0
+
+        if file_name is not None:
+
+            self._load()
+
+            atexit.register(self.save)
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def call(self, function, args, kwargs):
+        '''
+        function(*args, **kwargs), from the cache if it holds a result for
+        the current data version. None (how the analysis functions report
+        a failure) is never cached.
+        '''
+
+        try:
+
+            version = data_version()
+
+        except:
+
+            # No database to check against, so nothing can be trusted
+            return function(*args, **kwargs)
+
+        key = _make_key(function, args, kwargs)
+
+        with self._lock:
+
+            entry = self._entries.pop(key, None)
+
+            if entry is not None and entry[0] == version:
+
+                self._entries[key] = entry
+
+                self.hits += 1
+
+                return cPickle.loads(entry[1])
+
+            if entry is not None:
+
+                self.invalidations += 1
+
+            self.misses += 1
+
+        result = function(*args, **kwargs)
+
+        if result is not None:
+
+            self.put(key, version, result)
+
+        return result
+
+    def put(self, key, version, result):
+
+        pickled = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+
+        with self._lock:
+
+            self._entries.pop(key, None)
+
+            self._entries[key] = (version, pickled)
+
+            while len(self._entries) > self.max_entries:
+
+                self._entries.popitem(last=False)
+
+                self.evictions += 1
+
+    def clear(self):
+        '''
+        Drop every entry (the statistics are kept)
+        '''
+
+        with self._lock:
+
+            self._entries.clear()
+
+    def stats(self):
+        '''
+        Hits, misses, entries dropped because the data version moved on
+        (invalidations) or to make room (evictions), the number of entries
+        and the bytes they take up
+        '''
+
+        with self._lock:
+
+            calls = self.hits + self.misses
+
+            return {'hits'         : self.hits,
+                    'misses'       : self.misses,
+                    'hit_rate'     : float(self.hits) / calls if calls else 0.,
+                    'invalidations': self.invalidations,
+                    'evictions'    : self.evictions,
+                    'entries'      : len(self._entries),
+                    'bytes'        : sum(len(pickled) for version, pickled
+                                         in self._entries.values())}
+
+    def report(self):
+
+        stats = self.stats()
+
+        print "Query cache:", stats['hits'], "hits,", stats['misses'],\
+              "misses (" + str(round(100 * stats['hit_rate'], 1)) + "%),",\
+              stats['invalidations'], "invalidated,", stats['evictions'],\
+              "evicted,", stats['entries'], "entries,", stats['bytes'], "bytes"
+
+    def save(self):
+        '''
+        Write the entries to file_name (written to a temporary file first,
+        so a crash can't leave half a cache behind)
+        '''
+
+        if self.file_name is None:
+
+            return
+
+        with self._lock:
+
+            entries = list(self._entries.items())
+
+        temp_file_name = self.file_name + '.tmp'
+
+        with open(temp_file_name, 'wb') as cache_file:
+
+            cPickle.dump(entries, cache_file, cPickle.HIGHEST_PROTOCOL)
+
+        os.rename(temp_file_name, self.file_name)
+
+    def _load(self):
+
+        if not os.path.exists(self.file_name):
+
+            return
+
+        try:
+
+            with open(self.file_name, 'rb') as cache_file:
+
+                entries = cPickle.load(cache_file)
+
+        except (EOFError, cPickle.UnpicklingError):
+
+            print "Ignoring unreadable query cache file", self.file_name
+
+            return
+
+        for key, entry in entries[-self.max_entries:]:
+
+            self._entries[key] = entry
+
+
+# The cache memoize() uses, see use_cache()
+cache = QueryCache()
+
+
+def use_cache(query_cache):
+    '''
+    Make memoized functions use a different QueryCache, or none at all
+
+    query_cache : eg. QueryCache(1024, 'analysis_cache.pickle'), or None to
+                  run every call
+                  (Type: QueryCache)
+    '''
+
+    global cache
+
+    cache = query_cache
+
+
+def memoize(skip=None):
+    '''
+    Decorator caching a function's results in the module's cache
+
+    skip : Function with no arguments, when it returns True the call isn't
+           cached (eg. data_analysis answering from a GameStore)
+    '''
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def memoized(*args, **kwargs):
+
+            if cache is None or (skip is not None and skip()):
+
+                return function(*args, **kwargs)
+
+            return cache.call(function, args, kwargs)
+
+        return memoized
+
+    return decorator
+
+
+def data_version(db=None):
+    '''
+    The current data version of a database (query_executor's if not given),
+    None if it has never been bumped
+    '''
+
+    return query_executor.execute("""SELECT pg_sequence_last_value(
+                                                to_regclass(%s));""",
+                                  (DATA_VERSION_SEQUENCE,), db=db)[0][0]
+
+
+def _make_key(function, args, kwargs):
+    '''
+    The database plus the function and its arguments by name, defaults
+    filled in, so count_column('mechanics') and
+    count_column(column='mechanics') share an entry
+    '''
+
+    call_args = inspect.getcallargs(function, *args, **kwargs)
+
+    return cPickle.dumps((query_executor.database,
+                          function.__module__,
+                          function.__name__,
+                          sorted(call_args.items())), 2)
@@ -0,0 +1,422 @@
+'''
+Shared database access for data_analysis.py
+
+Instead of every analysis function opening (and tearing down) its own
+psycopg2 connection, they all borrow one from a module level connection
+pool. Queries that get run over and over with different arguments (like
+the *_for_item_in_column functions inside the plotting loops) are turned
+into server side prepared statements the first time a connection sees
+them, so Postgres only parses and plans them once per connection.
+
+    import query_executor
+
+    rows = query_executor.execute("""SELECT name FROM boardgames
+                                     WHERE rank < %s;""", (10,))
+
+Big results don't have to be fetched all at once. stream() runs a query
+through a server side (named) cursor and hands the rows back in numpy
+record batches of ITERSIZE rows, so memory stays bounded by the batch
+size; fetch_arrays() puts the batches together into one array per column
+without ever holding the rows as Python tuples:
+
+    for batch in query_executor.stream("""SELECT play_time, complx_rating
+                                           FROM boardgames;"""):
+
+        batch['play_time']   # float array, NaN for NULL
+
+Everything runs against bg_scraper.DATABASE unless use_database() says
+otherwise.
+'''
+
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+import psycopg2.pool
+
+from bg_scraper import DATABASE # Global Variable
+
+MIN_CONNECTIONS = 1
+
+MAX_CONNECTIONS = 4
+
+# Set to False to go back to one new connection per query and no prepared
+#   statements (used by the benchmarks for the before picture)
+POOLING = True
+
+# Postgres types used to declare the parameters of prepared statements
+PARAM_TYPES = [(bool,    'boolean'),
+               (int,     'bigint'),
+               (long,    'bigint'),
+               (float,   'double precision'),
+               (str,     'text'),
+               (unicode, 'text')]
+
+# Rows fetched per round trip (and per batch) by stream()
+ITERSIZE = 2000
+
+# Database used when a function isn't given one, see use_database()
+database = DATABASE
+
+_pool = None
+
+_pool_db = None
+
+_pool_lock = threading.Lock()
+
+# connection -> names of the statements already prepared on it
+_prepared = {}
+
+# Numbers for naming stream()'s server side cursors
+_cursor_numbers = itertools.count()
+
+# (sql, params) of every query run while logged_queries() is in use
+_query_log = None
+
+
+def use_database(db):
+    '''
+    Point every analysis query at a different database
+
+    db : psycopg2 connection string, eg. "dbname = 'bggdb'"
+         (Type: String)
+    '''
+
+    global database
+
+    database = db
+
+
+def get_pool(db=None):
+    '''
+    The module's connection pool, made the first time it is needed. Asking
+    for a different database closes the old pool and starts a new one.
+    '''
+
+    global _pool, _pool_db
+
+    db = db or database
+
+    with _pool_lock:
+
+        if _pool is None or _pool_db != db:
+
+            if _pool is not None:
+
+                _pool.closeall()
+
+                _prepared.clear()
+
+            _pool = psycopg2.pool.ThreadedConnectionPool(MIN_CONNECTIONS,
+                                                         MAX_CONNECTIONS, db)
+
+            _pool_db = db
+
+        return _pool
+
+
+def close_pool():
+    '''
+    Close every pooled connection, eg. before the notebook kernel shuts down
+    '''
+
+    global _pool, _pool_db
+
+    with _pool_lock:
+
+        if _pool is not None:
+
+            _pool.closeall()
+
+        _pool = None
+
+        _pool_db = None
+
+        _prepared.clear()
+
+
+@contextmanager
+def connection(db=None):
+    '''
+    Borrow a connection from the pool for the length of a with block. The
+    transaction is committed at the end of the block (rolled back on an
+    error) and the connection goes back to the pool.
+    '''
+
+    if not POOLING:
+
+        conn = psycopg2.connect(db or database)
+
+        try:
+
+            with conn:
+
+                yield conn
+
+        finally:
+
+            conn.close()
+
+        return
+
+    pool = get_pool(db)
+
+    conn = pool.getconn()
+
+    broken = False
+
+    try:
+
+        with conn:
+
+            yield conn
+
+    except GeneratorExit:
+
+        # A stream() that wasn't read to the end, its transaction was
+        #   rolled back so the connection is fine
+        raise
+
+    except:
+
+        # Don't hand out a connection that is left in an unknown state
+        broken = True
+
+        raise
+
+    finally:
+
+        if broken:
+
+            _prepared.pop(conn, None)
+
+        pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def logged_queries():
+    '''
+    Collect the (sql, params) of every query run by execute() and stream()
+    inside a with block, eg. to EXPLAIN them (see check_query_plans.py)
+
+        with query_executor.logged_queries() as queries:
+
+            data_analysis.count_column('mechanics')
+    '''
+
+    global _query_log
+
+    _query_log = []
+
+    try:
+
+        yield _query_log
+
+    finally:
+
+        _query_log = None
+
+
+def execute(sql, params=(), db=None):
+    '''
+    Run a query on a pooled connection and return all of its rows
+
+    sql    : The query, with %s placeholders for its parameters
+             (Type: String)
+
+    params : Values for the placeholders
+             (Type: tuple)
+
+    Queries with parameters are run as prepared statements, unless a
+    parameter has a type that isn't in PARAM_TYPES (eg. None)
+    '''
+
+    if _query_log is not None:
+
+        _query_log.append((sql, params))
+
+    with connection(db) as conn:
+        with conn.cursor() as curs:
+
+            if POOLING and params and _param_types(params) is not None:
+
+                _execute_prepared(conn, curs, sql, params)
+
+            else:
+
+                curs.execute(sql, params or None)
+
+            return curs.fetchall()
+
+
+def stream(sql, params=(), itersize=None, db=None):
+    '''
+    Run a query through a server side cursor and yield its rows in batches
+
+    sql      : The query, with %s placeholders for its parameters
+               (Type: String)
+
+    params   : Values for the placeholders
+               (Type: tuple)
+
+    itersize : Rows per batch (and per round trip), ITERSIZE if not given
+               (Type: int)
+
+    Every batch is a numpy record array with a field per column, named
+    after the column: numbers as floats (NaN for NULL), anything else as
+    objects. A query without rows gives one empty batch, so the fields are
+    always known. The connection is kept until the last batch has been
+    read (or the generator is closed).
+    '''
+
+    itersize = itersize or ITERSIZE
+
+    if _query_log is not None:
+
+        _query_log.append((sql, params))
+
+    with connection(db) as conn:
+
+        # Cursors are planned for getting the first rows quickly, but every
+        #   row is going to be read
+        with conn.cursor() as curs:
+
+            curs.execute("""SET LOCAL cursor_tuple_fraction = 1.0;""")
+
+        with conn.cursor('stream_' + str(next(_cursor_numbers))) as curs:
+
+            curs.itersize = itersize
+
+            curs.execute(sql, params or None)
+
+            rows = curs.fetchmany(itersize)
+
+            dtype = _record_dtype(curs.description)
+
+            yield _record_batch(rows, dtype)
+
+            while len(rows) == itersize:
+
+                rows = curs.fetchmany(itersize)
+
+                if rows:
+
+                    yield _record_batch(rows, dtype)
+
+
+def fetch_arrays(sql, params=(), itersize=None, db=None):
+    '''
+    All the rows of a query as one array per column, put together from
+    stream()'s batches
+
+    Returns a tuple of arrays in the order of the query's columns
+    '''
+
+    batches = list(stream(sql, params, itersize, db))
+
+    return tuple(np.concatenate([batch[name] for batch in batches])
+                 for name in batches[0].dtype.names)
+
+
+def _record_dtype(description):
+    '''
+    Record array type for a cursor's columns: float for numbers, object
+    for everything else. A repeated column name gets its position added.
+    '''
+
+    fields = []
+
+    for i, column in enumerate(description):
+
+        name = column.name
+
+        if name in [field[0] for field in fields]:
+
+            name += '_' + str(i)
+
+        fields.append((name, float if column.type_code == psycopg2.NUMBER
+                                   else object))
+
+    return np.dtype(fields)
+
+
+def _record_batch(rows, dtype):
+
+    batch = np.empty(len(rows), dtype=dtype)
+
+    for name, values in zip(dtype.names, zip(*rows)):
+
+        if dtype.fields[name][0] == object:
+
+            # One by one, so list values (text arrays) stay whole
+            field = batch[name]
+
+            for i, value in enumerate(values):
+
+                field[i] = value
+
+        else:
+
+            # None (NULL) turns into NaN in a float field
+            batch[name] = np.array(values, dtype=float)
+
+    return batch
+
+
+def _execute_prepared(conn, curs, sql, params):
+
+    param_types = _param_types(params)
+
+    # Same query with differently typed parameters needs its own statement
+    name = 'q_' + hashlib.md5(sql + repr(param_types)).hexdigest()[:16]
+
+    prepared = _prepared.setdefault(conn, set())
+
+    if name not in prepared:
+
+        curs.execute('PREPARE ' + name + ' (' + ', '.join(param_types) +\
+                     ') AS ' + _numbered_placeholders(sql))
+
+        prepared.add(name)
+
+    curs.execute('EXECUTE ' + name + ' (' + ', '.join(['%s']*len(params)) +\
+                 ');', params)
+
+
+def _param_types(params):
+    '''
+    Postgres type names for a tuple of parameters, or None if one of them
+    has no entry in PARAM_TYPES
+    '''
+
+    param_types = []
+
+    for param in params:
+
+        for python_type, pg_type in PARAM_TYPES:
+
+            if type(param) is python_type:
+
+                param_types.append(pg_type)
+
+                break
+
+        else:
+
+            return None
+
+    return param_types
+
+
+def _numbered_placeholders(sql):
+    '''
+    Turn psycopg2's %s placeholders into the $1, $2, ... used by PREPARE
+    '''
+
+    pieces = sql.rstrip().rstrip(';').split('%s')
+
+    return ''.join(piece + ('$' + str(i + 1) if i < len(pieces) - 1 else '')
+                   for i, piece in enumerate(pieces))
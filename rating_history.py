@@ -0,0 +1,371 @@
+'''
+History of every game's rank, geek_rating, avg_rating and num_voters.
+
+boardgames only ever holds the latest numbers, but BGG's ratings are
+polls that keep drifting. After install_rating_history() has been run
+once, a trigger on boardgames writes a row into boardgame_ratings whenever
+a game is inserted or one of those four columns changes (eg. by
+bg_scraper.scrape_changed_games()).
+
+Storage is kept small in two ways:
+
+    - Only changes are stored, one row per game per day at most. The
+      numbers of a game on any date are in its latest row on or before
+      that date (see rating_trajectory() and biggest_movers()).
+
+    - boardgame_ratings is partitioned by month
+      (boardgame_ratings_2016_06, ...), partitions are made as needed.
+      Old months can be dropped or archived one table at a time.
+
+A crawl of the browse pages (the csv file from collect_games.py) has all
+four numbers, so it can be recorded without touching boardgames with
+record_snapshot(csv_file_name=...).
+
+$ python rating_history.py                     # install the trigger
+$ python rating_history.py BGG_GameList.csv    # record a crawl
+'''
+
+import sys
+import time
+from io import BytesIO
+
+import psycopg2
+
+import query_executor
+from bg_scraper import DATABASE # Global Variable
+from bg_scraper import _copy_rows, _last_per_game
+from game_list import iter_game_list
+
+# Columns of boardgames that are tracked
+RATING_COLUMNS = ['rank', 'geek_rating', 'avg_rating', 'num_voters']
+
+# The date rows are recorded under is today, unless the connection sets
+#   bgg.snapshot_date (eg. to backfill an older crawl)
+RATING_HISTORY_SQL = """
+    CREATE TABLE IF NOT EXISTS boardgame_ratings (
+        snapshot_date  date NOT NULL,
+        bg_id          int  NOT NULL,
+        rank           int,
+        geek_rating    real,
+        avg_rating     real,
+        num_voters     int,
+        PRIMARY KEY (bg_id, snapshot_date)
+    ) PARTITION BY RANGE (snapshot_date);
+
+    CREATE OR REPLACE FUNCTION boardgame_ratings_snapshot_date()
+    RETURNS date AS $$
+        SELECT COALESCE(NULLIF(current_setting('bgg.snapshot_date', true),
+                               '')::date,
+                        current_date);
+    $$ LANGUAGE sql STABLE;
+
+    CREATE OR REPLACE FUNCTION boardgame_ratings_partition(day date)
+    RETURNS void AS $$
+    DECLARE
+        first_day date := date_trunc('month', day)::date;
+        partition text := 'boardgame_ratings_' || to_char(day, 'YYYY_MM');
+    BEGIN
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF boardgame_ratings
+                            FOR VALUES FROM (%L) TO (%L)', partition,
+                           first_day, (first_day + interval '1 month')::date);
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION log_boardgame_rating() RETURNS trigger AS $$
+    DECLARE
+        day date := boardgame_ratings_snapshot_date();
+    BEGIN
+        PERFORM boardgame_ratings_partition(day);
+
+        INSERT INTO boardgame_ratings (snapshot_date, bg_id, rank,
+                                       geek_rating, avg_rating, num_voters)
+        VALUES (day, NEW.id, NEW.rank, NEW.geek_rating, NEW.avg_rating,
+                NEW.num_voters)
+        ON CONFLICT (bg_id, snapshot_date) DO UPDATE
+        SET rank        = EXCLUDED.rank,
+            geek_rating = EXCLUDED.geek_rating,
+            avg_rating  = EXCLUDED.avg_rating,
+            num_voters  = EXCLUDED.num_voters;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS boardgames_rating_insert_log ON boardgames;
+
+    CREATE TRIGGER boardgames_rating_insert_log
+        AFTER INSERT ON boardgames
+        FOR EACH ROW EXECUTE PROCEDURE log_boardgame_rating();
+
+    DROP TRIGGER IF EXISTS boardgames_rating_update_log ON boardgames;
+
+    CREATE TRIGGER boardgames_rating_update_log
+        AFTER UPDATE ON boardgames
+        FOR EACH ROW
+        WHEN (OLD.id          IS DISTINCT FROM NEW.id
+           OR OLD.rank        IS DISTINCT FROM NEW.rank
+           OR OLD.geek_rating IS DISTINCT FROM NEW.geek_rating
+           OR OLD.avg_rating  IS DISTINCT FROM NEW.avg_rating
+           OR OLD.num_voters  IS DISTINCT FROM NEW.num_voters)
+        EXECUTE PROCEDURE log_boardgame_rating();
+"""
+
+# Latest numbers of every game on or before a date
+_AS_OF_SQL = """SELECT DISTINCT ON (bg_id) bg_id, rank, geek_rating,
+                                           avg_rating, num_voters
+                FROM boardgame_ratings
+                WHERE snapshot_date <= {as_of}
+                ORDER BY bg_id, snapshot_date DESC"""
+
+def install_rating_history(db=DATABASE):
+    '''
+    Create the boardgame_ratings table and the trigger that fills it. Safe
+    to run again.
+
+    Games already in boardgames aren't in the history until they change,
+    record_snapshot() puts all of them in.
+
+    db = database to connect to
+    '''
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute(RATING_HISTORY_SQL)
+
+def record_snapshot(db=DATABASE, csv_file_name=None, snapshot_date=None):
+    '''
+    Record the current numbers of every game, either from boardgames or
+    from a crawl of the browse pages
+
+    Only games whose numbers differ from their latest recorded ones get a
+    row.
+
+    db            = database to connect to
+
+    csv_file_name = csv file made by collect_games.py to record instead of
+                    the boardgames table
+                    (string)
+
+    snapshot_date = date to record the numbers under, today if not given
+                    (datetime.date or 'YYYY-MM-DD')
+
+    Returns the number of games that got a row
+    '''
+
+    start_time = time.time()
+
+    with psycopg2.connect(db) as conn:
+        with conn.cursor() as curs:
+
+            curs.execute("""SELECT to_regclass('boardgame_ratings');""")
+
+            if curs.fetchone()[0] is None:
+
+                curs.execute(RATING_HISTORY_SQL)
+
+            if snapshot_date is not None:
+
+                curs.execute("""SELECT set_config('bgg.snapshot_date', %s,
+                                                  true);""",
+                             (str(snapshot_date),))
+
+            curs.execute("""SELECT boardgame_ratings_partition(
+                                       boardgame_ratings_snapshot_date());""")
+
+            if csv_file_name is None:
+
+                source = 'boardgames'
+
+            else:
+
+                curs.execute("""CREATE TEMP TABLE crawled_ratings
+                                       (id int, rank int, geek_rating real,
+                                        avg_rating real, num_voters int)
+                                       ON COMMIT DROP;""")
+
+                curs.copy_expert("""COPY crawled_ratings FROM STDIN;""",
+                                 BytesIO(_crawl_copy_rows(csv_file_name)))
+
+                curs.execute("""ANALYZE crawled_ratings;""")
+
+                source = 'crawled_ratings'
+
+            source_columns = ', '.join('source.' + column
+                                       for column in RATING_COLUMNS)
+
+            latest_columns = ', '.join('latest.' + column
+                                       for column in RATING_COLUMNS)
+
+            latest = _AS_OF_SQL.format(as_of='boardgame_ratings_snapshot_date()')
+
+            curs.execute("""INSERT INTO boardgame_ratings (snapshot_date,
+                                                           bg_id, """ +\
+                                             ', '.join(RATING_COLUMNS) + """)
+                            SELECT boardgame_ratings_snapshot_date(), source.id,
+                                   """ + source_columns + """
+                            FROM """ + source + """ AS source
+                            LEFT JOIN (""" + latest + """) AS latest
+                            ON latest.bg_id = source.id
+                            WHERE latest.bg_id IS NULL
+                            OR (""" + latest_columns + """) IS DISTINCT FROM
+                               (""" + source_columns + """)
+                            ON CONFLICT (bg_id, snapshot_date) DO UPDATE
+                            SET """ + ', '.join(column + ' = EXCLUDED.' + column
+                                                for column in RATING_COLUMNS) +\
+                         """;""")
+
+            num_recorded = curs.rowcount
+
+    print "Recorded", num_recorded, "changed games in",\
+          time.time() - start_time, "seconds"
+
+    return num_recorded
+
+def _crawl_copy_rows(csv_file_name):
+    '''
+    The id and the four tracked numbers of every game in a csv file made
+    by collect_games.py, in COPY's text format. A game listed twice only
+    gets its last row, the upsert can't touch a row twice.
+    '''
+
+    return _copy_rows(_last_per_game(record._asdict() for record
+                                     in iter_game_list(csv_file_name)),
+                      ['id'] + RATING_COLUMNS)
+
+def snapshot_dates(db=None):
+    '''
+    Every date something was recorded on, oldest first
+    '''
+
+    try:
+
+        rows = query_executor.execute("""SELECT DISTINCT snapshot_date
+                                         FROM boardgame_ratings
+                                         ORDER BY snapshot_date;""", db=db)
+
+    except:
+
+        print "Failed to SELECT from table"
+
+        return
+
+    return [row_tuple[0] for row_tuple in rows]
+
+def rating_trajectory(bg_id, db=None):
+    '''
+    How a game's numbers changed over time
+
+    bg_id : boardgamegeek id of the game
+            (Type: int)
+
+    Returns a list of dates and a list each of the game's rank,
+    geek_rating, avg_rating and num_voters on those dates (the dates it
+    changed on)
+    '''
+
+    dates       = []
+    rank        = []
+    geek_rating = []
+    avg_rating  = []
+    num_voters  = []
+
+    try:
+
+        rows = query_executor.execute("""SELECT snapshot_date, rank,
+                                                geek_rating, avg_rating,
+                                                num_voters
+                                         FROM boardgame_ratings
+                                         WHERE bg_id = %s
+                                         ORDER BY snapshot_date;""",
+                                      (int(bg_id),), db=db)
+
+    except:
+
+        print "Failed to SELECT from table"
+
+        return
+
+    for row_tuple in rows:
+
+        dates.append(row_tuple[0])
+
+        rank.append(row_tuple[1])
+
+        geek_rating.append(row_tuple[2])
+
+        avg_rating.append(row_tuple[3])
+
+        num_voters.append(row_tuple[4])
+
+    return dates, rank, geek_rating, avg_rating, num_voters
+
+def biggest_movers(date_from, date_to, column='geek_rating', top=10, db=None):
+    '''
+    Games whose numbers changed the most between two dates
+
+    date_from, date_to : compare the numbers as they were on these dates
+                         (datetime.date or 'YYYY-MM-DD')
+
+    column             : one of RATING_COLUMNS
+                         (Type: String)
+
+    top                : number of games to return
+                         (Type: int)
+
+    Returns a list of [bg_id, name, value on date_from, value on date_to,
+    change] lists, biggest change (either way) first. Only games that have
+    a value on both dates are compared.
+    '''
+
+    if column not in RATING_COLUMNS:
+
+        print "\nRequested column is not tracked."
+        print "Options for column:", RATING_COLUMNS
+
+        return
+
+    try:
+
+        rows = query_executor.execute("""WITH before AS (""" +\
+                                      _AS_OF_SQL.format(as_of='%s::date') +\
+                                      """), after AS (""" +\
+                                      _AS_OF_SQL.format(as_of='%s::date') +\
+                                      """)
+                                         SELECT after.bg_id, boardgames.name,
+                                                before.""" + column + """,
+                                                after.""" + column + """
+                                         FROM before
+                                         INNER JOIN after
+                                         ON after.bg_id = before.bg_id
+                                         LEFT JOIN boardgames
+                                         ON boardgames.id = after.bg_id
+                                         WHERE before.""" + column + """ IS NOT NULL
+                                         AND after.""" + column + """ IS NOT NULL
+                                         ORDER BY abs(after.""" + column +\
+                                                    """ - before.""" + column +\
+                                                    """) DESC, after.bg_id
+                                         LIMIT %s;""",
+                                      (str(date_from), str(date_to), int(top)),
+                                      db=db)
+
+    except:
+
+        print "Failed to SELECT from table"
+
+        return
+
+    return [[bg_id, name, before, after, after - before]
+            for bg_id, name, before, after in rows]
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+
+        record_snapshot(csv_file_name=sys.argv[1])
+
+    else:
+
+        install_rating_history()
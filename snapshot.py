@@ -0,0 +1,442 @@
+'''
+Frozen, point-in-time copies of the scraped catalog that can be analyzed
+without a running database.
+
+A snapshot is a directory of plain .npy files plus a manifest:
+
+    manifest.json           format version, when it was taken, a label,
+                            the number of games and an md5 of every file
+    <column>.npy            one per numeric boardgames column (float, NaN
+                            for NULL), rows in rank order
+    name.codes.npy,         text columns, as codes into the string
+    href.codes.npy          dictionary (-1 for NULL)
+    <column>.items.npy      for each of the six text array columns, the
+    <column>.indptr.npy     CSR item index of game_store.GameStore (the
+    <column>.game_rows.npy  items as string dictionary codes); these are
+                            the link tables from normalize_database.py
+    strings.npy             string dictionary: every distinct string once,
+    string_offsets.npy      utf-8 bytes back to back, string i is
+                            strings[offsets[i]:offsets[i+1]]
+
+load_snapshot() memory-maps the arrays (nothing is read until it is
+used) and hands back a GameStore, so it plugs straight into
+data_analysis.use_game_store(). Text stays as codes too: a string is only
+decoded from the memory-mapped dictionary when something looks at it, eg.
+the names of the items count_column() returns, and the first item lookup
+in a column decodes that column's items. Since BGG's ratings keep drifting, a
+snapshot is also the way to keep the exact dataset an analysis was run on.
+
+$ python snapshot.py export snapshots/2016-06 "June 2016 scrape"
+$ python snapshot.py info snapshots/2016-06
+$ python snapshot.py verify snapshots/2016-06
+'''
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from game_store import GameStore, ItemIndex, NUMERIC_COLUMNS, TEXT_COLUMNS,\
+                       LINK_COLUMNS
+
+# Bumped whenever the layout changes; older readers refuse newer snapshots
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def export_snapshot(directory, label=None, db=None):
+    '''
+    Take a snapshot of the boardgames table
+
+    directory : Where the snapshot is written (made if it doesn't exist)
+                (Type: String)
+
+    label     : Free text kept in the manifest, eg. "June 2016 scrape"
+                (Type: String)
+
+    db        : database to read from, query_executor's database if not
+                given
+
+    Returns the manifest
+    '''
+
+    return save_snapshot(GameStore.from_database(db), directory, label)
+
+
+def save_snapshot(store, directory, label=None):
+    '''
+    Write a GameStore to a snapshot directory, see export_snapshot()
+
+    The manifest is written last, so a snapshot that was interrupted
+    half way can't be loaded.
+    '''
+
+    start_time = time.time()
+
+    if not os.path.isdir(directory):
+
+        os.makedirs(directory)
+
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+
+    if os.path.exists(manifest_path):
+
+        os.remove(manifest_path)
+
+    strings = {}
+
+    arrays = {}
+
+    for name in NUMERIC_COLUMNS:
+
+        arrays[name] = np.asarray(store.columns[name], dtype=np.float64)
+
+    for name in TEXT_COLUMNS:
+
+        arrays[name + '.codes'] = _string_codes(store.columns[name], strings)
+
+    for column in LINK_COLUMNS:
+
+        index = store.links[column]
+
+        arrays[column + '.items'] = _string_codes(index.items, strings)
+
+        arrays[column + '.indptr'] = np.asarray(index.indptr, dtype=np.int64)
+
+        arrays[column + '.game_rows'] = np.asarray(index.game_rows,
+                                                   dtype=np.int64)
+
+    # Dictionary order is the order the strings were first seen in
+    ordered = [None] * len(strings)
+
+    for string, code in strings.items():
+
+        ordered[code] = string
+
+    offsets = np.zeros(len(ordered) + 1, dtype=np.int64)
+
+    offsets[1:] = np.cumsum([len(string) for string in ordered])
+
+    arrays['strings'] = np.frombuffer(''.join(ordered), dtype=np.uint8)
+
+    arrays['string_offsets'] = offsets
+
+    files = {}
+
+    for name, array in arrays.items():
+
+        file_name = name + '.npy'
+
+        np.save(os.path.join(directory, file_name), array)
+
+        files[file_name] = _md5(os.path.join(directory, file_name))
+
+    manifest = {'format_version': FORMAT_VERSION,
+                'created'       : time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                time.gmtime()),
+                'label'         : label,
+                'num_games'     : store.num_games,
+                'num_strings'   : len(ordered),
+                'files'         : files}
+
+    with open(manifest_path, 'w') as manifest_file:
+
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    print "Saved snapshot of", store.num_games, "games to", directory, "in",\
+          time.time() - start_time, "seconds"
+
+    return manifest
+
+
+def load_snapshot(directory, mmap=True):
+    '''
+    Open a snapshot as a GameStore
+
+    directory : A directory written by export_snapshot()
+                (Type: String)
+
+    mmap      : Memory-map the arrays (read only) instead of reading them
+                into memory
+                (Type: bool)
+
+    Returns the GameStore, or None if the directory isn't a snapshot this
+    version can read
+    '''
+
+    manifest = read_manifest(directory)
+
+    if manifest is None:
+
+        return
+
+    mmap_mode = 'r' if mmap else None
+
+    def array(name):
+
+        return np.load(os.path.join(directory, name + '.npy'),
+                       mmap_mode=mmap_mode)
+
+    strings = StringDictionary(array('strings'), array('string_offsets'))
+
+    columns = {}
+
+    for name in NUMERIC_COLUMNS:
+
+        columns[name] = array(name)
+
+    for name in TEXT_COLUMNS:
+
+        columns[name] = StringColumn(array(name + '.codes'), strings)
+
+    links = {}
+
+    for column in LINK_COLUMNS:
+
+        links[column] = ItemIndex(StringColumn(array(column + '.items'),
+                                               strings),
+                                  array(column + '.indptr'),
+                                  array(column + '.game_rows'))
+
+    return GameStore(columns, links)
+
+
+class StringDictionary(object):
+    '''
+    The string dictionary of a snapshot, decoding strings one at a time as
+    they are asked for (and keeping them)
+
+    data    : utf-8 bytes of every string back to back
+              (Type: numpy uint8 array, usually memory-mapped)
+
+    offsets : string i is data[offsets[i]:offsets[i+1]]
+              (Type: numpy int64 array)
+    '''
+
+    def __init__(self, data, offsets):
+
+        self.data = data
+
+        self.offsets = offsets
+
+        # code -> str, for the ones decoded so far
+        self._decoded = {}
+
+    def __len__(self):
+
+        return len(self.offsets) - 1
+
+    def decode(self, code):
+        '''
+        String with a code, None for -1 (NULL)
+        '''
+
+        if code < 0:
+
+            return None
+
+        string = self._decoded.get(code)
+
+        if string is None:
+
+            string = self.data[self.offsets[code]:self.offsets[code+1]]\
+                         .tostring()
+
+            self._decoded[code] = string
+
+        return string
+
+    def decode_all(self, codes):
+        '''
+        Object array of the strings with some codes
+        '''
+
+        strings = np.empty(len(codes), dtype=object)
+
+        for i, code in enumerate(np.asarray(codes).tolist()):
+
+            strings[i] = self.decode(code)
+
+        return strings
+
+
+class StringColumn(object):
+    '''
+    Text values kept as codes into a StringDictionary, standing in for the
+    object arrays of a GameStore. Indexing (with an int, a slice, rows or a
+    mask) only decodes the values it picks out.
+    '''
+
+    def __init__(self, codes, strings):
+
+        self.codes = codes
+
+        self.strings = strings
+
+    def __len__(self):
+
+        return len(self.codes)
+
+    def __getitem__(self, key):
+
+        codes = self.codes[key]
+
+        if np.ndim(codes) == 0:
+
+            return self.strings.decode(int(codes))
+
+        return self.strings.decode_all(codes)
+
+    def __iter__(self):
+
+        return iter(self.strings.decode_all(self.codes))
+
+    def __array__(self, dtype=None):
+
+        strings = self.strings.decode_all(self.codes)
+
+        return strings if dtype is None else strings.astype(dtype)
+
+    def tolist(self):
+
+        return self.strings.decode_all(self.codes).tolist()
+
+
+def read_manifest(directory):
+    '''
+    The manifest of a snapshot, or None (after printing why) if there isn't
+    a readable one
+    '''
+
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_path):
+
+        print "\nNo snapshot in", directory, "(missing " + MANIFEST_FILE + ")"
+
+        return
+
+    with open(manifest_path) as manifest_file:
+
+        manifest = json.load(manifest_file)
+
+    if manifest.get('format_version') > FORMAT_VERSION:
+
+        print "\nSnapshot in", directory, "has format version",\
+              manifest.get('format_version'), "but only versions up to",\
+              FORMAT_VERSION, "can be read"
+
+        return
+
+    return manifest
+
+
+def verify_snapshot(directory):
+    '''
+    Check every file of a snapshot against the md5 in its manifest
+
+    Returns True if they all match
+    '''
+
+    manifest = read_manifest(directory)
+
+    if manifest is None:
+
+        return False
+
+    ok = True
+
+    for file_name, md5 in sorted(manifest['files'].items()):
+
+        file_path = os.path.join(directory, file_name)
+
+        if not os.path.exists(file_path):
+
+            print "Missing", file_name
+
+            ok = False
+
+        elif _md5(file_path) != md5:
+
+            print "Changed", file_name
+
+            ok = False
+
+    return ok
+
+
+def _string_codes(values, strings):
+    '''
+    Codes of values in the string dictionary (strings, string -> code),
+    adding the ones it doesn't have yet. None gets -1.
+    '''
+
+    codes = np.empty(len(values), dtype=np.int32)
+
+    for i, value in enumerate(values):
+
+        if value is None:
+
+            codes[i] = -1
+
+            continue
+
+        if isinstance(value, unicode):
+
+            value = value.encode('utf-8')
+
+        codes[i] = strings.setdefault(value, len(strings))
+
+    return codes
+
+
+def _md5(file_path):
+
+    md5 = hashlib.md5()
+
+    with open(file_path, 'rb') as f:
+
+        for block in iter(lambda: f.read(1 << 20), ''):
+
+            md5.update(block)
+
+    return md5.hexdigest()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'info', 'verify'):
+
+        print "Usage: python snapshot.py export DIRECTORY [LABEL]"
+        print "       python snapshot.py info DIRECTORY"
+        print "       python snapshot.py verify DIRECTORY"
+
+        sys.exit(1)
+
+    command, directory = sys.argv[1], sys.argv[2]
+
+    if command == 'export':
+
+        export_snapshot(directory, sys.argv[3] if len(sys.argv) > 3 else None)
+
+    elif command == 'info':
+
+        manifest = read_manifest(directory)
+
+        if manifest is not None:
+
+            for key in ('label', 'created', 'num_games', 'format_version'):
+
+                print '%-15s %s' % (key, manifest[key])
+
+    elif not verify_snapshot(directory):
+
+        sys.exit(1)
+
+    else:
+
+        print "Snapshot OK"